@@ -1,67 +1,240 @@
-from flask import Flask, render_template, request, jsonify
-from services.gutenberg_ebook import *
-import threading
-from services.operations import *
-
-create_database()
-app= Flask(__name__)
-books = {
-    "1234": "This is a sample text for book ID 123.",
-    "456": "Another example book with different content."
-}
-
-
-@app.route("/")
-def home():
-    return render_template("index.html")
-def get_book(book_id):
-    """Helper function to fetch book content by ID."""
-    return books.get(book_id)
-
-@app.route("/fetch_book", methods=["GET"])
-def fetch_book():
-    book_id = request.args.get("bookId")
-    contents, file_path = proccess_gutenberg(book_id)
-    insert_ebook(book_id)
-    # Run process_analysis in a background thread
-    thread = threading.Thread(target=process_analysis, args=(file_path, book_id))
-    thread.start()
-    return jsonify({"bookId": book_id, "content": contents})
-
-@app.route("/search", methods=["GET"])
-def search_book():
-    query = request.args.get("query", "").strip().lower()
-    data = search_gutenberg(query)
-    return jsonify({"content": data})
-
-@app.route("/analyze", methods=["POST"])
-def analyze_text():
-    data = request.get_json()
-    book_id = data.get("bookId")
-    analysis_type = data.get("type")
-    if analysis_type=="meta":
-        status, meta_data_raw = book_id_exists(book_id)
-        meta_data = json_to_html_table(json.loads(meta_data_raw))
-        return jsonify({"result": meta_data})
-    ifexits, record = book_id_exists_in_analysis(book_id)
-    if not book_id or not analysis_type:
-        return jsonify({"error": "Book ID and analysis type are required"}), 400
-    if ifexits:
-        result = ebook_analysis_to_html(record)
-        response = {
-            "bookId": book_id,
-            "type": analysis_type,
-            "result": f"{result}"
-        }
-        return jsonify(response)
-    else:
-        return jsonify({"result": "Ebook is not valid!"})
-
-@app.route("/get_all_ebooks", methods=["GET"])
-def get_all_books_html():
-    books_data = get_all_books()
-    print(books_data)
-    return jsonify(books_data)
-
-if __name__=="__main__":
+import re
+import time
+from flask import Flask, render_template, request, jsonify, make_response, url_for, Response, stream_with_context, g
+from werkzeug.wsgi import wrap_file
+from services.gutenberg_ebook import *
+import os
+from services.operations import *
+from services.jobs import enqueue_analysis, start_workers, job_stats
+from services.search import search_books
+from services.ingest import parse_book_ids, start_ingest, ingest_status, INGEST_MAX_IDS
+from services.llm_backends import llm_metrics
+from services.llm_cache import cache_stats
+from services.llm_json import parse_stats
+from services.progress import iter_progress_events
+from services.metrics import render_metrics, HTTP_REQUEST_SECONDS, IN_FLIGHT, trace, log
+
+create_database()
+app= Flask(__name__)
+# Under the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    start_workers()
+books = {
+    "1234": "This is a sample text for book ID 123.",
+    "456": "Another example book with different content."
+}
+
+
+TRACE_HEADER = "X-Trace-Id"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+_VALID_TRACE_ID = re.compile(r"[\w.-]{1,64}")
+
+
+def requested_trace_id(value):
+    """The caller's X-Trace-Id if it is a valid id, else None (a new one is generated)."""
+    return value if value and _VALID_TRACE_ID.fullmatch(value) else None
+
+
+def last_event_id(header, after):
+    """The last analysis event a client has seen: its Last-Event-ID header, else ?after, else -1."""
+    value = header or after or "-1"
+    return int(value) if value.lstrip("-").isdigit() else -1
+
+
+def fetched_book(book_id, contents, file_path, content_url):
+    """
+    Registers a downloaded book and queues its analysis; shared by /fetch_book here and in asgi.py.
+
+    Returns:
+    tuple: (JSON body, HTTP status).
+    """
+    if contents == "Ebook content not found" or book_file_info(book_id) is None:
+        return {"error": "Ebook content not found"}, 404
+    insert_ebook(book_id)
+    # Queue process_analysis for the worker pool (no-op if already analysed or queued)
+    job = enqueue_analysis(book_id, file_path)
+    return {**book_summary(book_id, content_url), "job": job}, 200
+
+
+@app.before_request
+def start_request_trace():
+    """Times the request and binds a trace id (the caller's X-Trace-Id if valid) for its log lines."""
+    g.started = time.perf_counter()
+    g.trace = trace(requested_trace_id(request.headers.get(TRACE_HEADER)))
+    g.trace_id = g.trace.__enter__()
+    IN_FLIGHT.inc("http_request")
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUEST_SECONDS.observe(route, request.method, response.status_code, value=time.perf_counter() - g.started)
+    response.headers[TRACE_HEADER] = g.trace_id
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    # Runs a second time for responses streamed with stream_with_context; only the first counts
+    request_trace = g.pop("trace", None)
+    if request_trace is not None:
+        IN_FLIGHT.dec("http_request")
+        request_trace.__exit__(None, None, None)
+
+@app.route("/")
+def home():
+    return render_template("index.html")
+def get_book(book_id):
+    """Helper function to fetch book content by ID."""
+    return books.get(book_id)
+
+@app.route("/fetch_book", methods=["GET"])
+def fetch_book():
+    book_id = request.args.get("bookId")
+    if not book_id or not book_id.isdigit():
+        return jsonify({"error": "A numeric Book ID is required"}), 400
+    contents, file_path = proccess_gutenberg(book_id, load_content=False)
+    body, status = fetched_book(book_id, contents, file_path, url_for("book_content", book_id=book_id))
+    return jsonify(body), status
+
+@app.route("/books/<book_id>/content", methods=["GET"])
+def book_content(book_id):
+    """
+    Serves a book's text from the content store (or uploads/) without building it in memory.
+
+    Without ?page the whole text is streamed with ETag/Last-Modified and HTTP Range (206) support;
+    a range only inflates the compressed frames it covers.
+    With ?page=N (and optional page_size in bytes) one line-aligned page is returned, along with
+    X-Page/X-Total-Pages headers.
+    """
+    if not book_id.isdigit():
+        return jsonify({"error": "Invalid Book ID"}), 400
+    info = book_file_info(book_id)
+    if info is None:
+        return jsonify({"error": "Ebook content not found"}), 404
+    size, mtime = info
+
+    page = request.args.get("page", type=int)
+    if page is None:
+        response = Response(
+            wrap_file(request.environ, open_book_file(book_id)), mimetype="text/plain", direct_passthrough=True
+        )
+        response.set_etag(f"{int(mtime * 1e9):x}-{size:x}")
+        response.last_modified = mtime
+        response.cache_control.no_cache = True
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+    page_size = min(max(request.args.get("page_size", CONTENT_PAGE_SIZE, type=int), 1024), 1024 * 1024)
+    response = make_response()
+    response.set_etag(f"{int(mtime * 1e9):x}-{size:x}-{page}-{page_size}")
+    response.last_modified = mtime
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    text, total_pages = read_txt_page(book_id, page, page_size)
+    response.set_data(text)
+    response.mimetype = "text/plain"
+    response.headers["X-Page"] = str(page)
+    response.headers["X-Total-Pages"] = str(total_pages)
+    return response
+
+@app.route("/books/<book_id>/analysis/events", methods=["GET"])
+def analysis_events(book_id):
+    """Server-Sent Events stream of analysis stages and per-chunk partial results (see services.progress)."""
+    if not book_id.isdigit():
+        return jsonify({"error": "A numeric Book ID is required"}), 400
+    after = last_event_id(request.headers.get("Last-Event-ID"), request.args.get("after"))
+    return Response(
+        stream_with_context(iter_progress_events(book_id, after)), mimetype="text/event-stream", headers=SSE_HEADERS
+    )
+
+@app.route("/search", methods=["GET"])
+def search_book():
+    query = request.args.get("query", "").strip().lower()
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 10, type=int)
+    results = search_books(query, page=page, per_page=per_page)
+    # A bare book ID that is already downloaded resolves to that book
+    if query.isdigit() and book_exists(query):
+        results["book"] = book_summary(query, url_for("book_content", book_id=query))
+    return jsonify(results)
+
+@app.route("/analyze", methods=["GET", "POST"])
+def analyze_text():
+    """
+    Rendered LLM analysis ("analysis"), metadata ("meta") or local text statistics ("stats") of a
+    book, from the fragment cache.
+
+    POST takes a JSON body {"bookId", "type", "format"}; GET takes the same query parameters and
+    answers If-None-Match revalidations with 304. format=json returns the data instead of HTML.
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+    book_id = str(data.get("bookId") or "")
+    analysis_type = data.get("type")
+    if not book_id or not analysis_type:
+        return jsonify({"error": "Book ID and analysis type are required"}), 400
+    if not book_id.isdigit():
+        return jsonify({"error": "A numeric Book ID is required"}), 400
+    kind = analysis_type if analysis_type in ("meta", "stats") else "analysis"
+    if kind == "stats":
+        # Computed on first request so the ETag below already carries the stored version
+        book_text_stats(book_id)
+    fmt = "json" if data.get("format") == "json" else "html"
+
+    # The ETag only needs the row version, so a revalidation never renders anything
+    version = get_render_version(book_id, kind)
+    etag = f"{kind}-{book_id}-{version}-{fmt}"
+    if request.method == "GET" and request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        result = render_fragment(book_id, kind, fmt, version)
+        if result is None:
+            response = jsonify({"result": "Ebook is not valid!"})
+        else:
+            response = jsonify({"bookId": book_id, "type": analysis_type, "result": result})
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/ingest", methods=["POST"])
+def ingest():
+    """Starts a background bulk ingestion: {"book_ids": "1-500,1342" or [...], "analyze": false}."""
+    data = request.get_json(silent=True) or {}
+    try:
+        book_ids = parse_book_ids(data.get("book_ids", ""), max_ids=INGEST_MAX_IDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not book_ids:
+        return jsonify({"error": "book_ids is required"}), 400
+    run_id = start_ingest(book_ids, analyze=bool(data.get("analyze")))
+    return jsonify({"ingestId": run_id, "total": len(book_ids), "statusUrl": url_for("ingest_progress", run_id=run_id)}), 202
+
+@app.route("/ingest", methods=["GET"])
+@app.route("/ingest/<run_id>", methods=["GET"])
+def ingest_progress(run_id=None):
+    status = ingest_status(run_id)
+    if status is None:
+        return jsonify({"error": "Unknown ingest run"}), 404
+    return jsonify(status)
+
+@app.route("/jobs", methods=["GET"])
+def jobs_status():
+    return jsonify(job_stats())
+
+@app.route("/llm", methods=["GET"])
+def llm_status():
+    """Per-stage LLM backend, model, call/token/latency counters, response parsing and llm_cache hit rates."""
+    return jsonify({"backends": llm_metrics(), "parsing": parse_stats(), "cache": cache_stats()})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: request, pipeline stage, LLM, SQLite and queue metrics of this process."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/get_all_ebooks", methods=["GET"])
+def get_all_books_html():
+    books_data = get_all_books()
+    log("Listed all ebooks", books=len(books_data))
+    return jsonify(books_data)
+
+if __name__=="__main__":
     app.run(debug=True, port=5005, host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from app import app as flask_app, fetched_book, last_event_id, requested_trace_id, SSE_HEADERS, TRACE_HEADER
+from services.gutenberg_ebook import proccess_gutenberg_async
+from services.progress import aiter_progress_events
+from services.metrics import HTTP_REQUEST_SECONDS, IN_FLIGHT, trace
+from services.aio import run_sync, close_async_http_client
+
+# ASGI serving mode: the Flask app of app.py behind asgiref's WSGI adapter, so every route,
+# hook and error handler is the same code in both modes. Each Flask request runs in its own
+# thread (a ThreadSensitiveContext per request, otherwise asgiref runs them all on one thread).
+# The two routes that wait on upstream I/O or on analysis progress are served natively here so
+# they hold no thread while waiting: /fetch_book downloads through httpx on the event loop and
+# the analysis event stream waits on asyncio events. Serve it with `python -m services.serve`
+# (uvicorn worker processes), which also recovers interrupted analysis jobs once for all of them.
+_flask = WsgiToAsgi(flask_app)
+_async_routes = Map([
+    Rule("/fetch_book", endpoint="fetch_book", methods=["GET"]),
+    Rule("/books/<book_id>/analysis/events", endpoint="analysis_events", methods=["GET"]),
+])
+
+
+def _host(scope, headers):
+    if "host" in headers:
+        return headers["host"]
+    server = scope.get("server") or ("localhost", None)
+    return server[0] if server[1] is None else f"{server[0]}:{server[1]}"
+
+
+async def _send_json(send, data, status, headers):
+    body = json.dumps(data).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": headers + [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_stream(send, receive, chunks, headers):
+    """Sends the chunks of an async iterator as they come; stops when the client disconnects."""
+    async def stream():
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    streaming = asyncio.ensure_future(stream())
+    disconnect = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        done, pending = await asyncio.wait((streaming, disconnect), return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if streaming in done:
+            streaming.result()
+    finally:
+        await chunks.aclose()
+
+
+async def fetch_book(scope, receive, send, args, headers, response_headers):
+    book_id = args.get("bookId")
+    if not book_id or not book_id.isdigit():
+        await _send_json(send, {"error": "A numeric Book ID is required"}, 400, response_headers)
+        return 400
+    contents, file_path = await proccess_gutenberg_async(book_id)
+    # The same URL url_for builds in app.py
+    content_url = flask_app.url_map.bind(
+        _host(scope, headers), script_name=scope.get("root_path") or "/", url_scheme=scope.get("scheme", "http")
+    ).build("book_content", {"book_id": book_id})
+    body, status = await run_sync(fetched_book, book_id, contents, file_path, content_url)
+    await _send_json(send, body, status, response_headers)
+    return status
+
+
+async def analysis_events(scope, receive, send, args, headers, response_headers, book_id):
+    """Server-Sent Events stream of analysis stages and per-chunk partial results (see services.progress)."""
+    if not book_id.isdigit():
+        await _send_json(send, {"error": "A numeric Book ID is required"}, 400, response_headers)
+        return 400
+    after = last_event_id(headers.get("last-event-id"), args.get("after"))
+    response_headers = response_headers + [(b"content-type", b"text/event-stream; charset=utf-8")] + [
+        (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in SSE_HEADERS.items()
+    ]
+    await _send_stream(send, receive, aiter_progress_events(book_id, after), response_headers)
+    return 200
+
+
+async def _serve_async_route(scope, receive, send, headers, rule, values):
+    """Runs a native route with the trace id, in-flight gauge and request timing of app.py's hooks."""
+    args = {name: found[0] for name, found in parse_qs(scope["query_string"].decode("latin-1")).items()}
+    started = time.perf_counter()
+    with trace(requested_trace_id(headers.get(TRACE_HEADER.lower()))) as trace_id, IN_FLIGHT.track("http_request"):
+        response_headers = [(TRACE_HEADER.lower().encode("latin-1"), trace_id.encode("latin-1"))]
+        handler = _async_handlers[rule.endpoint]
+        status = await handler(scope, receive, send, args, headers, response_headers, **values)
+        HTTP_REQUEST_SECONDS.observe(rule.rule, scope["method"], status, value=time.perf_counter() - started)
+
+
+_async_handlers = {"fetch_book": fetch_book, "analysis_events": analysis_events}
+
+
+async def _lifespan(receive, send):
+    # Analysis workers are started when app.py is imported, as under the Flask server
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_http_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if scope["method"] == "GET":
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        try:
+            rule, values = _async_routes.bind(_host(scope, headers)).match(scope["path"], "GET", return_rule=True)
+        except HTTPException:
+            # Anything else, including slash redirects, is answered by Flask from the request's own host
+            pass
+        else:
+            await _serve_async_route(scope, receive, send, headers, rule, values)
+            return
+    async with ThreadSensitiveContext():
+        await _flask(scope, receive, send)
@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from .downloader import HTTP_POOL_SIZE, HTTP_TIMEOUT
+
+# Helpers for the ASGI serving mode (asgi.py): a bounded thread pool for the blocking parts of
+# the pipeline (SQLite, file and CPU work) and a shared non-blocking HTTP client per event loop.
+ASYNC_THREADS = int(os.getenv("ASYNC_THREADS", "32"))
+# Upstream connections an event loop may hold open at once; requests beyond this wait for a slot
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "100"))
+
+_executor = None
+_clients = {}  # event loop -> httpx.AsyncClient
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=ASYNC_THREADS, thread_name_prefix="async-io")
+    return _executor
+
+
+async def run_sync(function, *args, **kwargs):
+    """
+    Runs a blocking call in the ASYNC_THREADS pool without blocking the event loop.
+
+    The caller's context (trace id, book id) is copied into the worker thread.
+    """
+    call = functools.partial(contextvars.copy_context().run, function, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+def get_async_http_client():
+    """
+    Returns the httpx.AsyncClient of the running event loop, creating it on first use.
+
+    Like get_http_session it keeps connections alive per host and follows redirects; at most
+    ASYNC_HTTP_MAX_CONNECTIONS requests are in flight at once.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        connect, read = HTTP_TIMEOUT
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_POOL_SIZE),
+            follow_redirects=True,
+            headers={"User-Agent": "project-llm/1.0 (+https://github.com/aisanjeev/project-llm)"},
+            transport=httpx.AsyncHTTPTransport(retries=2),  # connection errors only, like get_http_session
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_async_http_client():
+    """Closes the running loop's client (ASGI lifespan shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def single_flight(calls):
+    """
+    Decorator for coroutine functions whose first argument identifies the work (e.g. a book id):
+    concurrent calls with the same key share one run instead of repeating it.
+
+    Parameters:
+    calls (dict): Running calls by key; one per decorated function, used from a single event loop.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        async def run(key, *args, **kwargs):
+            task = calls.get(key)
+            if task is None:
+                task = asyncio.ensure_future(function(key, *args, **kwargs))
+                calls[key] = task
+                task.add_done_callback(lambda _: calls.pop(key, None))
+            # A cancelled waiter (client went away) must not cancel the shared run
+            return await asyncio.shield(task)
+        return run
+    return decorate
@@ -0,0 +1,352 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Benchmarks run in a scratch directory with their own database.db, uploads/ and store/, so the
+# services modules (which read their paths and settings at import time) are only imported once
+# the environment below is in place.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS_DIR = os.path.join(REPO_DIR, "benchmark-results")
+REGRESSION_THRESHOLD = 0.10   # 10% slower than the baseline is flagged
+MIN_REGRESSION_SECONDS = 0.0005  # ignore differences below timer noise
+
+
+def measure(function, repeat):
+    """Runs `function` `repeat` times; returns {"value": median seconds, "min", "runs"}."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return {"value": statistics.median(times), "min": min(times), "runs": repeat}
+
+
+def synthetic_text(corpus_texts, size, seed=0):
+    """
+    A deterministic multi-MB Gutenberg-style text: paragraphs drawn from the real corpus, a
+    chapter heading every 40 paragraphs, wrapped in the usual START/END licence markers.
+    """
+    paragraphs = [p for text in corpus_texts for p in text.split("\n\n") if len(p) > 200]
+    rng = random.Random(seed)
+    parts = ["*** START OF THE PROJECT GUTENBERG EBOOK SYNTHETIC ***\n\n"]
+    length, chapter = 0, 0
+    while length < size:
+        if length == 0 or rng.random() < 1 / 40:
+            chapter += 1
+            parts.append(f"CHAPTER {chapter}\n\n")
+        paragraph = rng.choice(paragraphs)
+        parts.append(paragraph + "\n\n")
+        length += len(paragraph) + 2
+    parts.append("*** END OF THE PROJECT GUTENBERG EBOOK SYNTHETIC ***\n")
+    return "".join(parts)
+
+
+def prepare_workdir(workdir, synthetic_sizes):
+    """Copies uploads/*.txt into the scratch directory and adds synthetic books (ids 900000+)."""
+    uploads = os.path.join(workdir, "uploads")
+    os.makedirs(uploads, exist_ok=True)
+    corpus = {}
+    for name in sorted(os.listdir(os.path.join(REPO_DIR, "uploads"))):
+        if name.endswith(".txt"):
+            shutil.copy(os.path.join(REPO_DIR, "uploads", name), uploads)
+            with open(os.path.join(uploads, name), "r", encoding="utf-8") as file:
+                corpus[name[:-4]] = file.read()
+    for number, size_mb in enumerate(synthetic_sizes):
+        book_id = str(900000 + number)
+        text = synthetic_text(list(corpus.values()), int(size_mb * 1024 * 1024), seed=number)
+        with open(os.path.join(uploads, f"{book_id}.txt"), "w", encoding="utf-8") as file:
+            file.write(text)
+        corpus[book_id] = text
+    return corpus
+
+
+def bench_functions(corpus, repeat):
+    """Pure-Python pipeline pieces: chunking, selection, normalisation, statistics and merging."""
+    from services.operations import (
+        chunk_text, iter_chunk_spans, select_chunks, sample_chunks, merge_responses, parse_analysis_responses,
+    )
+    from services.normalize import normalize_text
+    from services.text_stats import compute_text_stats
+    from services.llm_json import parse_json_response
+
+    results = {}
+    for book_id, text in corpus.items():
+        results[f"chunk_text.{book_id}"] = measure(lambda: chunk_text(text, 5000), repeat)
+        results[f"normalize_text.{book_id}"] = measure(lambda: normalize_text(text), repeat)
+        results[f"text_stats.{book_id}"] = measure(lambda: compute_text_stats(text), repeat)
+    largest = max(corpus.values(), key=len)
+    spans = list(iter_chunk_spans(largest, 5000))
+    results["select_chunks"] = measure(lambda: [select_chunks(spans, 10, seed=str(i)) for i in range(100)], repeat)
+    results["sample_chunks"] = measure(lambda: sample_chunks(largest, 10, seed="1"), repeat)
+
+    rng = random.Random(0)
+    words = largest.split()[:5000]
+    responses = [
+        "```json\n" + json.dumps({
+            "summary": " ".join(rng.choice(words) for _ in range(80)),
+            "sentiment": rng.choice(["positive", "negative", "neutral"]),
+            "language": "English",
+            "key_characters": [rng.choice(words) for _ in range(5)],
+            "themes": [rng.choice(words) for _ in range(5)],
+        }) + "\n```"
+        for _ in range(200)
+    ]
+    results["parse_json_response.200"] = measure(lambda: [parse_json_response(r) for r in responses], repeat)
+    results["merge_responses.200"] = measure(lambda: merge_responses(responses), repeat)
+    results["parse_analysis_responses.200"] = measure(lambda: parse_analysis_responses(responses), repeat)
+    return results
+
+
+def bench_database(corpus, repeat):
+    """SQLite helpers on the hot request paths."""
+    from services.operations import insert_ebook_data, get_book_record, book_id_exists_in_analysis, get_all_books
+    book_ids = list(corpus)
+
+    def insert_all():
+        for book_id in book_ids:
+            insert_ebook_data(book_id, {"Title": f"Book {book_id}", "Author": "Benchmark", "Language": "English"},
+                              txt_path=f"uploads/{book_id}.txt")
+
+    results = {"db.insert_ebook_data": measure(insert_all, repeat)}
+    results["db.get_book_record.1000"] = measure(
+        lambda: [get_book_record(book_ids[i % len(book_ids)]) for i in range(1000)], repeat
+    )
+    results["db.book_id_exists_in_analysis.1000"] = measure(
+        lambda: [book_id_exists_in_analysis(book_ids[i % len(book_ids)]) for i in range(1000)], repeat
+    )
+    results["db.get_all_books.100"] = measure(lambda: [get_all_books() for _ in range(100)], repeat)
+    return results
+
+
+def bench_content_store(corpus, repeat):
+    from services import content_store
+    from services.operations import read_txt_page
+    results = {}
+    book_id = max(corpus, key=lambda key: len(corpus[key]))
+    source = os.path.join("uploads", f"{book_id}.txt")
+    results["store.write_book"] = measure(lambda: content_store.write_book(book_id, source), repeat)
+    results["store.read_book"] = measure(lambda: content_store.read_book(book_id), repeat)
+    results["store.read_txt_page.100"] = measure(lambda: [read_txt_page(book_id, page, 65536) for page in range(1, 101)], repeat)
+    return results
+
+
+def _reset_analysis():
+    from services.db import connection
+    with connection() as conn:
+        for table in ("ebook_analysis", "text_stats", "book_texts", "analysis_checkpoints", "llm_cache",
+                      "edition_signatures", "edition_bands", "chunk_analyses", "analysis_sources"):
+            conn.execute(f"DELETE FROM {table}")
+
+
+def bench_analysis(corpus, repeat, modes):
+    """
+    process_analysis of every corpus book against the stub LLM, from a cold start (no cached
+    LLM responses, statistics or cleaned copies). Reports total seconds per stage and mode.
+    """
+    from services.gutenberg_ebook import process_analysis
+    results = {}
+    for mode in modes:
+        runs = []
+        for _ in range(repeat):
+            _reset_analysis()
+            totals = {}
+            for book_id in corpus:
+                timings = {}
+                started = time.perf_counter()
+                process_analysis(None, book_id, timings=timings, mode=mode)
+                timings["total"] = time.perf_counter() - started
+                for stage, seconds in timings.items():
+                    totals[stage] = totals.get(stage, 0.0) + seconds
+            runs.append(totals)
+        for stage in runs[0]:
+            values = [run.get(stage, 0.0) for run in runs]
+            results[f"analysis.{mode}.{stage}"] = {"value": statistics.median(values), "min": min(values), "runs": repeat}
+    return results
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def load_test(app, book_ids, requests_per_endpoint, concurrency):
+    """Serves the app on a local port and hits each endpoint with `concurrency` parallel clients."""
+    import logging
+    import requests
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log line per request
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.port}"
+    endpoints = {
+        "/fetch_book": lambda i: ("GET", f"{base}/fetch_book?bookId={book_ids[i % len(book_ids)]}", None),
+        "/analyze": lambda i: ("GET", f"{base}/analyze?bookId={book_ids[i % len(book_ids)]}&type=analysis", None),
+        "/analyze (POST)": lambda i: ("POST", f"{base}/analyze", {"bookId": book_ids[i % len(book_ids)], "type": "meta"}),
+        "/get_all_ebooks": lambda i: ("GET", f"{base}/get_all_ebooks", None),
+    }
+    results = {}
+    sessions = threading.local()
+    try:
+        for name, make_request in endpoints.items():
+            def call(i):
+                session = getattr(sessions, "session", None)
+                if session is None:
+                    session = sessions.session = requests.Session()
+                method, url, body = make_request(i)
+                started = time.perf_counter()
+                try:
+                    ok = session.request(method, url, json=body, timeout=30).status_code < 400
+                except requests.RequestException:
+                    ok = False
+                return time.perf_counter() - started, ok
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outcomes = list(executor.map(call, range(requests_per_endpoint)))
+            elapsed = time.perf_counter() - started
+            latencies = [latency for latency, _ in outcomes]
+            results[f"load.{name}"] = {
+                "value": statistics.median(latencies),
+                "p95": _percentile(latencies, 0.95),
+                "p99": _percentile(latencies, 0.99),
+                "rps": len(outcomes) / elapsed,
+                "errors": sum(1 for _, ok in outcomes if not ok),
+                "runs": len(outcomes),
+            }
+    finally:
+        server.shutdown()
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares two result sets metric by metric (lower "value" is better).
+
+    Returns:
+    list: (name, baseline value, new value, relative change, regressed) for every shared metric.
+    """
+    rows = []
+    for name, entry in sorted(results.items()):
+        old = baseline.get(name)
+        if not old or not old.get("value"):
+            continue
+        change = entry["value"] / old["value"] - 1
+        regressed = change > threshold and entry["value"] - old["value"] > MIN_REGRESSION_SECONDS
+        rows.append((name, old["value"], entry["value"], change, regressed))
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the ingestion and analysis pipeline offline.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (the median is reported)")
+    parser.add_argument("--synthetic-mb", default="2,8", help="Sizes of the synthetic books in MB, comma separated")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM sleeps per call")
+    parser.add_argument("--modes", default="sample,full", help="process_analysis modes to time")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint in the load test")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel clients in the load test")
+    parser.add_argument("--only", help="Comma separated groups: functions,database,store,analysis,load")
+    parser.add_argument("--output", help="Result file (default benchmark-results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Baseline result file; regressions make the exit status 1")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Relative slowdown flagged as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    groups = args.only.split(",") if args.only else ["functions", "database", "store", "analysis", "load"]
+    sizes = [float(size) for size in args.synthetic_mb.split(",") if size]
+    output = os.path.abspath(args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json"
+    ))
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix="project-llm-bench-")
+    os.chdir(workdir)
+    os.environ.update({
+        "LLM_BACKEND": "stub",
+        "STUB_LLM_LATENCY": str(args.llm_latency),
+        "LLM_RPM_LIMIT": "1000000",
+        "ANALYSIS_WORKERS": "0",
+        "METADATA_OFFLINE": "1",
+    })
+    sys.path.insert(0, REPO_DIR)
+    corpus = prepare_workdir(workdir, sizes)
+
+    from services.operations import create_database
+    log_path = os.path.join(workdir, "pipeline.log")
+    results = {}
+    with open(log_path, "w") as log, contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(log))
+        create_database()
+        steps = [
+            ("functions", lambda: bench_functions(corpus, args.repeat)),
+            ("database", lambda: bench_database(corpus, args.repeat)),
+            ("store", lambda: bench_content_store(corpus, args.repeat)),
+            ("analysis", lambda: bench_analysis(corpus, args.repeat, args.modes.split(","))),
+        ]
+        for group, step in steps:
+            if group in groups:
+                print(f"Running {group} benchmarks", file=sys.stderr)
+                results.update(step())
+        if "load" in groups:
+            print("Running load test", file=sys.stderr)
+            bench_database(corpus, 1)  # the endpoints need ebooks rows
+            if "analysis" not in groups:
+                bench_analysis(corpus, 1, ["sample"])
+            from app import app
+            results.update(load_test(app, list(corpus), args.requests, args.concurrency))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": {book_id: len(text) for book_id, text in corpus.items()},
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    for name, entry in sorted(results.items()):
+        extra = f"  p95 {entry['p95'] * 1000:8.2f} ms  {entry['rps']:8.1f} req/s  errors {entry['errors']}" if "rps" in entry else ""
+        print(f"{name:45s} {entry['value'] * 1000:10.2f} ms{extra}")
+    print(f"Results saved to {output}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        rows = compare(results, baseline, args.threshold)
+        for name, old, new, change, regressed in rows:
+            print(f"{'REGRESSION' if regressed else 'ok':10s} {name:45s} {old * 1000:10.2f} -> {new * 1000:10.2f} ms ({change:+.1%})")
+        if any(row[4] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import argparse
+import bisect
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+STORE_DIR = os.getenv("CONTENT_STORE_DIR", "store")
+CONTENT_STORE_ENABLED = os.getenv("CONTENT_STORE", "1") != "0"
+FRAME_SIZE = int(os.getenv("CONTENT_FRAME_SIZE", str(64 * 1024)))  # uncompressed bytes per frame
+COMPRESSION_LEVEL = int(os.getenv("CONTENT_COMPRESSION_LEVEL", "6"))
+INDEX_SUFFIX = ".idx"
+READER_CACHED_FRAMES = 4  # inflated frames each open reader keeps, so seeking back and forth stays cheap
+
+_indexes = {}  # index path -> (mtime_ns, index)
+_indexes_lock = threading.Lock()
+
+
+def check_book_id(book_id):
+    """
+    Returns `book_id` as a string if it is a Gutenberg id (ASCII digits only).
+
+    Every path built from a book id goes through this, so an id such as "../x" from a request
+    can never name a file outside uploads/ or STORE_DIR.
+
+    Raises:
+    ValueError: If the id is anything else.
+    """
+    book_id = str(book_id)
+    if not (book_id.isascii() and book_id.isdigit()):
+        raise ValueError(f"Invalid book id: {book_id!r}")
+    return book_id
+
+
+def book_path(book_id, variant="txt"):
+    """
+    Path of a stored book: STORE_DIR/<2 hex digits of sha1(book_id)>/<book_id>.<variant>.gz.
+
+    The shard keeps directories small for catalogues of tens of thousands of books. The file is
+    a series of independent gzip members (frames), so it is also a plain .gz file for zcat.
+    """
+    book_id = check_book_id(book_id)
+    shard = hashlib.sha1(str(book_id).encode("utf-8")).hexdigest()[:2]
+    return os.path.join(STORE_DIR, shard, f"{book_id}.{variant}.gz")
+
+
+def write_book(book_id, source, variant="txt", frame_size=None):
+    """
+    Compresses a book into the store, one gzip frame per `frame_size` uncompressed bytes.
+
+    The frame index (uncompressed offset, compressed offset and length of every frame) is
+    written next to the data as <path>.idx; both files are replaced atomically.
+
+    Parameters:
+    book_id (str): The unique identifier of the eBook.
+    source (str or bytes): Path of the file to store, or the content itself.
+    variant (str): "txt" for the downloaded text, "clean" for the normalised copy.
+    frame_size (int, optional): Defaults to FRAME_SIZE.
+
+    Returns:
+    dict: {"path", "raw_bytes", "stored_bytes", "frames"}
+    """
+    frame_size = frame_size or FRAME_SIZE
+    path = book_path(book_id, variant)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    reader = io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+    frames, raw_offset, stored_offset = [], 0, 0
+    with reader, open(path + ".part", "wb") as target:
+        for block in iter(lambda: reader.read(frame_size), b""):
+            data = gzip.compress(block, COMPRESSION_LEVEL, mtime=0)
+            target.write(data)
+            frames.append([raw_offset, stored_offset, len(data)])
+            raw_offset += len(block)
+            stored_offset += len(data)
+    index = {"size": raw_offset, "frame_size": frame_size, "frames": frames}
+    with open(path + INDEX_SUFFIX + ".part", "w", encoding="utf-8") as file:
+        json.dump(index, file)
+    os.replace(path + ".part", path)
+    os.replace(path + INDEX_SUFFIX + ".part", path + INDEX_SUFFIX)
+    return {"path": path, "raw_bytes": raw_offset, "stored_bytes": stored_offset, "frames": len(frames)}
+
+
+def load_index(book_id, variant="txt"):
+    """Frame index of a stored book (cached until the file changes), or None if it is not stored."""
+    index_path = book_path(book_id, variant) + INDEX_SUFFIX
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _indexes_lock:
+        cached = _indexes.get(index_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(index_path, "r", encoding="utf-8") as file:
+        index = json.load(file)
+    index["starts"] = [frame[0] for frame in index["frames"]]
+    with _indexes_lock:
+        _indexes[index_path] = (mtime, index)
+    return index
+
+
+def has_book(book_id, variant="txt"):
+    return load_index(book_id, variant) is not None
+
+
+def book_info(book_id, variant="txt"):
+    """(uncompressed size, mtime) of a stored book, or None."""
+    index = load_index(book_id, variant)
+    if index is None:
+        return None
+    return index["size"], os.stat(book_path(book_id, variant)).st_mtime
+
+
+class FrameReader(io.RawIOBase):
+    """
+    Seekable read-only file over a stored book that inflates only the frames a read touches.
+
+    Wrapped in io.BufferedReader by open_book, so readline(), iteration and text decoding work
+    as with a plain file.
+    """
+
+    def __init__(self, path, index):
+        self.file = open(path, "rb")
+        self.index = index
+        self.position = 0
+        self.frames = OrderedDict()  # frame number -> inflated bytes
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.index["size"]
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.position = offset
+        return offset
+
+    def _load(self, frame_number):
+        frame = self.frames.get(frame_number)
+        if frame is None:
+            _, stored_offset, stored_length = self.index["frames"][frame_number]
+            self.file.seek(stored_offset)
+            frame = gzip.decompress(self.file.read(stored_length))
+            self.frames[frame_number] = frame
+            if len(self.frames) > READER_CACHED_FRAMES:
+                self.frames.popitem(last=False)
+        else:
+            self.frames.move_to_end(frame_number)
+        return frame
+
+    def readinto(self, buffer):
+        if self.position >= self.index["size"]:
+            return 0
+        frame_number = bisect.bisect_right(self.index["starts"], self.position) - 1
+        frame = self._load(frame_number)
+        start = self.position - self.index["starts"][frame_number]
+        count = min(len(buffer), len(frame) - start)
+        buffer[:count] = frame[start:start + count]
+        self.position += count
+        return count
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def open_book(book_id, variant="txt"):
+    """Opens a stored book for binary reading, or returns None if it is not in the store."""
+    index = load_index(book_id, variant)
+    if index is None:
+        return None
+    return io.BufferedReader(FrameReader(book_path(book_id, variant), index), buffer_size=64 * 1024)
+
+
+def read_book(book_id, variant="txt"):
+    """Whole uncompressed content of a stored book as bytes (concatenated frames inflate in one call)."""
+    with open(book_path(book_id, variant), "rb") as file:
+        return gzip.decompress(file.read())
+
+
+def migrate_uploads(upload_dir="uploads", remove=False, log=print):
+    """
+    Moves the plain .txt files of `upload_dir` into the store.
+
+    Every file is compressed, read back and compared before the original is deleted (only
+    with remove=True). Files already stored with the same size are skipped.
+
+    Returns:
+    dict: {"books", "skipped", "raw_bytes", "stored_bytes"}
+    """
+    totals = {"books": 0, "skipped": 0, "raw_bytes": 0, "stored_bytes": 0}
+    for name in sorted(os.listdir(upload_dir)):
+        book_id, extension = os.path.splitext(name)
+        file_path = os.path.join(upload_dir, name)
+        if extension != ".txt" or not os.path.isfile(file_path):
+            continue
+        index = load_index(book_id)
+        if index is not None and index["size"] == os.path.getsize(file_path):
+            totals["skipped"] += 1
+        else:
+            result = write_book(book_id, file_path)
+            with open(file_path, "rb") as file:
+                if read_book(book_id) != file.read():
+                    raise IOError(f"Stored copy of book_id={book_id} does not match {file_path}")
+            totals["books"] += 1
+            totals["raw_bytes"] += result["raw_bytes"]
+            totals["stored_bytes"] += result["stored_bytes"]
+            log(f"Stored book_id={book_id}: {result['raw_bytes']} -> {result['stored_bytes']} bytes")
+        if remove:
+            os.remove(file_path)
+    return totals
+
+
+def store_stats():
+    """Number of stored files and their uncompressed and compressed sizes."""
+    stats = {"files": 0, "raw_bytes": 0, "stored_bytes": 0}
+    if not os.path.isdir(STORE_DIR):
+        return stats
+    for root, _, names in os.walk(STORE_DIR):
+        for name in names:
+            if name.endswith(".gz" + INDEX_SUFFIX):
+                with open(os.path.join(root, name), "r", encoding="utf-8") as file:
+                    index = json.load(file)
+                stats["files"] += 1
+                stats["raw_bytes"] += index["size"]
+                stats["stored_bytes"] += sum(frame[2] for frame in index["frames"])
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed content store for downloaded books.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="Compress the .txt files of uploads/ into the store")
+    migrate.add_argument("--upload-dir", default="uploads")
+    migrate.add_argument("--remove", action="store_true", help="Delete each .txt file once it is stored")
+    commands.add_parser("stats", help="Show the store size")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        print(migrate_uploads(args.upload_dir, remove=args.remove))
+    else:
+        print(store_stats())
+
+
+if __name__ == "__main__":
+    main()
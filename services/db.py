@@ -0,0 +1,150 @@
+import os
+import queue
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from .metrics import DB_QUERY_SECONDS, log
+
+# Shared SQLite access for Flask request threads and background workers.
+# Connections are pooled instead of opened per helper call, so the per-connection
+# statement cache (cached_statements) keeps every query prepared between calls.
+DATABASE_PATH = os.getenv("DATABASE_PATH", "database.db")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?|TRIGGER(?: IF EXISTS)?)\s+([A-Za-z_][\w]*)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def statement_label(sql):
+    """Metric label of a statement: its verb and first table, e.g. "SELECT ebooks"."""
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else ""
+    table = _STATEMENT_TABLE.search(sql)
+    return f"{verb} {table.group(1)}" if table and verb != "PRAGMA" else verb
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection that records every execute() in the sqlite_query_duration_seconds histogram.
+
+    execute() steps a statement to its first row, so the time covers the query's execution but
+    not fetching later rows of a large result.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(statement_label(sql), value=time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(statement_label(sql), value=time.perf_counter() - started)
+
+
+def _connect():
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # a pooled connection is used by one thread at a time
+        cached_statements=256,
+        factory=TimedConnection,
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers proceed while a writer commits; NORMAL sync is durable enough under WAL
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+@contextmanager
+def connection():
+    """
+    Borrows a pooled connection for the duration of a `with` block.
+
+    The transaction is committed when the block exits normally and rolled back on error,
+    then the connection goes back to the pool.
+
+    Yields:
+    sqlite3.Connection: A connection with row_factory set to sqlite3.Row.
+    """
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def set_database_path(path):
+    """Points the pool at another database file (used by benchmarks and scripts)."""
+    global DATABASE_PATH
+    close_all()
+    DATABASE_PATH = path
+
+
+def close_all():
+    """Closes every idle pooled connection."""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+def run_migrations(migrations):
+    """
+    Applies schema migrations newer than the database's PRAGMA user_version.
+
+    The version is read again once each migration's write lock is held, so processes starting
+    together apply every migration exactly once.
+
+    Parameters:
+    migrations (list): (version, function) pairs in ascending order. Each function receives
+                       an open connection and runs inside its own transaction together with
+                       the user_version bump, so a failed migration leaves the schema untouched.
+
+    Returns:
+    int: The schema version after migrating.
+    """
+    with connection() as conn:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, migrate in migrations:
+            if version <= current:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have migrated while this one waited for the write lock
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version <= current:
+                    conn.rollback()
+                    continue
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            log(f"Applied database migration {version}: {migrate.__doc__.strip() if migrate.__doc__ else ''}")
+            current = version
+    return current
@@ -0,0 +1,343 @@
+import asyncio
+import codecs
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")), float(os.getenv("HTTP_READ_TIMEOUT", "60")))
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Returns the process-wide requests.Session.
+
+    Keep-alive connections are pooled per host (HTTP_POOL_SIZE) and connection errors are
+    retried a couple of times before surfacing.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.5),
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = "project-llm/1.0 (+https://github.com/aisanjeev/project-llm)"
+            _session = session
+        return _session
+
+
+def _read_meta(path):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path, meta):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+
+def _validators(response):
+    return {
+        "url": response.candidate_url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def _open(session, url, headers, timeout):
+    response = session.get(url, headers=headers, stream=True, timeout=timeout)
+    if response.status_code in (200, 206, 304):
+        response.candidate_url = url  # the URL we asked for, before any redirect
+        return response
+    response.close()
+    raise requests.HTTPError(f"{response.status_code} for {url}", response=response)
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _first_success(session, candidates, timeout):
+    """
+    Opens every candidate URL in parallel (headers only) and returns the first good response.
+
+    Parameters:
+    candidates (list): (url, headers) pairs.
+
+    Returns:
+    requests.Response: The winning streamed response; the others are closed as they arrive.
+    """
+    if len(candidates) == 1:
+        url, headers = candidates[0]
+        return _open(session, url, headers, timeout)
+    errors = []
+    winner = None
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = [executor.submit(_open, session, url, headers, timeout) for url, headers in candidates]
+    try:
+        for future in as_completed(futures):
+            try:
+                winner = future.result()
+            except requests.RequestException as e:
+                errors.append(e)
+                continue
+            futures.remove(future)
+            break
+    finally:
+        # Don't wait for slower candidates; just release their connections when they finish
+        for future in futures:
+            future.add_done_callback(_close_response)
+        executor.shutdown(wait=False)
+    if winner is None:
+        raise errors[-1] if errors else requests.RequestException("No download candidates")
+    return winner
+
+
+def _ensure_utf8(path, fallback_encoding):
+    """Re-encodes a downloaded file to UTF-8 in place if it is not valid UTF-8 already."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(DOWNLOAD_BLOCK_SIZE), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        return
+    except UnicodeDecodeError:
+        pass
+    converted = path + ".utf8"
+    with open(path, "r", encoding=fallback_encoding or "latin-1", errors="replace") as source, \
+            open(converted, "w", encoding="utf-8") as target:
+        for block in iter(lambda: source.read(DOWNLOAD_BLOCK_SIZE), ""):
+            target.write(block)
+    os.replace(converted, path)
+
+
+def _plan_download(urls, file_path, have_copy):
+    """
+    Decides which requests a download starts with: a conditional GET of the previously used URL,
+    or every candidate (with a Range request for an interrupted .part download).
+
+    Returns:
+    dict: {"meta", "candidates": [(url, headers)], "part_path", "meta_path", "part_meta_path"}
+    """
+    part_path = file_path + ".part"
+    meta_path = file_path + ".meta.json"
+    part_meta_path = part_path + ".json"
+
+    if have_copy is None:
+        have_copy = os.path.exists(file_path)
+    meta = _read_meta(meta_path) if have_copy else None
+    part_meta = _read_meta(part_meta_path) if os.path.exists(part_path) else None
+    resume_from = os.path.getsize(part_path) if part_meta else 0
+
+    if meta and meta.get("url") in urls:
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        candidates = [(meta["url"], headers)]
+    else:
+        candidates = []
+        for url in urls:
+            headers = {}
+            if resume_from and part_meta.get("url") == url:
+                headers["Range"] = f"bytes={resume_from}-"
+                if part_meta.get("etag") or part_meta.get("last_modified"):
+                    headers["If-Range"] = part_meta.get("etag") or part_meta.get("last_modified")
+            candidates.append((url, headers))
+    return {
+        "meta": meta,
+        "candidates": candidates,
+        "part_path": part_path,
+        "meta_path": meta_path,
+        "part_meta_path": part_meta_path,
+    }
+
+
+def _resume_rejected(plan, error):
+    """
+    Whether a Range request for an interrupted .part download was answered with an HTTP error,
+    e.g. 416 because the .part is already complete but was never moved into place, or belongs
+    to an older version of the file.
+    """
+    resuming = any("Range" in headers for _, headers in plan["candidates"])
+    return resuming and getattr(error, "response", None) is not None
+
+
+def _discard_part(plan):
+    for path in (plan["part_path"], plan["part_meta_path"]):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _not_modified(plan, file_path):
+    size = os.path.getsize(file_path) if os.path.exists(file_path) else None
+    return {"status": "not_modified", "url": plan["meta"]["url"], "bytes": size}
+
+
+def _finish_download(plan, file_path, validators, resumed, encoding):
+    """Moves a complete .part file into place (as UTF-8) and records its validators."""
+    _ensure_utf8(plan["part_path"], encoding)
+    os.replace(plan["part_path"], file_path)
+    os.remove(plan["part_meta_path"])
+    _write_meta(plan["meta_path"], validators)
+    return {
+        "status": "resumed" if resumed else "downloaded",
+        "url": validators["url"],
+        "bytes": os.path.getsize(file_path),
+    }
+
+
+def download_file(urls, file_path, session=None, timeout=HTTP_TIMEOUT, have_copy=None):
+    """
+    Streams the first available URL to `file_path`, atomically and resumably.
+
+    - Candidate URLs are tried in parallel; the first successful response wins.
+    - The body is streamed to `<file_path>.part` and renamed into place only when complete,
+      so a failed download never clobbers an existing file.
+    - An interrupted download is resumed with a Range request (guarded by If-Range) the next time;
+      if the server rejects the range (416), the .part file is dropped and fetched again in full.
+    - When `file_path` was downloaded before, a conditional GET (If-None-Match /
+      If-Modified-Since) against the same URL skips the transfer if it has not changed.
+    - Text that is not UTF-8 is re-encoded so the rest of the app can read it as UTF-8.
+
+    Parameters:
+    urls (list): Candidate URLs, e.g. the "-0.txt" and ".txt" variants of a Gutenberg book.
+    file_path (str): Destination path.
+    session (requests.Session, optional): Defaults to the shared pooled session.
+    timeout (tuple): (connect, read) timeouts in seconds.
+    have_copy (bool, optional): Whether a previous download is kept somewhere (e.g. compressed in
+                                the content store) even if `file_path` itself is gone; enables
+                                the conditional GET. Defaults to os.path.exists(file_path).
+
+    Returns:
+    dict: {"status": "downloaded" | "resumed" | "not_modified", "url": str, "bytes": int}
+
+    Raises:
+    requests.RequestException: If no candidate could be downloaded.
+    """
+    session = session or get_http_session()
+    plan = _plan_download(urls, file_path, have_copy)
+
+    try:
+        response = _first_success(session, plan["candidates"], timeout)
+    except requests.RequestException as e:
+        if plan["meta"]:
+            # The previously used URL is gone; fall back to a fresh download from all candidates
+            os.remove(plan["meta_path"])
+            return download_file(urls, file_path, session, timeout, have_copy)
+        if _resume_rejected(plan, e):
+            # Without the .part file the retry sends no Range, so this happens at most once
+            _discard_part(plan)
+            return download_file(urls, file_path, session, timeout, have_copy)
+        raise
+
+    with response:
+        if response.status_code == 304:
+            return _not_modified(plan, file_path)
+
+        validators = _validators(response)
+        resumed = response.status_code == 206
+        _write_meta(plan["part_meta_path"], validators)
+        with open(plan["part_path"], "ab" if resumed else "wb") as file:
+            for block in response.iter_content(DOWNLOAD_BLOCK_SIZE):
+                file.write(block)
+        encoding = response.encoding
+
+    return _finish_download(plan, file_path, validators, resumed, encoding)
+
+
+async def _open_async(client, url, headers):
+    response = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+    if response.status_code in (200, 206, 304):
+        response.candidate_url = url
+        return response
+    await response.aclose()
+    raise httpx.HTTPStatusError(f"{response.status_code} for {url}", request=response.request, response=response)
+
+
+async def _first_success_async(client, candidates):
+    """Async twin of _first_success: the candidates race as tasks and the losers are closed."""
+    tasks = [asyncio.ensure_future(_open_async(client, url, headers)) for url, headers in candidates]
+    errors, winner = [], None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                winner = await next_done
+                break
+            except httpx.HTTPError as e:
+                errors.append(e)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None and task.result() is not winner:
+                await task.result().aclose()
+    if winner is None:
+        raise errors[-1] if errors else httpx.RequestError("No download candidates")
+    return winner
+
+
+async def download_file_async(urls, file_path, client=None, have_copy=None):
+    """
+    Non-blocking twin of download_file for the ASGI serving mode, with the same resumable,
+    conditional and atomic behaviour. Network I/O runs on the event loop via httpx; disk
+    writes and the final UTF-8 check run in the services.aio thread pool.
+
+    Raises:
+    httpx.HTTPError: If no candidate could be downloaded.
+    """
+    from .aio import get_async_http_client, run_sync
+
+    client = client or get_async_http_client()
+    plan = await run_sync(_plan_download, urls, file_path, have_copy)
+
+    try:
+        response = await _first_success_async(client, plan["candidates"])
+    except httpx.HTTPError as e:
+        if plan["meta"]:
+            await run_sync(os.remove, plan["meta_path"])
+            return await download_file_async(urls, file_path, client, have_copy)
+        if _resume_rejected(plan, e):
+            await run_sync(_discard_part, plan)
+            return await download_file_async(urls, file_path, client, have_copy)
+        raise
+
+    try:
+        if response.status_code == 304:
+            return await run_sync(_not_modified, plan, file_path)
+
+        validators = _validators(response)
+        resumed = response.status_code == 206
+        await run_sync(_write_meta, plan["part_meta_path"], validators)
+        file = await run_sync(open, plan["part_path"], "ab" if resumed else "wb")
+        try:
+            async for block in response.aiter_bytes(DOWNLOAD_BLOCK_SIZE):
+                await run_sync(file.write, block)
+        finally:
+            await run_sync(file.close)
+        # Like requests' response.encoding: only what the server declared
+        encoding = response.charset_encoding
+    finally:
+        await response.aclose()
+
+    return await run_sync(_finish_download, plan, file_path, validators, resumed, encoding)
@@ -0,0 +1,336 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+from .db import connection
+from .metrics import register_collector, labelled, log
+
+# Near-duplicate edition detection: Gutenberg often has the same work under several book ids
+# (editions, re-encodings, "-0" and "-8" variants). Each normalised text gets a MinHash signature
+# of its word shingles; signatures are split into LSH bands stored in SQLite, so finding similar
+# editions is a handful of index lookups however large the catalogue grows.
+#
+# Changing SHINGLE_WORDS, NUM_HASHES or BANDS makes stored signatures incomparable; re-index
+# with `python -m services.editions index --all` afterwards.
+SHINGLE_WORDS = 5
+NUM_HASHES = 128
+BANDS = 32                      # 32 bands of 4 rows: candidates from an estimated similarity of ~0.42
+ROWS_PER_BAND = NUM_HASHES // BANDS
+MIN_SHINGLES = 1000             # shorter texts are not indexed: too few shingles for a stable estimate
+MAX_CANDIDATES = 20             # LSH candidates verified per query, most shared bands first
+
+# Estimated Jaccard similarity needed to reuse the analysis of an edition already analysed:
+# from EDITION_COPY_THRESHOLD the whole ebook_analysis row is copied, from EDITION_REUSE_THRESHOLD
+# only the chunks whose text differs are sent to the LLM. EDITION_REUSE=0 disables both.
+EDITION_REUSE = os.getenv("EDITION_REUSE", "1") != "0"
+EDITION_COPY_THRESHOLD = float(os.getenv("EDITION_COPY_THRESHOLD", "0.95"))
+EDITION_REUSE_THRESHOLD = float(os.getenv("EDITION_REUSE_THRESHOLD", "0.8"))
+
+_WORD = re.compile(r"\w+")
+_MAX_HASH = 1 << 64
+_ROLLING_BASE = 0x100000001B3  # FNV-1a 64-bit prime
+_ROLLING_HIGH = pow(_ROLLING_BASE, SHINGLE_WORDS - 1, _MAX_HASH)
+
+_stats = {"indexed": 0, "queries": 0, "copied": 0, "chunks": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def _shingle_hashes(words):
+    """
+    Distinct 64-bit hashes of the SHINGLE_WORDS-word windows of `words`: a polynomial rolling
+    hash over per-word hashes, so each window costs a few integer operations.
+    """
+    word_hashes, hashes = {}, []
+    for word in words:
+        value = word_hashes.get(word)
+        if value is None:
+            value = word_hashes[word] = _hash64(word.encode("utf-8"))
+        hashes.append(value)
+    shingles, rolling = set(), 0
+    for index, value in enumerate(hashes):
+        if index >= SHINGLE_WORDS:
+            rolling -= hashes[index - SHINGLE_WORDS] * _ROLLING_HIGH
+        rolling = (rolling * _ROLLING_BASE + value) % _MAX_HASH
+        if index >= SHINGLE_WORDS - 1:
+            shingles.add(rolling)
+    return shingles
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+def chunk_fingerprint(chunk):
+    """
+    Identifies a chunk by its words only, so the same passage in a re-encoded edition (other
+    quotes, dashes, line breaks or case) has the same fingerprint.
+    """
+    return hashlib.sha1(" ".join(_words(chunk)).encode("utf-8")).hexdigest()
+
+
+def minhash_signature(text):
+    """
+    MinHash signature of the SHINGLE_WORDS-word shingles of a text.
+
+    Uses one-permutation hashing: every shingle is hashed once and the hash picks one of the
+    NUM_HASHES bins, which keeps its minimum; empty bins borrow from the next filled bin
+    (rotation densification). The share of equal bins between two signatures estimates the
+    Jaccard similarity of the two shingle sets.
+
+    Parameters:
+    text (str): A normalised book text (see normalize_book).
+
+    Returns:
+    tuple: (signature as a tuple of NUM_HASHES ints, number of distinct shingles), or
+           (None, shingles) when the text has fewer than MIN_SHINGLES of them.
+    """
+    shingles = _shingle_hashes(_words(text))
+    if len(shingles) < MIN_SHINGLES:
+        return None, len(shingles)
+    bins = [None] * NUM_HASHES
+    for value in shingles:
+        index, rank = value % NUM_HASHES, value // NUM_HASHES
+        if bins[index] is None or rank < bins[index]:
+            bins[index] = rank
+    signature = list(bins)
+    for index, value in enumerate(bins):
+        if value is None:
+            step = 1
+            while bins[(index + step) % NUM_HASHES] is None:
+                step += 1
+            signature[index] = (bins[(index + step) % NUM_HASHES] + step * (_MAX_HASH // NUM_HASHES)) % _MAX_HASH
+    return tuple(signature), len(shingles)
+
+
+def signature_similarity(first, second):
+    """Estimated Jaccard similarity of two signatures: the share of equal bins."""
+    return sum(a == b for a, b in zip(first, second)) / NUM_HASHES
+
+
+def band_buckets(signature):
+    """[(band, bucket)] LSH keys of a signature; two texts sharing any key are candidates."""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        bucket = _hash64(struct.pack(f"<{ROWS_PER_BAND}Q", *rows))
+        buckets.append((band, bucket - _MAX_HASH if bucket >= _MAX_HASH // 2 else bucket))  # SQLite INTEGER is signed
+    return buckets
+
+
+def _pack(signature):
+    return struct.pack(f"<{NUM_HASHES}Q", *signature)
+
+
+def _unpack(blob):
+    return struct.unpack(f"<{NUM_HASHES}Q", blob)
+
+
+def index_edition(book_id, text):
+    """
+    Stores the MinHash signature and LSH band keys of a book's normalised text, replacing any
+    earlier ones. Called when a download is stored (see gutenberg_ebook._store_download).
+
+    Returns:
+    tuple or None: The signature, or None if the text is too short to index.
+    """
+    book_id = str(book_id)
+    signature, shingles = minhash_signature(text)
+    with connection() as conn:
+        conn.execute("DELETE FROM edition_bands WHERE book_id = ?", (book_id,))
+        if signature is None:
+            conn.execute("DELETE FROM edition_signatures WHERE book_id = ?", (book_id,))
+            return None
+        conn.execute(
+            "INSERT OR REPLACE INTO edition_signatures (book_id, signature, shingles, indexed_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            (book_id, _pack(signature), shingles),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO edition_bands (band, bucket, book_id) VALUES (?, ?, ?)",
+            ((band, bucket, book_id) for band, bucket in band_buckets(signature)),
+        )
+    _count("indexed")
+    return signature
+
+
+def load_signature(book_id):
+    with connection() as conn:
+        row = conn.execute("SELECT signature FROM edition_signatures WHERE book_id = ?", (str(book_id),)).fetchone()
+    return _unpack(row["signature"]) if row else None
+
+
+def find_similar_editions(book_id, signature=None, min_similarity=EDITION_REUSE_THRESHOLD, analysed_only=False):
+    """
+    Other books whose text is a near-duplicate of `book_id`'s.
+
+    Only books sharing at least one LSH band with the signature are read (an indexed lookup per
+    band), at most MAX_CANDIDATES of them after the analysed_only filter, and their similarity is then estimated from the
+    stored signatures.
+
+    Parameters:
+    book_id (str): The book to compare; excluded from the results.
+    signature (tuple, optional): Its signature. Defaults to the stored one.
+    min_similarity (float): Minimum estimated Jaccard similarity.
+    analysed_only (bool): Only return books with a completed ebook_analysis.
+
+    Returns:
+    list: [(book_id, similarity)], most similar first (lowest book id on ties).
+    """
+    book_id = str(book_id)
+    signature = signature or load_signature(book_id)
+    if signature is None:
+        return []
+    buckets = band_buckets(signature)
+    # Filtered before the LIMIT, so unanalysed editions do not use up the MAX_CANDIDATES slots
+    analysed = (
+        "AND book_id IN (SELECT ebook_id FROM ebook_analysis WHERE status = 'Analysis Completed')"
+        if analysed_only else ""
+    )
+    with connection() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT s.book_id, s.signature FROM (
+                SELECT book_id, COUNT(*) AS hits FROM edition_bands
+                WHERE ({" OR ".join(["(band = ? AND bucket = ?)"] * len(buckets))}) AND book_id != ?
+                {analysed}
+                GROUP BY book_id ORDER BY hits DESC, book_id LIMIT ?
+            ) c
+            JOIN edition_signatures s ON s.book_id = c.book_id
+            """,
+            [value for key in buckets for value in key] + [book_id, MAX_CANDIDATES],
+        ).fetchall()
+    _count("queries")
+    matches = [(row["book_id"], signature_similarity(signature, _unpack(row["signature"]))) for row in rows]
+    matches = [(other, similarity) for other, similarity in matches if similarity >= min_similarity]
+    return sorted(matches, key=lambda match: (-match[1], int(match[0]) if match[0].isdigit() else 0, match[0]))
+
+
+def find_analysed_edition(book_id, text):
+    """
+    The most similar already analysed edition of a book, for process_analysis to reuse.
+
+    A book without a stored signature (downloaded before the index existed) is indexed first.
+
+    Returns:
+    tuple: (source book_id, similarity, "copy" or "chunks"), or None if no edition reaches
+           EDITION_REUSE_THRESHOLD or EDITION_REUSE is off.
+    """
+    if not EDITION_REUSE:
+        return None
+    signature = load_signature(book_id)
+    if signature is None:
+        signature = index_edition(book_id, text)
+    matches = find_similar_editions(book_id, signature, EDITION_REUSE_THRESHOLD, analysed_only=True)
+    if not matches:
+        _count("misses")
+        return None
+    source, similarity = matches[0]
+    reuse = "copy" if similarity >= EDITION_COPY_THRESHOLD else "chunks"
+    _count("copied" if reuse == "copy" else "chunks")
+    log(f"Near-duplicate of book_id={source}", similarity=f"{similarity:.3f}", reuse=reuse)
+    return source, similarity, reuse
+
+
+def save_chunk_analyses(book_id, chunks, analyses):
+    """
+    Keeps the chunk analyses of a finished map step by chunk_fingerprint, replacing the book's
+    earlier ones, so a later near-duplicate edition only re-analyses the chunks that differ.
+    """
+    book_id = str(book_id)
+    with connection() as conn:
+        conn.execute("DELETE FROM chunk_analyses WHERE book_id = ?", (book_id,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_analyses (book_id, chunk_hash, result) VALUES (?, ?, ?)",
+            (
+                (book_id, chunk_fingerprint(chunk), json.dumps(analysis))
+                for chunk, analysis in zip(chunks, analyses) if analysis is not None
+            ),
+        )
+
+
+def load_chunk_analyses(book_id):
+    """{chunk_fingerprint: analysis} of a book (see save_chunk_analyses)."""
+    with connection() as conn:
+        rows = conn.execute("SELECT chunk_hash, result FROM chunk_analyses WHERE book_id = ?", (str(book_id),)).fetchall()
+    return {row["chunk_hash"]: json.loads(row["result"]) for row in rows}
+
+
+def copy_chunk_analyses(source_book_id, book_id):
+    """Gives a copied analysis the source's chunk analyses, so editions of the copy can reuse them too."""
+    with connection() as conn:
+        conn.execute("DELETE FROM chunk_analyses WHERE book_id = ?", (str(book_id),))
+        conn.execute(
+            "INSERT INTO chunk_analyses (book_id, chunk_hash, result) SELECT ?, chunk_hash, result FROM chunk_analyses WHERE book_id = ?",
+            (str(book_id), str(source_book_id)),
+        )
+
+
+def save_analysis_source(book_id, source_book_id, similarity, reuse):
+    """Records which edition an analysis was copied or partly reused from."""
+    with connection() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO analysis_sources (book_id, source_book_id, similarity, reuse, created_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (str(book_id), str(source_book_id), similarity, reuse),
+        )
+
+
+def clear_analysis_source(book_id):
+    with connection() as conn:
+        conn.execute("DELETE FROM analysis_sources WHERE book_id = ?", (str(book_id),))
+
+
+def _collect_metrics():
+    with _stats_lock:
+        stats = dict(_stats)
+    return [("edition_index_events_total", "counter",
+             "Near-duplicate edition index events (indexed, queries, copied, chunks, misses).",
+             labelled(stats, "event"))]
+
+
+register_collector(_collect_metrics)
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def main():
+    from .operations import create_database, read_clean_text, get_all_books
+    parser = argparse.ArgumentParser(description="Near-duplicate edition index of the downloaded books.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index = commands.add_parser("index", help="Index the books that have no signature yet")
+    index.add_argument("--all", action="store_true", help="Re-index every book")
+    similar = commands.add_parser("similar", help="List the near-duplicate editions of a book")
+    similar.add_argument("book_id")
+    similar.add_argument("--min-similarity", type=float, default=0.5)
+    args = parser.parse_args()
+    create_database()
+    if args.command == "index":
+        indexed = skipped = 0
+        for book in get_all_books():
+            book_id = book["Book_id"]
+            if not args.all and load_signature(book_id) is not None:
+                continue
+            text, _ = read_clean_text(book_id)
+            if index_edition(book_id, text) is None:
+                skipped += 1
+            else:
+                indexed += 1
+        print({"indexed": indexed, "skipped": skipped})
+    else:
+        for book_id, similarity in find_similar_editions(args.book_id, min_similarity=args.min_similarity):
+            print(f"{book_id}\t{similarity:.3f}")
+
+
+if __name__ == "__main__":
+    main()
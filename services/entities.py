@@ -0,0 +1,218 @@
+import os
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+# Local canonicalisation of merged chunk analyses (see operations.merge_parsed_responses): the
+# same character or theme reported by many chunks under different spellings is collapsed into
+# one entry ranked by how many chunks mention it, and sentiment / language are voted on, so
+# the reduce prompt is smaller and identical inputs always produce the identical prompt.
+MAX_ENTITIES = int(os.getenv("MERGE_MAX_ENTITIES", "25"))  # entries kept per list after ranking
+FUZZY_RATIO = 0.85          # SequenceMatcher ratio for two spellings of one word ("Elisabeth", "Elizabeth")
+MIN_FUZZY_LENGTH = 4        # shorter words must match exactly ("Mr" / "Mrs", "Tom" / "Tim")
+SENTIMENT_LABELS = ("positive", "negative", "neutral", "mixed")
+
+_POSSESSIVE = re.compile(r"['’]s\b")
+_NON_WORD = re.compile(r"[\W_]+")
+# Ignored when one name is compared as part of another: "Dian" is part of "Dian the Beautiful"
+_LINKING_WORDS = {"the", "of", "a", "an", "de", "von", "van", "la", "le"}
+
+
+@lru_cache(maxsize=4096)
+def entity_key(value):
+    """
+    Comparison key of a name or label: accents folded, case folded, possessives and
+    punctuation removed, whitespace collapsed ("Dian's" and "dian" give "dian").
+    """
+    text = unicodedata.normalize("NFKD", str(value))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = _POSSESSIVE.sub("", text.casefold())
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def clean_label(value):
+    """A reported value as shown: surrounding whitespace, quotes and trailing punctuation stripped."""
+    return " ".join(str(value).split()).strip("\"'“”‘’`").rstrip(".,;:!").strip()
+
+
+@lru_cache(maxsize=4096)
+def _letters(word):
+    return Counter(word)
+
+
+def _similar_words(first, second, names):
+    if first == second:
+        return True
+    if min(len(first), len(second)) < MIN_FUZZY_LENGTH or abs(len(first) - len(second)) > 2:
+        return False
+    if names and (first.startswith(second) or second.startswith(first)):
+        return False  # "Julia" / "Julian", "Daniel" / "Danielle" are different people
+    # Shared letters bound the ratio from above (SequenceMatcher.quick_ratio) and are much cheaper
+    shared = sum((_letters(first) & _letters(second)).values())
+    if 2 * shared < FUZZY_RATIO * (len(first) + len(second)):
+        return False
+    return SequenceMatcher(None, first, second).ratio() >= FUZZY_RATIO
+
+
+def _is_alias(first, second, names):
+    """Same number of words and every word equal or a close spelling of the other."""
+    return len(first) == len(second) and all(_similar_words(a, b, names) for a, b in zip(first, second))
+
+
+class _Entity:
+    """One canonical entry: its spellings and the chunks that mention any of them."""
+
+    def __init__(self, key, first_seen):
+        self.key = key
+        self.words = key.split()
+        self.forms = {}          # shown spelling -> chunks mentioning it
+        self.chunks = set()
+        self.first_seen = first_seen
+        self._name = None
+
+    def add(self, form, chunk_index):
+        chunks = self.forms.setdefault(form, set())
+        chunks.add(chunk_index)
+        self.chunks.add(chunk_index)
+        self._name = None
+
+    def absorb(self, other):
+        for form, chunks in other.forms.items():
+            self.forms.setdefault(form, set()).update(chunks)
+        self.chunks |= other.chunks
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self._name = None
+
+    def name(self):
+        if self._name is None:
+            self._name = self._choose_name()
+        return self._name
+
+    def _choose_name(self):
+        # The name most chunks used ("Dian", "dian" and "Dian's" count as one), fuller on ties;
+        # then its most used spelling, preferring capitalised and shorter ones
+        chunks = {}
+        for form, form_chunks in self.forms.items():
+            chunks.setdefault(entity_key(form), set()).update(form_chunks)
+        key = min(chunks, key=lambda key: (-len(chunks[key]), -len(key), key))
+        return min(
+            (form for form in self.forms if entity_key(form) == key),
+            key=lambda form: (-len(self.forms[form]), form.islower(), len(form), form)
+        )
+
+    def rank(self):
+        return -len(self.chunks), self.first_seen, self.name()
+
+
+def canonical_entities(lists, names=False, max_entities=None):
+    """
+    Collapses the entity lists reported by several chunks into one ranked list.
+
+    Entries with the same entity_key are one entity, and entities whose words are close
+    spellings of each other ("Elisabeth Bennet", "Elizabeth Bennet"; "friendship",
+    "friendships") are merged. For names a word is not merged with a longer form of itself
+    ("Julia", "Julian"), but a name whose words all appear in exactly one longer name ("Dian"
+    in "Dian the Beautiful") is merged into it. Each entity is shown under the spelling most
+    chunks used.
+
+    Parameters:
+    lists (list): One list of names (or themes) per chunk, in chunk order.
+    names (bool): The entries are character names rather than themes.
+    max_entities (int, optional): Entries to keep. Defaults to MAX_ENTITIES.
+
+    Returns:
+    list: Canonical names, most chunks first, then by first appearance.
+    """
+    entities = {}
+    for chunk_index, values in enumerate(lists):
+        for value in values or ():
+            form, key = clean_label(value), entity_key(value)
+            if not key:
+                continue
+            entity = entities.get(key)
+            if entity is None:
+                entity = entities[key] = _Entity(key, (chunk_index, len(entities)))
+            entity.add(form, chunk_index)
+
+    # Close spellings: only entities with as many words, the same initial and at most two
+    # letters more or less can be aliases, so each is compared with a few buckets only
+    merged, buckets = [], {}
+    for entity in sorted(entities.values(), key=_Entity.rank):
+        words, initial, length = len(entity.words), entity.key[0], len(entity.key)
+        candidates = (
+            other for size in range(length - 2, length + 3) for other in buckets.get((words, initial, size), ())
+        )
+        target = next((other for other in candidates if _is_alias(entity.words, other.words, names)), None)
+        if target is None:
+            buckets.setdefault((words, initial, length), []).append(entity)
+            merged.append(entity)
+        else:
+            target.absorb(entity)
+
+    if names:
+        merged = _merge_partial_names(merged)
+    limit = MAX_ENTITIES if max_entities is None else max_entities
+    return [entity.name() for entity in sorted(merged, key=_Entity.rank)[:limit]]
+
+
+def _merge_partial_names(entities):
+    """Merges each name into the single longer name that contains all of its words, if there is exactly one."""
+    significant = {id(entity): set(entity.words) - _LINKING_WORDS or set(entity.words) for entity in entities}
+    by_word = {}
+    for entity in entities:
+        for word in significant[id(entity)]:
+            by_word.setdefault(word, []).append(entity)
+    absorbed = set()
+    # Shortest names first, so "Dian" joins "Dian the Beautiful" before that is compared with longer names
+    for entity in sorted(entities, key=lambda entity: (len(significant[id(entity)]), entity.rank())):
+        words = significant[id(entity)]
+        containers = [
+            other for other in by_word[next(iter(sorted(words)))]
+            if other is not entity and id(other) not in absorbed and words < significant[id(other)]
+        ]
+        if len(containers) == 1:
+            containers[0].absorb(entity)
+            absorbed.add(id(entity))
+    return [entity for entity in entities if id(entity) not in absorbed]
+
+
+def _vote_key(value, labels):
+    key = entity_key(value)
+    if labels:
+        # "Mostly positive, with tense moments" votes for "positive"
+        positions = [(key.find(label), label) for label in labels if re.search(rf"\b{label}\b", key)]
+        if positions:
+            return min(positions)[1]
+    return key
+
+
+def vote(values, labels=None):
+    """
+    The value most chunks reported, compared by entity_key; ties go to the value reported first.
+
+    Parameters:
+    values (list): One reported value per chunk ("English", "english.", ...).
+    labels (tuple, optional): Known labels (e.g. SENTIMENT_LABELS); a value mentioning one
+                              votes for that label.
+
+    Returns:
+    str: The winning label, or the winner's most common spelling; "" if nothing was reported.
+    """
+    counts, forms, first_seen = {}, {}, {}
+    for index, value in enumerate(values):
+        form, key = clean_label(value), _vote_key(value, labels)
+        if not key:
+            continue
+        counts[key] = counts.get(key, 0) + 1
+        first_seen.setdefault(key, index)
+        spellings = forms.setdefault(key, {})
+        spellings[form] = spellings.get(form, 0) + 1
+    if not counts:
+        return ""
+    winner = min(counts, key=lambda key: (-counts[key], first_seen[key]))
+    if labels and winner in labels:
+        return winner
+    spellings = forms[winner]
+    return min(spellings, key=lambda form: (-spellings[form], form))
@@ -0,0 +1,84 @@
+import os
+import threading
+from collections import OrderedDict
+from .metrics import register_collector
+
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", "2048"))
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv("FRAGMENT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class FragmentCache:
+    """
+    Thread-safe LRU cache of rendered /analyze fragments, bounded by entry count and size.
+
+    Keys are (book_id, kind, format, version) tuples; values are HTML strings or JSON-ready
+    dicts. Entries of one book can be dropped at once with invalidate().
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_MAX_ENTRIES, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.by_book = {}             # book_id -> set of keys
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size)
+            self.by_book.setdefault(key[0], set()).add(key)
+            self.size += size
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, book_id):
+        """Drops every cached fragment of `book_id`."""
+        with self.lock:
+            for key in list(self.by_book.get(str(book_id), ())):
+                self._remove(key)
+
+    def _remove(self, key):
+        _, size = self.entries.pop(key)
+        self.size -= size
+        keys = self.by_book.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_book[key[0]]
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+_fragments = FragmentCache()
+
+
+def _collect_metrics():
+    stats = _fragments.stats()
+    return [
+        ("fragment_cache_lookups_total", "counter", "Rendered /analyze fragment cache lookups.",
+         [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+        ("fragment_cache_bytes", "gauge", "Size of the rendered fragments held in memory.", [({}, stats["bytes"])]),
+    ]
+
+
+register_collector(_collect_metrics)
+
+
+def get_fragment_cache():
+    return _fragments
@@ -1,219 +1,462 @@
-import requests
-from bs4 import BeautifulSoup
-import os
-from groq import Groq
-from .operations import *
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-def getGroqClient():
-    client = Groq(
-        api_key=os.getenv('API_KEY'),
-    )
-    return client
-def scrape_gutenberg_metadata(book_id):
-    """
-    Scrape metadata from a Project Gutenberg eBook page.
-
-    Parameters:
-    book_id (int): The unique identifier of the eBook on Project Gutenberg.
-
-    Returns:
-    dict, int: A dictionary containing the scraped metadata and the HTTP status code.
-               If the book is not found, the dictionary will contain an "error" key with the value "ebook not found",
-               and the status code will be 404.
-               If any other request failure occurs, the dictionary will contain the error message,
-               and the status code will be 500.
-               If the request is successful, the dictionary will contain the scraped metadata, and the status code will be 200.
-    """
-    url = f"https://www.gutenberg.org/ebooks/{book_id}"
-
-    try:
-        response = requests.get(url)
-
-        # If the book is not found, return 404
-        if response.status_code == 404:
-            return {"error": "ebook not found"}, 404
-
-        response.raise_for_status()  # Raise an error for other bad responses (e.g., 500)
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        table = soup.find('table', class_='bibrec')
-        metadata = {}
-
-        if table:
-            for row in table.find_all('tr'):
-                th = row.find('th')  # Get the header column
-                td = row.find('td')  # Get the value column
-
-                if th and td:  # Ensure both elements exist
-                    header = th.get_text(strip=True)
-                    value = td.get_text(strip=True)
-                    metadata[header] = value
-
-        return metadata, 200
-
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e)}, 500  # Return 500 for any other request failures
-
-
-def get_ebook_data(book_id):
-    """
-    Fetch book content from Project Gutenberg and save it as a text file.
-
-    If the first attempt fails, retry once by removing '-0' from the URL.
-    If both attempts fail, save "Ebook content not found".
-
-    Parameters:
-    book_id (int): The unique identifier of the eBook on Project Gutenberg.
-
-    Returns:
-    tuple: A tuple containing the file path and the content of the eBook.
-           If both attempts to fetch the content fail, the content will be "Ebook content not found".
-    """
-    # Primary URL format
-    content_urls = [
-        f"https://www.gutenberg.org/files/{book_id}/{book_id}-0.txt",
-        f"https://www.gutenberg.org/files/{book_id}/{book_id}.txt"  # Retry without "-0"
-    ]
-    print(content_urls)
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)  # Ensure upload directory exists
-
-    file_path = os.path.join(upload_dir, f"{book_id}.txt")
-
-    content = "Ebook content not found"  # Default content in case of failure
-
-    for url in content_urls:
-        print(url)
-        try:
-            response = requests.get(url)
-
-            response.raise_for_status()  # Raise error for bad responses (4xx, 5xx)
-            content = response.text
-            break  # Exit loop if request succeeds
-        except requests.exceptions.RequestException:
-            continue  # Try the next URL if the first one fails
-
-    # Save content to file
-    with open(file_path, "w", encoding="utf-8") as file:
-        file.write(content)
-
-    return file_path, content  # Return file path and content
-
-
-def proccess_gutenberg(book_id):
-    """
-    Processes an eBook from Project Gutenberg.
-
-    This function checks if the eBook with the given book_id already exists in the database.
-    If it does, the function retrieves the eBook content from the local file.
-    If it doesn't, the function scrapes the eBook metadata from Project Gutenberg,
-    fetches the eBook content, saves it as a text file, and inserts the data into the database.
-
-    Parameters:
-    book_id (int): The unique identifier of the eBook on Project Gutenberg.
-
-    Returns:
-    tuple: A tuple containing the eBook content and the file path.
-           If the eBook content is not found, the content will be "Ebook content not found".
-    """
-    if_exist, file_path = book_id_exists(book_id)
-    if if_exist:
-        content = read_txt_file(book_id)
-        return content, file_path
-
-    print("bookid", book_id)
-    metas, status = scrape_gutenberg_metadata(book_id)
-    print(metas)
-    content = "Ebook content not found"  # Default content in case of failure
-
-    if status == 200:
-        file_path, content = get_ebook_data(book_id)
-        print(file_path)
-        insert_ebook_data(book_id, metas, txt_path=file_path)
-
-    return content, file_path
-
-
-def search_gutenberg(book_id):
-    """
-    Search for an eBook in the local database based on its unique identifier.
-
-    Parameters:
-    book_id (int): The unique identifier of the eBook on Project Gutenberg.
-
-    Returns:
-    str, bytes: If the eBook is found in the database, the function returns the content of the eBook.
-                If the eBook is not found, the function returns the string "Data not found".
-    """
-    if_exist, file_path = book_id_exists(book_id)
-    if if_exist:
-        content = read_txt_file(book_id)
-        return content
-    return "Data not found"
-
-
-def process_analysis(file_path, book_id):
-    """
-    Performs a comprehensive analysis of an eBook using the Groq API.
-
-    This function reads the text content of an eBook from a local file,
-    inserts a new eBook record into the database with a pending status,
-    chunks the text into smaller segments, selects a subset of these chunks for analysis,
-    sends the selected chunks to the Groq API for raw analysis,
-    merges the responses from the Groq API, processes the final analysis,
-    extracts relevant information from the processed analysis,
-    updates the eBook record in the database with the analysis results,
-    and returns True upon successful completion.
-
-    Parameters:
-    file_path (str): The file path of the local text file containing the eBook content.
-    book_id (int): The unique identifier of the eBook in the database.
-
-    Returns:
-    bool: True if the analysis is completed successfully, False otherwise.
-    """
-    text = read_txt_file(book_id)
-    # Insert new ebook (Pending status)
-    isexit, data = book_id_exists_in_analysis(book_id)
-    if isexit and data[-1] != "In Progress":
-        return data
-    insert_ebook(book_id)
-    chunk = chunk_text(text, max_length=5000)
-    selected_chunks = select_chunks(chunk, num_samples=10)
-    client=getGroqClient()
-    summary = process_raw_analysis(client, selected_chunks)
-    merged_output = merge_responses(summary)
-    client=getGroqClient()
-    raw_json_output = process_final_analysis(merged_output, client)
-    if type(raw_json_output ) == dict:
-        final_analysis = raw_json_output
-    else:
-        final_analysis = dict(json.loads(raw_json_output))
-    print(final_analysis)
-    try:
-        update_ebook_data(
-            ebook_id=book_id,
-            summary=final_analysis.get("summary", ""),
-            sentiment=final_analysis.get("sentiment", ""),
-            language=final_analysis.get("language", ""),
-            key_characters=final_analysis.get("key_characters", ""),
-            themes=final_analysis.get("key_characters", "themes"),
-            status="Analysis Completed"
-        )
-    except Exception as e:
-        update_ebook_data(
-            ebook_id=book_id,
-            summary="",
-            sentiment="",
-            language="",
-            key_characters="",
-            themes="",
-            status="Analysis Failed"
-        )
-    return True
-
+import asyncio
+import httpx
+import requests
+import os
+import threading
+import time
+import weakref
+from groq import Groq
+from .operations import *
+from .content_store import check_book_id
+from .search import index_book_file, index_book_metadata, index_book_analysis
+from .downloader import download_file, download_file_async
+from .llm_backends import get_llm_backend
+from .summarize import summarize_book
+from .progress import AnalysisProgress
+from .metadata import get_metadata, get_metadata_async
+from .aio import run_sync, single_flight
+from .editions import (
+    index_edition, find_analysed_edition, load_chunk_analyses, save_chunk_analyses, copy_chunk_analyses,
+    save_analysis_source, clear_analysis_source,
+)
+from .metrics import IN_FLIGHT, STAGE_SECONDS, stage_timer, trace, log
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+GUTENBERG_BASE_URL = os.getenv("GUTENBERG_BASE_URL", "https://www.gutenberg.org")
+# "sample" analyses a seeded sample of chunks; "full" summarises every chunk and reduces hierarchically
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "sample")
+# New downloads indexed, compressed and normalised at once in the ASGI mode: the step is CPU bound
+# and holds SQLite's write lock while indexing, so more parallelism only produces lock timeouts
+ASYNC_STORE_CONCURRENCY = int(os.getenv("ASYNC_STORE_CONCURRENCY", "2"))
+BOOK_LOCK_POLL_INTERVAL = 0.05  # seconds between tries of an async download for a book being fetched elsewhere
+# Minimum text_stats language confidence for it to replace the language reported by the LLM
+LANGUAGE_CONFIDENCE = float(os.getenv("LANGUAGE_CONFIDENCE", "0.5"))
+
+def getGroqClient():
+    client = Groq(
+        api_key=os.getenv('API_KEY'),
+    )
+    return client
+def scrape_gutenberg_metadata(book_id):
+    """
+    Scrape metadata from a Project Gutenberg eBook page.
+
+    Parameters:
+    book_id (int): The unique identifier of the eBook on Project Gutenberg.
+
+    Returns:
+    dict, int: A dictionary containing the scraped metadata and the HTTP status code.
+               If the book is not found, the dictionary will contain an "error" key with the value "ebook not found",
+               and the status code will be 404.
+               If any other request failure occurs, the dictionary will contain the error message,
+               and the status code will be 500.
+               If the request is successful, the dictionary will contain the scraped metadata, and the status code will be 200.
+               Results come from metadata_cache while fresh (see services.metadata.get_metadata).
+    """
+    # Cached with a TTL, revalidated conditionally and parsed from the bibrec table only
+    return get_metadata(book_id, GUTENBERG_BASE_URL)
+
+
+async def scrape_gutenberg_metadata_async(book_id):
+    """Non-blocking twin of scrape_gutenberg_metadata for the ASGI serving mode."""
+    return await get_metadata_async(book_id, GUTENBERG_BASE_URL)
+
+
+def _content_urls(book_id, base_url):
+    return [
+        f"{base_url}/files/{book_id}/{book_id}-0.txt",
+        f"{base_url}/files/{book_id}/{book_id}.txt"
+    ]
+
+
+def _upload_path(book_id):
+    upload_dir = "uploads"
+    os.makedirs(upload_dir, exist_ok=True)  # Ensure upload directory exists
+    return os.path.join(upload_dir, f"{check_book_id(book_id)}.txt")
+
+
+def _store_download(book_id, file_path):
+    """
+    Indexes a new download, moves it into the content store, writes its cleaned copy and adds
+    it to the near-duplicate edition index (see services.editions).
+    """
+    index_book_file(book_id, file_path)
+    # Compressed into the content store (the plain file is then removed), then cleaned
+    store_book_file(book_id)
+    normalized = normalize_book(book_id)
+    if normalized is not None:
+        index_edition(book_id, normalized[0])
+
+
+_book_locks = weakref.WeakValueDictionary()  # book_id -> lock, kept while a download holds or awaits it
+_book_locks_lock = threading.Lock()
+
+
+def _book_lock(book_id):
+    """
+    The lock a download of `book_id` holds until the text is in the content store.
+
+    Shared by get_ebook_data (Flask requests, ingest threads) and get_ebook_data_async, so two
+    downloads of one book in this process never write the same .part/.meta files or remove the
+    plain file from under each other.
+    """
+    with _book_locks_lock:
+        lock = _book_locks.get(str(book_id))
+        if lock is None:
+            lock = _book_locks[str(book_id)] = threading.Lock()
+        return lock
+
+
+def _missing_download(error):
+    """Whether a failed download means Gutenberg has no such file (404/410), not an outage."""
+    return getattr(getattr(error, "response", None), "status_code", None) in (404, 410)
+
+
+def get_ebook_data(book_id, load_content=True, base_url=None, session=None, raise_errors=False):
+    """
+    Fetch book content from Project Gutenberg and save it as a text file.
+
+    The "-0.txt" and ".txt" variants are requested in parallel and the first that succeeds is
+    streamed to disk through the shared HTTP session (see services.downloader.download_file),
+    so the body is never held in memory and a failed download leaves any existing file untouched.
+    A book that was downloaded before is only re-fetched if Gutenberg reports it has changed.
+    The new text is then moved into the compressed content store (see services.content_store).
+
+    Parameters:
+    book_id (int): The unique identifier of the eBook on Project Gutenberg.
+    load_content (bool): Read the saved text back and return it. Defaults to True.
+    base_url (str, optional): Gutenberg mirror to download from. Defaults to GUTENBERG_BASE_URL.
+    session (requests.Session, optional): HTTP session to use. Defaults to the shared pooled session.
+    raise_errors (bool): Re-raise download errors other than a missing file (404/410), e.g.
+                         timeouts and 5xx, instead of reporting the book as not found.
+
+    Returns:
+    tuple: A tuple containing the file path and the content of the eBook.
+           If both attempts to fetch the content fail, the content will be "Ebook content not found".
+           With load_content=False the content is None on success.
+    """
+    content_urls = _content_urls(book_id, base_url or GUTENBERG_BASE_URL)
+    file_path = _upload_path(book_id)
+
+    with _book_lock(book_id):
+        try:
+            with IN_FLIGHT.track("download"), stage_timer("download"):
+                result = download_file(
+                    content_urls, file_path, session=session, have_copy=book_file_info(book_id) is not None
+                )
+        except requests.exceptions.RequestException as e:
+            log(f"Download failed: {e}", book_id=book_id)
+            if raise_errors and not _missing_download(e):
+                raise
+            return file_path, "Ebook content not found"
+        log(f"Download {result['status']}", book_id=book_id, url=result["url"], bytes=result["bytes"])
+
+        if result["status"] != "not_modified":
+            _store_download(book_id, file_path)
+
+    content = read_txt_file(book_id) if load_content else None
+    return file_path, content  # Return file path and content
+
+
+_store_slots = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore of ASYNC_STORE_CONCURRENCY
+
+
+def _get_store_slots():
+    """The running event loop's store semaphore, created on first use inside that loop."""
+    loop = asyncio.get_running_loop()
+    slots = _store_slots.get(loop)
+    if slots is None:
+        slots = _store_slots[loop] = asyncio.Semaphore(ASYNC_STORE_CONCURRENCY)
+    return slots
+
+
+async def get_ebook_data_async(book_id, base_url=None, client=None):
+    """
+    Non-blocking twin of get_ebook_data(load_content=False): the download runs on the event
+    loop (see download_file_async), storing and normalising in the services.aio thread pool.
+
+    Returns:
+    tuple: (file path, None), or (file path, "Ebook content not found") if the download failed.
+    """
+    content_urls = _content_urls(book_id, base_url or GUTENBERG_BASE_URL)
+    file_path = await run_sync(_upload_path, book_id)
+
+    lock = _book_lock(book_id)
+    # Polled rather than awaited in a thread: waiting holds no thread, and a cancelled wait
+    # cannot leave the lock taken
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(BOOK_LOCK_POLL_INTERVAL)
+    try:
+        have_copy = await run_sync(book_file_info, book_id) is not None
+        try:
+            with IN_FLIGHT.track("download"), stage_timer("download"):
+                result = await download_file_async(content_urls, file_path, client=client, have_copy=have_copy)
+        except httpx.HTTPError as e:
+            log(f"Download failed: {e}", book_id=book_id)
+            return file_path, "Ebook content not found"
+        log(f"Download {result['status']}", book_id=book_id, url=result["url"], bytes=result["bytes"])
+
+        if result["status"] != "not_modified":
+            async with _get_store_slots():
+                await run_sync(_store_download, book_id, file_path)
+    finally:
+        lock.release()
+    return file_path, None
+
+
+def proccess_gutenberg(book_id, load_content=True):
+    """
+    Processes an eBook from Project Gutenberg.
+
+    This function checks if the eBook with the given book_id already exists in the database.
+    If it does, the function retrieves the eBook content from the local file.
+    If it doesn't, the function scrapes the eBook metadata from Project Gutenberg,
+    fetches the eBook content, saves it as a text file, and inserts the data into the database.
+
+    Parameters:
+    book_id (int): The unique identifier of the eBook on Project Gutenberg.
+    load_content (bool): When False, an already downloaded book is not read back from disk
+                         and None is returned as its content.
+
+    Returns:
+    tuple: A tuple containing the eBook content and the file path.
+           If the eBook content is not found, the content will be "Ebook content not found".
+    """
+    record = get_book_record(book_id)
+    if record:
+        content = read_txt_file(book_id) if load_content else None
+        return content, record["txt_path"]
+
+    with trace(book_id=book_id):
+        with stage_timer("scrape"):
+            metas, status = scrape_gutenberg_metadata(book_id)
+        log("Scraped metadata", status=status, title=metas.get("Title", metas.get("error")))
+        content = "Ebook content not found"  # Default content in case of failure
+        file_path = None
+
+        if status == 200:
+            file_path, content = get_ebook_data(book_id, load_content=load_content)
+            _save_book_record(book_id, metas, file_path)
+
+    return content, file_path
+
+
+def _save_book_record(book_id, metas, file_path):
+    insert_ebook_data(book_id, metas, txt_path=file_path)
+    index_book_metadata(book_id, metas)
+
+
+_fetches = {}
+
+
+@single_flight(_fetches)
+async def proccess_gutenberg_async(book_id):
+    """
+    Non-blocking twin of proccess_gutenberg(load_content=False) for the ASGI serving mode.
+
+    Scraping and downloading wait on the network without holding a thread, and concurrent calls
+    for the same book share one run, so hundreds of /fetch_book requests can be in flight at once.
+
+    Returns:
+    tuple: (None, file path) on success; ("Ebook content not found", file path or None) otherwise.
+    """
+    record = await run_sync(get_book_record, book_id)
+    if record:
+        return None, record["txt_path"]
+
+    with trace(book_id=book_id):
+        with stage_timer("scrape"):
+            metas, status = await scrape_gutenberg_metadata_async(book_id)
+        log("Scraped metadata", status=status, title=metas.get("Title", metas.get("error")))
+        content = "Ebook content not found"  # Default content in case of failure
+        file_path = None
+
+        if status == 200:
+            file_path, content = await get_ebook_data_async(book_id)
+            await run_sync(_save_book_record, book_id, metas, file_path)
+
+    return content, file_path
+
+
+def search_gutenberg(book_id):
+    """
+    Search for an eBook in the local database based on its unique identifier.
+
+    Parameters:
+    book_id (int): The unique identifier of the eBook on Project Gutenberg.
+
+    Returns:
+    str, bytes: If the eBook is found in the database, the function returns the content of the eBook.
+                If the eBook is not found, the function returns the string "Data not found".
+    """
+    if book_exists(book_id):
+        content = read_txt_file(book_id)
+        return content
+    return "Data not found"
+
+
+def process_analysis(file_path, book_id, timings=None, mode=None):
+    """
+    Performs a comprehensive analysis of an eBook using the configured LLM backend (Groq by default).
+
+    This function reads the cleaned text content of an eBook (without the Gutenberg licence
+    and table of contents, see normalize_book) and its chapter offsets,
+    inserts a new eBook record into the database with a pending status,
+    chunks the text into smaller segments, selects a subset of these chunks for analysis,
+    sends the selected chunks to the Groq API for raw analysis,
+    merges the responses from the Groq API, processes the final analysis,
+    extracts relevant information from the processed analysis,
+    updates the eBook record in the database with the analysis results,
+    publishes each stage and chunk result as it happens (services.progress),
+    records the LLM requests and tokens spent on the book in analysis_usage,
+    and returns True upon successful completion.
+
+    A book whose text is a near-duplicate of an edition analysed before (see services.editions)
+    reuses that work: above EDITION_COPY_THRESHOLD the analysis is copied without any LLM call,
+    above EDITION_REUSE_THRESHOLD only the chunks whose text differs are analysed again.
+
+    Parameters:
+    file_path (str): The file path of the local text file containing the eBook content.
+    book_id (int): The unique identifier of the eBook in the database.
+    timings (dict, optional): If given, filled with the seconds spent in each stage
+                              (read, stats, editions, chunk, map, reduce, persist).
+    mode (str, optional): "sample" or "full" (see summarize_book). Defaults to ANALYSIS_MODE.
+
+    Returns:
+    bool: True if the analysis is completed successfully, False otherwise.
+
+    The stage timings are also exported as pipeline_stage_duration_seconds (see services.metrics),
+    and every log line of the run carries the book id and the current trace id.
+    """
+    if timings is None:
+        timings = {}
+    with trace(book_id=book_id), IN_FLIGHT.track("analysis"):
+        try:
+            return _run_analysis(book_id, timings, mode)
+        finally:
+            for stage, seconds in timings.items():
+                STAGE_SECONDS.observe(stage, value=seconds)
+            log("Analysis stages", **{stage: f"{seconds:.3f}s" for stage, seconds in timings.items()})
+
+
+def _run_analysis(book_id, timings, mode):
+    started = time.perf_counter()
+    # Cleaned copy without the Gutenberg licence and table of contents, plus chapter offsets
+    text, chapters = read_clean_text(book_id)
+    timings["read"] = time.perf_counter() - started
+    # Insert new ebook (Pending status)
+    isexit, data = book_id_exists_in_analysis(book_id)
+    if isexit and data[-1] != "In Progress":
+        return data
+    insert_ebook(book_id)
+    # Cheap deterministic facts first: they are shown by /analyze?type=stats before the LLM finishes
+    started = time.perf_counter()
+    stats = book_text_stats(book_id, text)
+    timings["stats"] = time.perf_counter() - started
+    # Stage changes and chunk results are streamed to the browser (see services.progress)
+    progress = AnalysisProgress(book_id)
+    usage = TokenUsage()
+    started = time.perf_counter()
+    edition = find_analysed_edition(book_id, text)
+    timings["editions"] = time.perf_counter() - started
+    if edition is not None and edition[2] == "copy":
+        return _copy_analysis(book_id, edition, usage, progress, timings)
+    known_results = load_chunk_analyses(edition[0]) if edition is not None else None
+    # Shared per-stage backends (LLM_BACKEND / LLM_CHUNK_MODEL / LLM_REDUCE_MODEL ...)
+    chunk_backend = get_llm_backend("chunk")
+    reduce_backend = get_llm_backend("reduce")
+    if (mode or ANALYSIS_MODE) == "full":
+        timings["chunk"] = 0.0
+        final_analysis = summarize_book(
+            book_id, text, chunk_backend, timings=timings, usage=usage, reduce_client=reduce_backend,
+            progress=progress, chapters=chapters, known_results=known_results
+        )
+    else:
+        progress.stage("chunk")
+        started = time.perf_counter()
+        # Only the sampled chunks are materialised; the rest stay as offsets into `text`. An edition
+        # samples with its source's seed, so the same passages are picked and their analyses reused
+        seed = str(edition[0] if edition is not None else book_id)
+        selected_chunks = sample_chunks(text, num_samples=10, seed=seed, max_length=5000, chapters=chapters)
+        timings["chunk"] = time.perf_counter() - started
+        progress.stage("map", chunks_total=len(selected_chunks))
+        started = time.perf_counter()
+        summary = process_raw_analysis(
+            chunk_backend, selected_chunks, usage=usage, on_result=progress.chunk_results, known_results=known_results
+        )
+        save_chunk_analyses(book_id, selected_chunks, summary)
+        timings["map"] = time.perf_counter() - started
+        progress.stage("reduce")
+        started = time.perf_counter()
+        merged_output = merge_responses(summary)
+        # Parsed, validated and re-requested if malformed (see process_final_analysis)
+        final_analysis = process_final_analysis(merged_output, reduce_backend, usage=usage)
+        timings["reduce"] = time.perf_counter() - started
+    # Stopword-based detection is more reliable than a language guessed from ten sampled chunks
+    if stats["language_confidence"] >= LANGUAGE_CONFIDENCE:
+        final_analysis["language"] = stats["language"]
+    if not final_analysis.get("key_characters"):
+        final_analysis["key_characters"] = stats["candidate_characters"]
+    log("Final analysis", analysis=final_analysis)
+    progress.stage("persist")
+    started = time.perf_counter()
+    try:
+        update_ebook_data(
+            ebook_id=book_id,
+            summary=final_analysis.get("summary", ""),
+            sentiment=final_analysis.get("sentiment", ""),
+            language=final_analysis.get("language", ""),
+            key_characters=final_analysis.get("key_characters", ""),
+            themes=final_analysis.get("themes", []),
+            status="Analysis Completed"
+        )
+        index_book_analysis(book_id, final_analysis.get("summary", ""), final_analysis.get("themes", []))
+        update_analysis_usage(book_id, usage)
+        if edition is not None:
+            save_analysis_source(book_id, edition[0], edition[1], edition[2])
+        else:
+            clear_analysis_source(book_id)
+    except Exception:
+        update_ebook_data(
+            ebook_id=book_id,
+            summary="",
+            sentiment="",
+            language="",
+            key_characters="",
+            themes="",
+            status="Analysis Failed"
+        )
+        # So jobs.run_job records the job as failed, not done
+        raise
+    finally:
+        timings["persist"] = time.perf_counter() - started
+    progress.finish()
+    return True
+
+
+def _copy_analysis(book_id, edition, usage, progress, timings):
+    """Fills a book's ebook_analysis row from a near-identical edition's completed analysis."""
+    source_book_id, similarity, reuse = edition
+    _, row = book_id_exists_in_analysis(source_book_id)
+    analysis = ebook_analysis_to_dict(row)
+    progress.stage("persist")
+    started = time.perf_counter()
+    update_ebook_data(
+        ebook_id=book_id,
+        summary=analysis["summary"],
+        sentiment=analysis["sentiment"],
+        language=analysis["language"],
+        key_characters=analysis["key_characters"],
+        themes=analysis["themes"],
+        status="Analysis Completed"
+    )
+    index_book_analysis(book_id, analysis["summary"], analysis["themes"])
+    update_analysis_usage(book_id, usage)
+    copy_chunk_analyses(source_book_id, book_id)
+    save_analysis_source(book_id, source_book_id, similarity, reuse)
+    timings["persist"] = time.perf_counter() - started
+    progress.finish()
+    return True
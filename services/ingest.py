@@ -0,0 +1,257 @@
+import argparse
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .db import connection
+from .gutenberg_ebook import scrape_gutenberg_metadata, get_ebook_data
+from .jobs import enqueue_analysis
+from .operations import create_database, insert_ebook_data, book_file_info
+from .search import index_book_metadata
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "16"))
+INGEST_PER_HOST = int(os.getenv("INGEST_PER_HOST", "4"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+PROGRESS_INTERVAL = 5  # seconds between progress lines
+INGEST_MAX_IDS = int(os.getenv("INGEST_MAX_IDS", "10000"))      # book ids one /ingest request may ask for
+INGEST_RUN_TTL = int(os.getenv("INGEST_RUN_TTL", "3600"))      # seconds a finished run stays in ingest_status
+INGEST_MAX_RUNS = int(os.getenv("INGEST_MAX_RUNS", "100"))     # finished runs kept at most
+
+# Ingestion runs started through the /ingest endpoint, by id, oldest first
+_runs = {}
+_runs_lock = threading.Lock()
+
+
+def parse_book_ids(spec, max_ids=None):
+    """
+    Parses "1-100,205,300-310" (or a list of such strings / ints) into a list of book ids.
+
+    Parameters:
+    spec (str, int or list): Book ids and inclusive ranges, comma separated.
+    max_ids (int, optional): Most ids allowed, counted before ranges are expanded. Unlimited if None.
+
+    Returns:
+    list: Book ids as strings, in order, without duplicates.
+
+    Raises:
+    ValueError: If the spec is malformed or names more than max_ids ids.
+    """
+    ranges = []
+    for item in spec if isinstance(spec, (list, tuple)) else [spec]:
+        for part in str(item).split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                first, last = (int(value) for value in part.split("-", 1)) if "-" in part else (int(part),) * 2
+            except ValueError:
+                raise ValueError("book_ids must be ids or ranges like 1-100") from None
+            ranges.append((first, last))
+    if max_ids is not None and sum(max(0, last - first + 1) for first, last in ranges) > max_ids:
+        raise ValueError(f"At most {max_ids} book ids can be ingested per request")
+    parts = itertools.chain.from_iterable(range(first, last + 1) for first, last in ranges)
+    return list(dict.fromkeys(str(book_id) for book_id in parts))
+
+
+class IngestProgress:
+    """Thread-safe counters for one ingestion run, including books/s and MB/s throughput."""
+
+    def __init__(self, total):
+        self.total = total
+        self.started = time.time()
+        self.finished = None
+        self.counts = {"ingested": 0, "skipped": 0, "not_found": 0, "failed": 0}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, outcome, size=0):
+        with self.lock:
+            self.counts[outcome] += 1
+            self.bytes += size
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = (self.finished or time.time()) - self.started
+            done = sum(self.counts.values())
+            return {
+                "total": self.total,
+                "done": done,
+                **self.counts,
+                "elapsed": round(elapsed, 2),
+                "books_per_second": round(self.counts["ingested"] / elapsed, 2) if elapsed else 0.0,
+                "mb_per_second": round(self.bytes / 1e6 / elapsed, 3) if elapsed else 0.0,
+                "finished": self.finished is not None,
+            }
+
+    def line(self):
+        stats = self.snapshot()
+        return (
+            f"[ingest] {stats['done']}/{stats['total']} done "
+            f"({stats['ingested']} ingested, {stats['skipped']} skipped, "
+            f"{stats['not_found']} not found, {stats['failed']} failed) "
+            f"{stats['books_per_second']} books/s, {stats['mb_per_second']} MB/s"
+        )
+
+
+def existing_book_ids(book_ids):
+    """Returns the subset of `book_ids` already present in the ebooks table."""
+    found = set()
+    with connection() as conn:
+        for start in range(0, len(book_ids), 500):
+            batch = book_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(
+                row[0] for row in conn.execute(f"SELECT book_id FROM ebooks WHERE book_id IN ({placeholders})", batch)
+            )
+    return found
+
+
+def _fetch_book(book_id, host_slots):
+    """
+    Scrapes metadata and downloads the text of one book, holding a per-host connection slot.
+
+    Returns:
+    tuple: (book_id, outcome, metadata, txt_path, size in bytes). txt_path is the path recorded
+           in ebooks like /fetch_book does; the text itself may already have been moved into the
+           content store, so the size comes from book_file_info.
+    """
+    with host_slots:
+        metadata, status = scrape_gutenberg_metadata(book_id)
+        if status != 200:
+            return book_id, "not_found" if status == 404 else "failed", metadata, None, 0
+        # An outage raises and is counted as failed, not as a book that does not exist
+        file_path, content = get_ebook_data(book_id, load_content=False, raise_errors=True)
+    info = book_file_info(book_id)
+    if content == "Ebook content not found" or info is None:
+        return book_id, "not_found", metadata, None, 0
+    return book_id, "ingested", metadata, file_path, info[0]
+
+
+def _write_batch(batch, analyze):
+    """Writes a batch of fetched books in a single transaction, then optionally queues analysis."""
+    with connection() as conn:
+        for book_id, metadata, file_path in batch:
+            insert_ebook_data(book_id, metadata, txt_path=file_path, conn=conn)
+            index_book_metadata(book_id, metadata, conn=conn)
+    if analyze:
+        for book_id, _, file_path in batch:
+            enqueue_analysis(book_id, file_path)
+
+
+def ingest_books(book_ids, workers=None, per_host=None, batch_size=None, analyze=False, progress=None, log=print):
+    """
+    Fetches many Gutenberg books concurrently and stores them like /fetch_book would.
+
+    Books already in the ebooks table are skipped. Metadata and text are fetched by a thread
+    pool, with at most `per_host` books talking to Gutenberg at once; rows are written in
+    batched transactions through insert_ebook_data.
+
+    Parameters:
+    book_ids (list): Book ids to ingest (see parse_book_ids).
+    workers (int, optional): Fetch threads. Defaults to INGEST_WORKERS.
+    per_host (int, optional): Concurrent books per upstream host. Defaults to INGEST_PER_HOST.
+    batch_size (int, optional): Rows per database transaction. Defaults to INGEST_BATCH_SIZE.
+    analyze (bool): Queue an analysis job for every ingested book.
+    progress (IngestProgress, optional): Counters to update, e.g. for the /ingest endpoint.
+    log (callable): Receives progress lines. Defaults to print.
+
+    Returns:
+    dict: Final progress snapshot.
+    """
+    workers = workers or INGEST_WORKERS
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    host_slots = threading.BoundedSemaphore(per_host or INGEST_PER_HOST)
+    progress = progress or IngestProgress(len(book_ids))
+
+    existing = existing_book_ids(book_ids)
+    for _ in existing:
+        progress.add("skipped")
+    pending = [book_id for book_id in book_ids if book_id not in existing]
+
+    batch = []
+    last_report = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_fetch_book, book_id, host_slots) for book_id in pending]
+        for future in as_completed(futures):
+            try:
+                book_id, outcome, metadata, file_path, size = future.result()
+                if outcome != "ingested":
+                    progress.add(outcome)
+                    continue
+                batch.append((book_id, metadata, file_path))
+                progress.add("ingested", size)
+                if len(batch) >= batch_size:
+                    _write_batch(batch, analyze)
+                    batch = []
+            except Exception as e:
+                log(f"[ingest] fetch failed: {e}")
+                progress.add("failed")
+                continue
+            if time.time() - last_report >= PROGRESS_INTERVAL:
+                log(progress.line())
+                last_report = time.time()
+    if batch:
+        _write_batch(batch, analyze)
+
+    progress.finished = time.time()
+    log(progress.line())
+    return progress.snapshot()
+
+
+def _evict_runs():
+    """Drops finished runs older than INGEST_RUN_TTL and all but the newest INGEST_MAX_RUNS finished ones."""
+    now = time.time()
+    finished = [run_id for run_id, progress in _runs.items() if progress.finished is not None]
+    for index, run_id in enumerate(finished):
+        if now - _runs[run_id].finished > INGEST_RUN_TTL or index < len(finished) - INGEST_MAX_RUNS:
+            del _runs[run_id]
+
+
+def start_ingest(book_ids, **options):
+    """Runs ingest_books in a background thread and returns the run id used by ingest_status()."""
+    run_id = uuid.uuid4().hex[:12]
+    progress = IngestProgress(len(book_ids))
+    with _runs_lock:
+        _evict_runs()
+        _runs[run_id] = progress
+    thread = threading.Thread(
+        target=ingest_books, args=(book_ids,), kwargs={**options, "progress": progress},
+        name=f"ingest-{run_id}", daemon=True
+    )
+    thread.start()
+    return run_id
+
+
+def ingest_status(run_id=None):
+    """Progress of one ingestion run, or of all runs in this process when run_id is None."""
+    with _runs_lock:
+        _evict_runs()
+        if run_id is not None:
+            progress = _runs.get(run_id)
+            return progress.snapshot() if progress else None
+        return {run_id: progress.snapshot() for run_id, progress in _runs.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest Project Gutenberg books into database.db and uploads/.")
+    parser.add_argument("book_ids", nargs="+", help="Book ids and ranges, e.g. 1-1000 1342 2600-2700")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="concurrent fetch threads")
+    parser.add_argument("--per-host", type=int, default=INGEST_PER_HOST, help="concurrent books per upstream host")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="rows per database transaction")
+    parser.add_argument("--analyze", action="store_true", help="queue LLM analysis for ingested books")
+    args = parser.parse_args()
+
+    create_database()
+    ingest_books(
+        parse_book_ids(args.book_ids),
+        workers=args.workers,
+        per_host=args.per_host,
+        batch_size=args.batch_size,
+        analyze=args.analyze,
+    )
+
+
+if __name__ == "__main__":
+    main()
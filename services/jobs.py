@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+from .gutenberg_ebook import process_analysis
+from .db import connection
+from .operations import update_ebook_data
+from .progress import notify_progress
+from .metrics import register_collector, current_trace_id, trace, log
+
+# Fixed-size pool of background threads draining the analysis_jobs table.
+_workers = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Condition()
+
+POLL_INTERVAL = 5  # seconds between queue checks when no enqueue notification arrives
+MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+
+
+def enqueue_analysis(book_id, file_path=None):
+    """
+    Queues an analysis job for a book unless one is not needed.
+
+    A book that already has a completed analysis is skipped, and a book with a queued or
+    running job reuses that job (single-flight), so repeated /fetch_book calls never
+    trigger duplicate LLM work. A failed analysis is queued again and shown as 'In Progress'.
+
+    Parameters:
+    book_id (str): The unique identifier of the eBook.
+    file_path (str, optional): The path of the downloaded text file.
+
+    Returns:
+    dict: {"job_id": int or None, "status": str, "created": bool}
+    """
+    book_id = str(book_id)
+    with connection() as conn:
+        analysis = conn.execute(
+            "SELECT status FROM ebook_analysis WHERE ebook_id = ?", (book_id,)
+        ).fetchone()
+        if analysis and analysis["status"] not in ("In Progress", "Analysis Failed"):
+            return {"job_id": None, "status": analysis["status"], "created": False}
+
+        # The partial unique index on active jobs keeps this to one queued or running job per book
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO analysis_jobs (book_id, file_path, status, trace_id) VALUES (?, ?, 'queued', ?)",
+            (book_id, file_path, current_trace_id()),
+        )
+        created = cursor.rowcount == 1
+        if created and analysis and analysis["status"] == "Analysis Failed":
+            # process_analysis only runs analyses that are 'In Progress'
+            conn.execute("UPDATE ebook_analysis SET status = 'In Progress' WHERE ebook_id = ?", (book_id,))
+        job = conn.execute(
+            "SELECT id, status FROM analysis_jobs WHERE book_id = ? AND status IN ('queued', 'running')",
+            (book_id,),
+        ).fetchone()
+
+    if created:
+        with _wakeup:
+            _wakeup.notify()
+    if job is None:
+        # The job finished between the insert and the lookup
+        return {"job_id": None, "status": "done", "created": created}
+    return {"job_id": job["id"], "status": job["status"], "created": created}
+
+
+def claim_next_job():
+    """Atomically moves the oldest queued job to 'running' and returns it, or None if the queue is empty."""
+    with connection() as conn:
+        while True:
+            row = conn.execute(
+                "SELECT id, book_id, file_path, trace_id FROM analysis_jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            cursor = conn.execute(
+                """
+                UPDATE analysis_jobs
+                SET status = 'running', attempts = attempts + 1, started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+                """,
+                (row["id"],),
+            )
+            conn.commit()
+            if cursor.rowcount == 1:
+                return dict(row)
+            # Another worker claimed it first; try the next one
+
+
+def finish_job(job_id, status, timings, error=None):
+    with connection() as conn:
+        conn.execute(
+            """
+            UPDATE analysis_jobs
+            SET status = ?, timings = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (status, json.dumps(timings), error, job_id),
+        )
+
+
+def run_job(job):
+    """
+    Runs process_analysis for a claimed job and records the outcome and per-stage timings.
+
+    The job runs under the trace id of the request that queued it, so its log lines can be
+    matched with that request's.
+    """
+    timings = {}
+    with trace(job.get("trace_id"), book_id=job["book_id"]):
+        try:
+            process_analysis(job["file_path"], job["book_id"], timings=timings)
+            finish_job(job["id"], "done", timings)
+        except Exception as e:
+            log(f"Analysis job {job['id']} failed: {e}", job_id=job["id"])
+            update_ebook_data(job["book_id"], "", "", "", "", "", "Analysis Failed")
+            finish_job(job["id"], "failed", timings, error=str(e))
+            notify_progress(job["book_id"])
+
+
+def recover_jobs():
+    """
+    Recovers work interrupted by a crash or restart.
+
+    Jobs left 'running' are re-queued (or failed once they exceed ANALYSIS_MAX_ATTEMPTS), and
+    analyses stuck 'In Progress' without an active job get a new job.
+    """
+    with connection() as conn:
+        conn.execute(
+            """
+            UPDATE analysis_jobs
+            SET status = 'failed', error = 'Exceeded maximum attempts', finished_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND attempts >= ?
+            """,
+            (MAX_ATTEMPTS,),
+        )
+        requeued = conn.execute(
+            "UPDATE analysis_jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+        ).rowcount
+        orphans = conn.execute(
+            """
+            SELECT ebook_id FROM ebook_analysis
+            WHERE status = 'In Progress'
+            AND CAST(ebook_id AS TEXT) NOT IN (
+                SELECT book_id FROM analysis_jobs WHERE status IN ('queued', 'running')
+            )
+            """
+        ).fetchall()
+
+    for row in orphans:
+        enqueue_analysis(row["ebook_id"])
+    if requeued or orphans:
+        log(f"Recovered {requeued} interrupted jobs and {len(orphans)} orphaned analyses")
+
+
+def _worker_loop():
+    while True:
+        job = claim_next_job()
+        if job is None:
+            with _wakeup:
+                _wakeup.wait(timeout=POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def start_workers(num_workers=None, recover=None):
+    """
+    Starts the analysis worker pool once per process and recovers interrupted jobs.
+
+    Recovery re-queues every 'running' job, so it must only run while no other process is
+    working on the queue: a launcher of several server processes (services.serve) runs
+    recover_jobs once itself and sets ANALYSIS_RECOVER=0 for them.
+
+    Parameters:
+    num_workers (int, optional): Pool size. Defaults to ANALYSIS_WORKERS or 2.
+    recover (bool, optional): Run recover_jobs first. Defaults to ANALYSIS_RECOVER (on).
+    """
+    with _workers_lock:
+        if _workers:
+            return
+        if recover is None:
+            recover = os.getenv("ANALYSIS_RECOVER", "1") != "0"
+        if recover:
+            recover_jobs()
+        if num_workers is None:
+            num_workers = int(os.getenv("ANALYSIS_WORKERS", "2"))
+        for i in range(num_workers):
+            thread = threading.Thread(target=_worker_loop, name=f"analysis-worker-{i}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def _collect_metrics():
+    with connection() as conn:
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM analysis_jobs WHERE status IN ('queued', 'running') GROUP BY status"
+        ).fetchall())
+    return [
+        ("analysis_jobs", "gauge", "Analysis jobs waiting or running (all processes sharing the database).",
+         [({"status": status}, counts.get(status, 0)) for status in ("queued", "running")]),
+        ("analysis_workers", "gauge", "Analysis worker threads started in this process.", [({}, len(_workers))]),
+        ("process_threads", "gauge", "Live threads in this process.", [({}, threading.active_count())]),
+    ]
+
+
+register_collector(_collect_metrics)
+
+
+def job_stats(recent=20):
+    """
+    Summarises the job queue for the /jobs endpoint.
+
+    Returns:
+    dict: Worker count, queue depth, running jobs with elapsed seconds, the most recent
+          finished jobs with their stage timings, and average seconds per stage.
+    """
+    with connection() as conn:
+        queue_depth = conn.execute(
+            "SELECT COUNT(*) FROM analysis_jobs WHERE status = 'queued'"
+        ).fetchone()[0]
+        running = conn.execute(
+            """
+            SELECT id, book_id, attempts, started_at,
+                   (julianday('now') - julianday(started_at)) * 86400 AS elapsed
+            FROM analysis_jobs WHERE status = 'running' ORDER BY started_at
+            """
+        ).fetchall()
+        finished = conn.execute(
+            """
+            SELECT id, book_id, status, attempts, error, timings, started_at, finished_at
+            FROM analysis_jobs WHERE status IN ('done', 'failed')
+            ORDER BY finished_at DESC, id DESC LIMIT ?
+            """,
+            (recent,),
+        ).fetchall()
+
+    recent_jobs = []
+    stage_totals = {}
+    stage_counts = {}
+    for row in finished:
+        job = dict(row)
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else {}
+        for stage, seconds in job["timings"].items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+            stage_counts[stage] = stage_counts.get(stage, 0) + 1
+        recent_jobs.append(job)
+
+    return {
+        "workers": len(_workers),
+        "queue_depth": queue_depth,
+        "running": [dict(row) for row in running],
+        "recent": recent_jobs,
+        "stage_averages": {stage: stage_totals[stage] / stage_counts[stage] for stage in stage_totals},
+    }
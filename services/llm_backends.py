@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from collections import namedtuple
+import requests
+from requests.adapters import HTTPAdapter
+from .stub_llm import StubLLMClient
+from .metrics import LLM_CALLS, LLM_SECONDS, LLM_TOKENS
+
+MODEL_NAME = "llama-3.3-70b-versatile"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # seconds per call
+STAGES = ("chunk", "reduce")
+
+# content plus token counts (None when the backend does not report them) and wall-clock latency
+Completion = namedtuple("Completion", ["content", "prompt_tokens", "completion_tokens", "latency"])
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+class BackendMetrics:
+    """Thread-safe per-backend call, error, token and latency counters."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, completion):
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += completion.prompt_tokens or 0
+            self.completion_tokens += completion.completion_tokens or 0
+            self.latency_total += completion.latency
+            self.latency_max = max(self.latency_max, completion.latency)
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "latency_avg": round(self.latency_total / self.calls, 4) if self.calls else 0.0,
+                "latency_max": round(self.latency_max, 4),
+            }
+
+
+class LLMBackend:
+    """
+    A chat-completion backend bound to one model.
+
+    Subclasses implement _complete(); complete() adds timing and metrics. A backend object is
+    created once per stage (see get_llm_backend) and shared by all threads, so any HTTP
+    connection pool it holds is reused across calls.
+    """
+
+    name = "base"
+
+    def __init__(self, model, timeout=LLM_TIMEOUT):
+        self.model = model
+        self.timeout = timeout
+        self.metrics = BackendMetrics()
+        self.stage = "default"  # set by get_llm_backend; labels the Prometheus series
+
+    def complete(self, prompt, system_prompt="You are a helpful assistant.", temperature=0.5):
+        """
+        Sends one chat completion.
+
+        Returns:
+        Completion: The response content, token counts and latency in seconds.
+
+        Raises:
+        Exception: Whatever the underlying client raises; HTTP errors keep their status code so
+                   throttle.call_with_retry can decide whether to retry.
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        labels = (self.stage, self.name, self.model)
+        started = time.perf_counter()
+        try:
+            content, prompt_tokens, completion_tokens = self._complete(messages, temperature)
+        except Exception:
+            self.metrics.record_error()
+            LLM_CALLS.inc(*labels, "error")
+            LLM_SECONDS.observe(*labels, value=time.perf_counter() - started)
+            raise
+        completion = Completion(content, prompt_tokens, completion_tokens, time.perf_counter() - started)
+        self.metrics.record(completion)
+        LLM_CALLS.inc(*labels, "ok")
+        LLM_SECONDS.observe(*labels, value=completion.latency)
+        LLM_TOKENS.inc(*labels, "prompt", amount=prompt_tokens or 0)
+        LLM_TOKENS.inc(*labels, "completion", amount=completion_tokens or 0)
+        return completion
+
+    def _complete(self, messages, temperature):
+        raise NotImplementedError
+
+    def describe(self):
+        return {"backend": self.name, "model": self.model, **self.metrics.snapshot()}
+
+
+class ChatClientBackend(LLMBackend):
+    """Backend over any SDK-style client exposing client.chat.completions.create (Groq, StubLLMClient, ...)."""
+
+    def __init__(self, client, model, timeout=LLM_TIMEOUT, name="client"):
+        super().__init__(model, timeout)
+        self.client = client
+        self.name = name
+
+    def _complete(self, messages, temperature):
+        chat_completion = self.client.chat.completions.create(
+            messages=messages,
+            model=self.model,
+            temperature=temperature,
+            timeout=self.timeout,
+        )
+        usage = getattr(chat_completion, "usage", None)
+        return (
+            chat_completion.choices[0].message.content,
+            getattr(usage, "prompt_tokens", None),
+            getattr(usage, "completion_tokens", None),
+        )
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Backend for any OpenAI-compatible /chat/completions HTTP endpoint (OpenAI, vLLM, llama.cpp
+    server, Ollama, ...), using a pooled requests.Session.
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url, api_key, model, timeout=LLM_TIMEOUT, pool_size=16):
+        super().__init__(model, timeout)
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def _complete(self, messages, temperature):
+        response = self.session.post(
+            self.url,
+            json={"model": self.model, "messages": messages, "temperature": temperature},
+            timeout=self.timeout,
+        )
+        # HTTPError carries the response, so call_with_retry sees 429/5xx status codes
+        response.raise_for_status()
+        body = response.json()
+        usage = body.get("usage") or {}
+        return (
+            body["choices"][0]["message"]["content"],
+            usage.get("prompt_tokens"),
+            usage.get("completion_tokens"),
+        )
+
+
+def _stage_setting(stage, name, default=None):
+    """LLM_<STAGE>_<NAME>, falling back to LLM_<NAME>, then `default`."""
+    return os.getenv(f"LLM_{stage.upper()}_{name}") or os.getenv(f"LLM_{name}") or default
+
+
+def create_backend(kind, model, timeout=LLM_TIMEOUT):
+    """
+    Builds a backend.
+
+    Parameters:
+    kind (str): "groq", "openai" (any OpenAI-compatible endpoint at LLM_BASE_URL) or "stub"
+                (deterministic offline answers, see services.stub_llm).
+    model (str): Model name sent to the backend; also part of the llm_cache key.
+    timeout (float): Per-call timeout in seconds.
+    """
+    if kind == "stub":
+        client = StubLLMClient(
+            latency=float(os.getenv("STUB_LLM_LATENCY", "0")),
+            malformed_rate=float(os.getenv("STUB_LLM_MALFORMED_RATE", "0")),
+        )
+        return ChatClientBackend(client, model, timeout, name="stub")
+    if kind == "openai":
+        return OpenAICompatibleBackend(
+            os.getenv("LLM_BASE_URL", "https://api.openai.com/v1"),
+            os.getenv("LLM_API_KEY") or os.getenv("API_KEY"),
+            model,
+            timeout,
+        )
+    if kind == "groq":
+        from groq import Groq
+        return ChatClientBackend(Groq(api_key=os.getenv("API_KEY")), model, timeout, name="groq")
+    raise ValueError(f"Unknown LLM backend: {kind}")
+
+
+def get_llm_backend(stage="chunk"):
+    """
+    Returns the shared backend for an analysis stage ("chunk" or "reduce").
+
+    The backend kind and model come from LLM_<STAGE>_BACKEND / LLM_<STAGE>_MODEL, falling back
+    to LLM_BACKEND (default "groq") and LLM_MODEL (default MODEL_NAME), so e.g. chunk
+    summaries can run on a smaller, faster model than the final reduce.
+    """
+    kind = _stage_setting(stage, "BACKEND", "groq")
+    model = _stage_setting(stage, "MODEL", MODEL_NAME)
+    with _backends_lock:
+        backend = _backends.get((stage, kind, model))
+        if backend is None:
+            backend = create_backend(kind, model)
+            backend.stage = stage
+            _backends[(stage, kind, model)] = backend
+        return backend
+
+
+def as_backend(client):
+    """Wraps a raw SDK client (e.g. a Groq() instance) as a backend; backends are returned unchanged."""
+    if isinstance(client, LLMBackend):
+        return client
+    return ChatClientBackend(client, MODEL_NAME)
+
+
+def llm_metrics():
+    """Per-stage backend description and call/token/latency counters for the backends in use."""
+    with _backends_lock:
+        backends = dict(_backends)
+    return {stage: backend.describe() for (stage, _, _), backend in backends.items()}
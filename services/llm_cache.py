@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from .db import connection
+from .metrics import register_collector, labelled
+
+# Size- and age-based eviction limits for the llm_cache table.
+MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "90"))
+EVICT_EVERY = 100  # run eviction after this many writes
+
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+
+
+def cache_key(model, temperature, prompt_version, text):
+    """Content-addressed key: identical inputs under the same model and prompt map to the same entry."""
+    payload = json.dumps([model, temperature, prompt_version, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(key):
+    """Returns the cached response for `key`, or None on a miss or expired entry."""
+    now = time.time()
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and now - row["created_at"] <= MAX_AGE_DAYS * 86400:
+            conn.execute(
+                "UPDATE llm_cache SET hits = hits + 1, last_used = ? WHERE key = ?", (now, key)
+            )
+            _count("hits")
+            return row["response"]
+    _count("misses")
+    return None
+
+
+def put_cached_response(key, model, response):
+    """Stores a response and periodically evicts old or least-recently-used entries."""
+    now = time.time()
+    with connection() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO llm_cache (key, model, response, size, hits, created_at, last_used)
+            VALUES (?, ?, ?, ?, 0, ?, ?)
+            """,
+            (key, model, response, len(response.encode("utf-8")), now, now),
+        )
+    if _count("writes") % EVICT_EVERY == 1:
+        evict_cache()
+
+
+def evict_cache(max_bytes=None, max_age_days=None):
+    """
+    Removes expired entries, then the least recently used ones until the cache fits in `max_bytes`.
+
+    Returns:
+    int: Number of entries removed.
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    max_age_days = MAX_AGE_DAYS if max_age_days is None else max_age_days
+    with connection() as conn:
+        removed = conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - max_age_days * 86400,)
+        ).rowcount
+        removed += conn.execute(
+            """
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running_size
+                    FROM llm_cache
+                ) WHERE running_size > ?
+            )
+            """,
+            (max_bytes,),
+        ).rowcount
+    if removed:
+        _count("evictions", removed)
+    return removed
+
+
+def cached_completion(model, temperature, prompt_version, text, request, validate=None):
+    """
+    Returns a cached LLM response for `text`, calling `request()` only on a miss.
+
+    Parameters:
+    model (str): Model name, part of the cache key.
+    temperature (float): Sampling temperature, part of the cache key.
+    prompt_version (int): Version of the prompt template, bump it when the template changes.
+    text (str): The variable input (chunk text or merged output).
+    request (callable): Zero-argument callable returning the response string.
+    validate (callable, optional): Only responses for which validate(response) is truthy are stored.
+
+    Returns:
+    str: The response content.
+    """
+    key = cache_key(model, temperature, prompt_version, text)
+    response = get_cached_response(key)
+    if response is not None:
+        return response
+    response = request()
+    if response and (validate is None or validate(response)):
+        put_cached_response(key, model, response)
+    return response
+
+
+def cache_stats():
+    """Returns the in-process hit/miss counters plus the current entry count and size."""
+    with connection() as conn:
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = entries
+    stats["bytes"] = size
+    return stats
+
+
+def _collect_metrics():
+    with _stats_lock:
+        stats = dict(_stats)
+    return [("llm_cache_events_total", "counter", "llm_cache lookups and maintenance (hits, misses, writes, evictions).",
+             labelled(stats, "event"))]
+
+
+register_collector(_collect_metrics)
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+        return _stats[name]
@@ -0,0 +1,188 @@
+import json
+import re
+import threading
+from .metrics import register_collector, labelled
+
+# Fields of an analysis object and the type each is normalised to
+ANALYSIS_SCHEMA = {
+    "summary": str,
+    "sentiment": str,
+    "language": str,
+    "key_characters": list,
+    "themes": list,
+}
+MAX_REPAIR_CUTS = 8  # how many trailing members a truncated response may lose
+MAX_START_POSITIONS = 16  # "{" / "[" positions tried when the JSON is embedded in prose
+
+_FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)(?:```|\Z)", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_decoder = json.JSONDecoder()
+
+_stats = {
+    "responses": 0,          # responses parsed
+    "clean": 0,              # parsed as-is (bare or fenced JSON)
+    "recovered": 0,          # needed prose stripping, comma fixes or truncation repair
+    "parse_failures": 0,     # no JSON could be recovered
+    "schema_failures": 0,    # JSON, but not a usable analysis
+    "rerequests": 0,         # chunks or final prompts sent again because of the above
+    "wasted_calls": 0,       # LLM responses that were thrown away
+}
+_stats_lock = threading.Lock()
+
+
+def count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _collect_metrics():
+    with _stats_lock:
+        stats = dict(_stats)
+    return [("llm_response_parse_total", "counter", "LLM responses by parsing outcome (see parse_stats).",
+             labelled(stats, "outcome"))]
+
+
+register_collector(_collect_metrics)
+
+
+def parse_stats():
+    """Returns the parsing counters and the parse-failure rate since the process started."""
+    with _stats_lock:
+        stats = dict(_stats)
+    failures = stats["parse_failures"] + stats["schema_failures"]
+    stats["failure_rate"] = failures / stats["responses"] if stats["responses"] else 0.0
+    return stats
+
+
+def _candidates(raw_string):
+    """Text fragments that may hold the JSON: fenced blocks first (closed or not), then the whole string."""
+    fragments = [match.group(1) for match in _FENCE.finditer(raw_string)]
+    fragments.append(raw_string)
+    return [fragment.strip() for fragment in fragments if fragment.strip()]
+
+
+def _decode_embedded(text):
+    """Decodes the first JSON object/array in `text`, ignoring prose before and after it."""
+    starts = [start for start, char in enumerate(text) if char in "{["][:MAX_START_POSITIONS]
+    for start in starts:
+        for attempt in (text[start:], _TRAILING_COMMA.sub(r"\1", text[start:])):
+            try:
+                return _decoder.raw_decode(attempt)[0]
+            except ValueError:
+                pass
+        repaired = _repair_truncated(text[start:])
+        if repaired is not None:
+            return repaired
+    return None
+
+
+def _repair_truncated(text):
+    """
+    Closes a JSON value cut off mid-way (e.g. by max_tokens): an open string is terminated and
+    open objects/arrays are closed. If the last member is itself incomplete it is dropped by
+    cutting back to an earlier comma.
+    """
+    closers, in_string, escaped = [], False, False
+    cuts = []  # (comma position, closers needed at that point)
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not closers:
+                break
+            closers.pop()
+        elif char == ",":
+            cuts.append((position, "".join(reversed(closers))))
+    if not closers and not in_string:
+        return None  # not truncated, just invalid
+    body = text[:-1] if escaped else text
+    attempts = [body + ('"' if in_string else "") + "".join(reversed(closers))]
+    attempts += [text[:position] + closing for position, closing in reversed(cuts[-MAX_REPAIR_CUTS:])]
+    for attempt in attempts:
+        try:
+            return json.loads(_TRAILING_COMMA.sub(r"\1", attempt))
+        except ValueError:
+            continue
+    return None
+
+
+def parse_json_response(raw_string):
+    """
+    Extracts a JSON value from an LLM response, tolerating everything models commonly add.
+
+    Accepts bare JSON, ```/```json fenced JSON, prose before or after the JSON, trailing
+    commas and responses truncated mid-object. Every call is counted in parse_stats().
+
+    Parameters:
+    raw_string (str): The response content.
+
+    Returns:
+    dict or list: The decoded value, or None if nothing could be recovered.
+    """
+    count("responses")
+    if not raw_string:
+        count("parse_failures")
+        return None
+    candidates = _candidates(raw_string)
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, (dict, list)):
+            count("clean")
+            return value
+    for candidate in candidates:
+        value = _decode_embedded(candidate)
+        if isinstance(value, (dict, list)):
+            count("recovered")
+            return value
+    count("parse_failures")
+    return None
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    if isinstance(value, list):
+        return [item if isinstance(item, str) else json.dumps(item) for item in value if item not in (None, "")]
+    return [str(value)]
+
+
+def _as_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return " ".join(str(item) for item in value)
+    return value if isinstance(value, str) else str(value)
+
+
+def validate_analysis(value):
+    """
+    Checks an analysis object against ANALYSIS_SCHEMA and normalises it.
+
+    Strings become lists (split on commas) where a list is expected and lists are joined where
+    text is expected; unknown keys are dropped. An object without a non-empty summary is
+    rejected.
+
+    Returns:
+    dict: The normalised analysis, or None (counted as a schema failure).
+    """
+    if not isinstance(value, dict) or not _as_text(value.get("summary")).strip():
+        count("schema_failures")
+        return None
+    return {
+        field: _as_list(value.get(field)) if kind is list else _as_text(value.get(field))
+        for field, kind in ANALYSIS_SCHEMA.items()
+    }
@@ -0,0 +1,250 @@
+import json
+import os
+import re
+import threading
+import time
+import httpx
+import requests
+from bs4 import BeautifulSoup
+from .db import connection
+from .downloader import get_http_session, HTTP_TIMEOUT
+from .metrics import register_collector, labelled
+
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", str(7 * 86400)))           # seconds
+METADATA_NEGATIVE_TTL = float(os.getenv("METADATA_NEGATIVE_TTL", "86400"))            # for 404s
+# Directory of saved book pages (<book_id>.html); fetched pages are saved there too
+METADATA_HTML_DIR = os.getenv("METADATA_HTML_DIR")
+# Never touch the network: answer from the cache and METADATA_HTML_DIR only
+METADATA_OFFLINE = os.getenv("METADATA_OFFLINE", "0") == "1"
+READ_BLOCK_SIZE = 16 * 1024
+
+_BIBREC_START = re.compile(r"<table[^>]*\bclass=[\"'][^\"']*\bbibrec\b", re.IGNORECASE)
+_TABLE_END = re.compile(r"</table\s*>", re.IGNORECASE)
+
+_stats = {"fresh": 0, "revalidated": 0, "fetched": 0, "offline": 0, "stale": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def metadata_stats():
+    """How metadata lookups were answered since the process started."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+register_collector(lambda: [(
+    "metadata_lookups_total", "counter", "Gutenberg metadata lookups by how they were answered.",
+    labelled(metadata_stats(), "source"),
+)])
+
+
+def bibrec_slice(html):
+    """Returns just the <table class="bibrec">...</table> markup of a book page, or None."""
+    start = _BIBREC_START.search(html)
+    if not start:
+        return None
+    end = _TABLE_END.search(html, start.end())
+    return html[start.start():end.end()] if end else None
+
+
+def parse_bibrec(html):
+    """
+    Reads the bibrec table of a Gutenberg book page into {header: value}.
+
+    Only the table itself is handed to BeautifulSoup (a few KB instead of the whole page),
+    with the same get_text(strip=True) extraction as before.
+    """
+    table_html = bibrec_slice(html)
+    soup = BeautifulSoup(table_html if table_html is not None else html, "html.parser")
+    table = soup.find("table", class_="bibrec")
+    metadata = {}
+    if table:
+        for row in table.find_all("tr"):
+            th = row.find("th")
+            td = row.find("td")
+            if th and td:
+                metadata[th.get_text(strip=True)] = td.get_text(strip=True)
+    return metadata
+
+
+def _read_until_bibrec(response):
+    """Reads a streamed page only until the bibrec table has been closed."""
+    response.encoding = response.encoding or "utf-8"
+    html = ""
+    for block in response.iter_content(READ_BLOCK_SIZE, decode_unicode=True):
+        html += block
+        start = _BIBREC_START.search(html)
+        if start and _TABLE_END.search(html, start.end()):
+            break
+    return html
+
+
+def _saved_page_path(book_id):
+    return os.path.join(METADATA_HTML_DIR, f"{book_id}.html") if METADATA_HTML_DIR else None
+
+
+def _save_page(book_id, html):
+    path = _saved_page_path(book_id)
+    if path:
+        os.makedirs(METADATA_HTML_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(html)
+
+
+def _load_cached(book_id):
+    with connection() as conn:
+        return conn.execute("SELECT * FROM metadata_cache WHERE book_id = ?", (str(book_id),)).fetchone()
+
+
+def _store(book_id, metadata, status, etag=None, last_modified=None):
+    with connection() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO metadata_cache (book_id, metadata, status, etag, last_modified, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (str(book_id), json.dumps(metadata), status, etag, last_modified, time.time()),
+        )
+
+
+def _is_fresh(row):
+    ttl = METADATA_CACHE_TTL if row["status"] == 200 else METADATA_NEGATIVE_TTL
+    return time.time() - row["fetched_at"] < ttl
+
+
+def _answer_locally(book_id):
+    """
+    The part of a lookup that needs no request.
+
+    Returns:
+    tuple: ((metadata, status) or None, cached row or None); the answer is None when the page
+           has to be fetched.
+    """
+    row = _load_cached(book_id)
+    if row is not None and _is_fresh(row):
+        _count("fresh")
+        return (json.loads(row["metadata"]), row["status"]), row
+
+    if METADATA_OFFLINE:
+        path = _saved_page_path(book_id)
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                metadata = parse_bibrec(file.read())
+            _store(book_id, metadata, 200)
+            _count("offline")
+            return (metadata, 200), row
+        if row is not None:
+            _count("stale")
+            return (json.loads(row["metadata"]), row["status"]), row
+        _count("errors")
+        return ({"error": "offline: no saved page for this ebook"}, 500), row
+    return None, row
+
+
+def _revalidation_headers(row):
+    headers = {}
+    if row is not None and row["status"] == 200:
+        if row["etag"]:
+            headers["If-None-Match"] = row["etag"]
+        if row["last_modified"]:
+            headers["If-Modified-Since"] = row["last_modified"]
+    return headers
+
+
+def _not_modified(book_id, row):
+    _store(book_id, json.loads(row["metadata"]), 200, row["etag"], row["last_modified"])
+    _count("revalidated")
+    return json.loads(row["metadata"]), 200
+
+
+def _not_found(book_id):
+    _store(book_id, {"error": "ebook not found"}, 404)
+    _count("fetched")
+    return {"error": "ebook not found"}, 404
+
+
+def _unreachable(row, error):
+    if row is not None:
+        _count("stale")
+        return json.loads(row["metadata"]), row["status"]
+    _count("errors")
+    return {"error": str(error)}, 500
+
+
+def _fetched(book_id, html, etag, last_modified):
+    metadata = parse_bibrec(html)
+    _save_page(book_id, html)
+    _store(book_id, metadata, 200, etag, last_modified)
+    _count("fetched")
+    return metadata, 200
+
+
+def get_metadata(book_id, base_url, session=None, timeout=HTTP_TIMEOUT):
+    """
+    Metadata of a Gutenberg book: from metadata_cache while fresh, otherwise scraped.
+
+    - Fresh entries (METADATA_CACHE_TTL, METADATA_NEGATIVE_TTL for 404s) need no request.
+    - Stale entries are revalidated with If-None-Match / If-Modified-Since; a 304 only renews them.
+    - Pages are streamed and read only up to the end of the bibrec table.
+    - A saved page in METADATA_HTML_DIR is used when offline (METADATA_OFFLINE=1) and saved
+      there after every fetch otherwise.
+    - If Gutenberg cannot be reached, a stale entry is returned rather than an error.
+
+    Returns:
+    dict, int: Same contract as scrape_gutenberg_metadata.
+    """
+    answer, row = _answer_locally(book_id)
+    if answer is not None:
+        return answer
+
+    url = f"{base_url}/ebooks/{book_id}"
+    try:
+        with (session or get_http_session()).get(
+            url, headers=_revalidation_headers(row), timeout=timeout, stream=True
+        ) as response:
+            if response.status_code == 304 and row is not None:
+                return _not_modified(book_id, row)
+            if response.status_code == 404:
+                return _not_found(book_id)
+            response.raise_for_status()
+            html = _read_until_bibrec(response)
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except requests.exceptions.RequestException as e:
+        return _unreachable(row, e)
+    return _fetched(book_id, html, etag, last_modified)
+
+
+async def get_metadata_async(book_id, base_url, client=None):
+    """
+    Non-blocking twin of get_metadata for the ASGI serving mode: the page is fetched with httpx
+    on the event loop, the cache and the parsing run in the services.aio thread pool.
+    """
+    from .aio import get_async_http_client, run_sync
+
+    answer, row = await run_sync(_answer_locally, book_id)
+    if answer is not None:
+        return answer
+
+    client = client or get_async_http_client()
+    url = f"{base_url}/ebooks/{book_id}"
+    try:
+        async with client.stream("GET", url, headers=_revalidation_headers(row)) as response:
+            if response.status_code == 304 and row is not None:
+                return await run_sync(_not_modified, book_id, row)
+            if response.status_code == 404:
+                return await run_sync(_not_found, book_id)
+            response.raise_for_status()
+            html = ""
+            async for block in response.aiter_text(READ_BLOCK_SIZE):
+                html += block
+                start = _BIBREC_START.search(html)
+                if start and _TABLE_END.search(html, start.end()):
+                    break
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except httpx.HTTPError as e:
+        return _unreachable(row, e)
+    return await run_sync(_fetched, book_id, html, etag, last_modified)
@@ -0,0 +1,276 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# In-process metrics in the Prometheus text exposition format (served by /metrics) and
+# trace-id aware logging. Dependency free: a handful of counters, gauges and histograms
+# guarded by locks, which is all the app needs.
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (one object per line)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_book_id = contextvars.ContextVar("book_id", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of series, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {label_values}")
+        return tuple(str(value) for value in label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, *label_values, value):
+        key = self._key(label_values)
+        with self.lock:
+            self.series[key] = value
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    @contextmanager
+    def track(self, *label_values):
+        """Counts the `with` block as in flight while it runs."""
+        self.inc(*label_values)
+        try:
+            yield
+        finally:
+            self.dec(*label_values)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *label_values, value):
+        key = self._key(label_values)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # per-bucket counts (not cumulative), then sum and count
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes the duration of the `with` block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*label_values, value=time.perf_counter() - started)
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labels, key, [f'le="{_format_value(float(bound))}"'])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, key, ['le="+Inf"'])
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+def register_collector(collector):
+    """
+    Adds a callable run on every scrape. It returns (name, kind, help, [(labels dict, value)])
+    tuples, for values that are cheaper to read on demand (queue depth, cache counters).
+    """
+    with _registry_lock:
+        _collectors.append(collector)
+
+
+def labelled(values, label):
+    """[({label: key}, value)] samples of a dict of numeric counters, for collectors."""
+    return [({label: key}, value) for key, value in sorted(values.items()) if isinstance(value, (int, float))]
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        metrics, collectors = list(_metrics), list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collector in collectors:
+        try:
+            families = collector()
+        except Exception as e:
+            log(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+            continue
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = _format_labels(labels.keys(), labels.values())
+                lines.append(f"{name}{label_text} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, per route.", ("route", "method", "status")
+)
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in each pipeline stage (scrape, download, read, stats, chunk, map, reduce, persist).",
+    ("stage",),
+)
+LLM_CALLS = Counter("llm_calls_total", "LLM chat completions sent, by outcome.", ("stage", "backend", "model", "outcome"))
+LLM_SECONDS = Histogram("llm_call_duration_seconds", "LLM chat completion latency.", ("stage", "backend", "model"))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the LLM backends.", ("stage", "backend", "model", "kind"))
+DB_QUERY_SECONDS = Histogram(
+    "sqlite_query_duration_seconds", "SQLite statement execution time, by statement type and table.",
+    ("statement",), buckets=QUERY_BUCKETS,
+)
+IN_FLIGHT = Gauge("in_flight", "Work currently running in this process (http_request, download, analysis).", ("kind",))
+
+
+@contextmanager
+def stage_timer(stage, timings=None):
+    """Times a pipeline stage into STAGE_SECONDS and, if given, timings[stage]."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(stage, value=elapsed)
+        if timings is not None:
+            timings[stage] = elapsed
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id=None, book_id=None):
+    """
+    Binds a trace id (a new one unless given or already bound) and optionally a book id to
+    everything logged inside the `with` block.
+
+    Yields:
+    str: The trace id in effect.
+    """
+    trace_id = trace_id or _trace_id.get() or new_trace_id()
+    trace_token = _trace_id.set(trace_id)
+    book_token = _book_id.set(str(book_id)) if book_id is not None else None
+    try:
+        yield trace_id
+    finally:
+        if book_token is not None:
+            _book_id.reset(book_token)
+        _trace_id.reset(trace_token)
+
+
+def traced(function):
+    """Wraps `function` so worker threads (thread pools) log with the caller's trace and book id."""
+    trace_id, book_id = _trace_id.get(), _book_id.get()
+
+    def run(*args, **kwargs):
+        with trace(trace_id, book_id):
+            return function(*args, **kwargs)
+    return run
+
+
+def log(message, **fields):
+    """
+    Prints a log line carrying the current trace id and book id.
+
+    With LOG_FORMAT=json each line is a JSON object {"ts", "message", "trace_id", "book_id", ...fields};
+    otherwise it is "[trace=... book=...] message key=value ...".
+    """
+    trace_id, book_id = _trace_id.get(), _book_id.get()
+    if LOG_FORMAT == "json":
+        record = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "message": message}
+        if trace_id:
+            record["trace_id"] = trace_id
+        if book_id:
+            record["book_id"] = book_id
+        record.update(fields)
+        print(json.dumps(record, default=str), flush=True)
+        return
+    context = " ".join(
+        part for part in (f"trace={trace_id}" if trace_id else "", f"book={book_id}" if book_id else "") if part
+    )
+    extra = " ".join(f"{key}={value}" for key, value in fields.items())
+    print(" ".join(part for part in (f"[{context}]" if context else "", message, extra) if part), flush=True)
@@ -0,0 +1,167 @@
+import json
+import re
+from .db import connection
+
+MAX_HEADER_FRACTION = 0.5   # start markers are only looked for in the first half of a book
+MAX_TOC_FRACTION = 0.1      # a table of contents never spans more than this share of the text
+MAX_HEADING_LENGTH = 80
+
+_START_MARKERS = re.compile(
+    r"^\*{3}\s*START OF (?:THE|THIS) PROJECT GUTENBERG.*$"
+    r"|^\*+END\*+THE SMALL PRINT.*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_END_MARKERS = re.compile(
+    r"^\*{3}\s*END OF (?:THE|THIS) PROJECT GUTENBERG"
+    r"|^End of (?:the |this )?Project Gutenberg"
+    r"|^\*{3}\s*START: FULL LICENSE",
+    re.IGNORECASE | re.MULTILINE,
+)
+_PRODUCER_NOTE = re.compile(r"\A(?:Produced by|E-?text prepared by|Transcribed (?:from|by))[^\n]*(?:\n[^\n]+)*\n*", re.IGNORECASE)
+_LINE_BREAK = re.compile(r"\r+\n?")
+_ILLUSTRATION = re.compile(r"\[Illustration[^\]]*\]", re.IGNORECASE)
+_CONTENTS = re.compile(r"^(?:TABLE OF )?CONTENTS\.?$", re.IGNORECASE | re.MULTILINE)
+# "CHAPTER IV. TITLE", "Part 2", "BOOK THE FIRST", "PROLOGUE" or a bare roman numeral on its own line
+_HEADING = re.compile(
+    r"^(?:(CHAPTER|BOOK|PART|STAVE|ACT|LETTER|SECTION)\s+([IVXLCDM]+|\d+|[A-Z][A-Za-z]+)\b[.:]?.*"
+    r"|(PROLOGU?E?|EPILOGUE|PREFACE|INTRODUCTION|CONCLUSION)\.?"
+    r"|([IVXLC]{1,7})\.?)$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def strip_boilerplate(text):
+    """
+    Cuts the Project Gutenberg header (everything up to the START / small-print marker), the
+    footer and licence (from the END marker on) and a leading "Produced by" note.
+    """
+    header_limit = int(len(text) * MAX_HEADER_FRACTION)
+    start = 0
+    for match in _START_MARKERS.finditer(text, 0, header_limit):
+        start = match.end()
+    end = len(text)
+    footer = _END_MARKERS.search(text, max(start, header_limit // 2))
+    if footer:
+        end = footer.start()
+    return _PRODUCER_NOTE.sub("", text[start:end].strip())
+
+
+def _heading_key(match):
+    label, number, named, roman = match.groups()
+    if label:
+        return label.lower(), number.lower()
+    return (named or roman).lower().rstrip("."), ""
+
+
+def _headings(text, start=0, end=None):
+    """(key, match) for every heading-like line in text[start:end]."""
+    for match in _HEADING.finditer(text, start, len(text) if end is None else end):
+        line = match.group(0)
+        if len(line) > MAX_HEADING_LENGTH or (match.group(4) and not match.group(4).isupper()):
+            continue
+        if not (line.isupper() or line[:1].isupper()):
+            continue
+        yield _heading_key(match), match
+
+
+def strip_table_of_contents(text):
+    """
+    Removes a "CONTENTS" block near the start of the book: the run of headings after it whose
+    chapter labels appear again further on, plus a subtitle paragraph after the last one.
+    """
+    contents = _CONTENTS.search(text, 0, int(len(text) * MAX_TOC_FRACTION))
+    if not contents:
+        return text
+    headings = list(_headings(text, contents.end()))
+    toc_end = None
+    for position, (key, match) in enumerate(headings):
+        if not any(later_key == key for later_key, _ in headings[position + 1:]):
+            break
+        toc_end = match.end()
+    if toc_end is None or toc_end > len(text) * MAX_TOC_FRACTION:
+        return text
+    # Drop one more all-caps paragraph (the last entry's subtitle) unless it is a heading itself
+    rest = text[toc_end:].lstrip("\n")
+    paragraph = rest.split("\n\n", 1)[0]
+    if paragraph.isupper() and not _HEADING.fullmatch(paragraph.strip()):
+        toc_end = len(text) - len(rest) + len(paragraph)
+    return text[:contents.start()] + text[toc_end:]
+
+
+def collapse_whitespace(text):
+    """Strips every line, collapses runs of spaces and blank lines and drops repeated paragraphs."""
+    lines = (re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in _LINE_BREAK.sub("\n", text).split("\n"))
+    paragraphs, previous = [], None
+    for paragraph in "\n".join(lines).split("\n\n"):
+        paragraph = paragraph.strip("\n")
+        if paragraph and paragraph != previous:
+            paragraphs.append(paragraph)
+            previous = paragraph
+    return "\n\n".join(paragraphs)
+
+
+def find_chapters(text):
+    """
+    Chapter boundaries of a normalised text: heading lines that start a paragraph.
+
+    Returns:
+    list: [{"title": heading line, "start": offset}], in text order.
+    """
+    chapters = []
+    for _, match in _headings(text):
+        if match.start() == 0 or text[match.start() - 2:match.start()] == "\n\n":
+            chapters.append({"title": match.group(0).strip(), "start": match.start()})
+    return chapters
+
+
+def normalize_text(text):
+    """
+    Cleans a Project Gutenberg text for analysis.
+
+    Strips the licence header and footer, the table of contents and [Illustration] markers,
+    collapses whitespace and repeated paragraphs, then locates chapter headings.
+
+    Parameters:
+    text (str): The raw downloaded text.
+
+    Returns:
+    tuple: (cleaned text, chapters as returned by find_chapters)
+    """
+    text = strip_boilerplate(_LINE_BREAK.sub("\n", text))
+    text = _ILLUSTRATION.sub("", text)
+    text = collapse_whitespace(strip_table_of_contents(collapse_whitespace(text)))
+    return text, find_chapters(text)
+
+
+def chapter_spans(chapters, length, max_length):
+    """
+    (start, end) sections of a text of `length` characters split at chapter starts; consecutive
+    short chapters are joined while they fit in `max_length`, so chunks follow chapter structure
+    without producing many tiny ones.
+    """
+    bounds = sorted({0, length, *(chapter["start"] for chapter in chapters if 0 < chapter["start"] < length)})
+    spans = []
+    for start, end in zip(bounds, bounds[1:]):
+        if spans and end - spans[-1][0] <= max_length:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def save_normalized(book_id, clean_path, chapters, raw_chars, clean_chars):
+    with connection() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO book_texts (book_id, clean_path, chapters, raw_chars, clean_chars, normalized_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (str(book_id), clean_path, json.dumps(chapters), raw_chars, clean_chars),
+        )
+
+
+def load_normalized(book_id):
+    """Returns (clean_path, chapters) of a normalised book, or None."""
+    with connection() as conn:
+        row = conn.execute("SELECT clean_path, chapters FROM book_texts WHERE book_id = ?", (str(book_id),)).fetchone()
+    return (row["clean_path"], json.loads(row["chapters"])) if row else None
@@ -1,415 +1,1410 @@
-import json
-import sqlite3
-import random
-import re
-from collections import defaultdict
-
-def ebook_analysis_to_html(row):
-    """
-    Converts an ebook_analysis row into a styled Tailwind HTML string.
-
-    Parameters:
-    row (sqlite3.Row): A row from the ebook_analysis table.
-
-    Returns:
-    str: A string containing the styled HTML for the ebook details.
-    """
-    if not row:
-        return """<div class="text-red-600 font-semibold p-4">No data found for the given Book ID.</div>"""
-
-    # Extract values from the row
-    ebook_id, summary, sentiment, language, key_characters, themes, status = row[1:]
-
-    # Convert JSON fields to formatted strings
-    key_characters_list = json.loads(key_characters) if key_characters else []
-    themes_list = json.loads(themes) if themes else []
-
-    key_characters_html = ", ".join(f"<span class='px-2 py-1 bg-gray-200 rounded-lg'>{char}</span>" for char in key_characters_list)
-    themes_html = ", ".join(f"<span class='px-2 py-1 bg-blue-200 rounded-lg'>{theme}</span>" for theme in themes_list)
-
-    # Construct HTML
-    html_content = f"""
-    <div class="max-w-3xl w-full bg-white">
-        <h2 class="text-2xl font-bold text-gray-800 mb-4">📖 EBook Details</h2>
-        <div class="grid grid-cols-1 md:grid-cols-2 gap-4">
-            <div class="font-semibold text-gray-600">📌 Ebook ID:</div>
-            <div class="text-gray-800">{ebook_id}</div>
-
-            <div class="font-semibold text-gray-600">📜 Summary:</div>
-            <div class="text-gray-800 text-sm leading-relaxed">{summary}</div>
-
-            <div class="font-semibold text-gray-600">📊 Sentiment:</div>
-            <div class="text-gray-800">{sentiment}</div>
-
-            <div class="font-semibold text-gray-600">🌎 Language:</div>
-            <div class="text-gray-800">{language}</div>
-
-            <div class="font-semibold text-gray-600">🎭 Key Characters:</div>
-            <div class="flex flex-wrap gap-2">{key_characters_html}</div>
-
-            <div class="font-semibold text-gray-600">🎨 Themes:</div>
-            <div class="flex flex-wrap gap-2">{themes_html}</div>
-
-            <div class="font-semibold text-gray-600">📌 Status:</div>
-            <div class="text-gray-800 font-semibold text-lg">{status}</div>
-        </div>
-    </div>
-    """
-
-    return html_content
-
-
-def json_to_html_table(json_data):
-    """
-    Converts JSON data to an HTML table with Tailwind CSS.
-
-    Parameters:
-    json_data (dict): A dictionary containing the JSON data to be converted into an HTML table.
-
-    Returns:
-    str: A string representing the HTML code for the table.
-    """
-    table_html = """
-        <div class="max-w-2xl w-full bg-white shadow-lg rounded-lg p-6">
-            <h2 class="text-2xl font-bold text-gray-700 mb-4">EBook Meta Data</h2>
-            <table class="w-full border border-gray-300 rounded-lg">
-                <tbody>
-    """
-
-    for key, value in json_data.items():
-        table_html += f"""
-        <tr class="border-b border-gray-200">
-            <th class="text-left px-4 py-2 font-semibold bg-gray-100">{key}</th>
-            <td class="px-4 py-2">{value}</td>
-        </tr>
-        """
-
-    table_html += """
-                </tbody>
-            </table>
-        </div>
-    """
-
-    return table_html
-
-
-# Database connection function
-def get_db_connection():
-    connection = sqlite3.connect("database.db")
-    connection.row_factory = sqlite3.Row
-    return connection
-
-def create_database():
-    """Creates the ebook_analysis table if it doesn't exist."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS ebook_analysis (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ebook_id INTEGER NOT NULL UNIQUE,
-        summary TEXT,
-        sentiment TEXT,
-        language TEXT,
-        key_characters TEXT,  -- Store as JSON string
-        themes TEXT,          -- Store as JSON string
-        status TEXT NOT NULL
-    )
-    ''')
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS ebooks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ebook_json TEXT NULL,
-        book_id TEXT NULL,
-        txt_path TEXT NULL,
-        accessed_date DATETIME DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    conn.commit()
-    conn.close()
-
-def insert_ebook(ebook_id):
-    """Inserts a new record with only ebook_id and status='pending'."""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-        INSERT INTO ebook_analysis (ebook_id, status)
-        VALUES (?, ?)
-        ''', (ebook_id, "In Progress"))
-
-        conn.commit()
-        print(f"Record created with ebook_id={ebook_id}, status='In Progress'")
-    except sqlite3.IntegrityError:
-        print(f"Record with ebook_id={ebook_id} already exists.")
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-    finally:
-        conn.close()
-
-def update_ebook_data(ebook_id, summary, sentiment, language, key_characters, themes, status):
-    """Updates an existing record with full details based on ebook_id."""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Convert lists to JSON strings
-        key_characters_json = json.dumps(key_characters)
-        themes_json = json.dumps(themes)
-
-        cursor.execute('''
-        UPDATE ebook_analysis 
-        SET summary=?, sentiment=?, language=?, key_characters=?, themes=?, status=? 
-        WHERE ebook_id=?
-        ''', (summary, sentiment, language, key_characters_json, themes_json, status, ebook_id))
-
-        if cursor.rowcount == 0:
-            print(f"No record found for ebook_id={ebook_id}")
-        else:
-            print(f"Record updated successfully for ebook_id={ebook_id}")
-
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-    finally:
-        conn.close()
-
-# create_database()
-
-
-# Function to insert ebook data
-def insert_ebook_data(book_id, data, txt_path=None):
-    """
-    Insert ebook metadata into the database as JSON.
-
-    Parameters:
-    data (dict): A dictionary containing the ebook metadata. Each key-value pair represents a metadata field and its value.
-    txt_path (str, optional): The path to the text file associated with the ebook. Defaults to None.
-
-    Returns:
-    None
-
-    This function converts the provided ebook metadata dictionary into a JSON string, establishes a connection to the SQLite database,
-    ensures the existence of the 'ebooks' table, inserts the JSON string and the optional text file path into the table,
-    commits the changes, and closes the database connection.
-    """
-    # Convert dictionary to JSON string
-    ebook_json = json.dumps(data)
-
-    # Get a database connection
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Ensure the table exists
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS ebooks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ebook_json TEXT NULL,
-        book_id TEXT NULL,
-        txt_path TEXT NULL,
-        accessed_date DATETIME DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    # Insert data into the table
-    insert_query = "INSERT INTO ebooks (book_id, ebook_json, txt_path) VALUES (?, ?, ?)"
-    cursor.execute(insert_query, (book_id, ebook_json, txt_path))
-
-    # Commit and close the connection
-    conn.commit()
-    conn.close()
-
-    print("Ebook data inserted successfully!")
-
-def book_id_exists(book_id):
-    """
-    Check if a book with the given ID exists in the database.
-    Returns a tuple (exists, value) where 'exists' is a boolean
-    and 'value' is row[3] if available, else None.
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    query = "SELECT * FROM ebooks WHERE book_id = ?"
-    cursor.execute(query, (book_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    return (row is not None, row[1] if row else None)
-def book_id_exists_in_analysis(book_id):
-    """
-    Check if a book with the given ID exists in the database.
-    Returns a tuple (exists, value) where 'exists' is a boolean
-    and 'value' is row[3] if available, else None.
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    query = "SELECT * FROM ebook_analysis WHERE ebook_id = ?"
-    cursor.execute(query, (book_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    return (row is not None, row if row else None)
-def get_all_books():
-    """
-    Fetch all books from the database and return as a list of dictionaries.
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    query = "SELECT book_id FROM ebooks"
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    
-    conn.close()
-    
-    # Convert the rows to a list of dictionaries
-    books = [{"Book_id": row[0]} for row in rows]
-    
-    return books
-
-def read_txt_file(ebook_id):
-    """Read content from a text file."""
-    file_path = "uploads/"+ebook_id+".txt"
-    try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            content = file.read()
-        return content
-    except FileNotFoundError:
-        return "Error: File not found."
-    except Exception as e:
-        return f"Error reading file: {e}"
-
-def chunk_text(text, max_length=5000):
-    """Splits the text into chunks of specified max_length."""
-    chunks = []
-    while len(text) > max_length:
-        split_index = text[:max_length].rfind(".") + 1
-        if split_index == 0:
-            split_index = max_length
-        chunks.append(text[:split_index].strip())
-        text = text[split_index:].strip()
-    chunks.append(text)
-    return chunks
-
-def select_chunks(chunks, num_samples=20):
-    """Selects a subset of chunks, ensuring diversity from start, middle, and end."""
-    if len(chunks) <= num_samples:
-        return chunks  # If chunks are fewer than needed, return all
-    
-    start_chunks = chunks[:max(1, num_samples // 4)]  # First few chunks
-    end_chunks = chunks[-max(1, num_samples // 4):]  # Last few chunks
-    middle_chunks = chunks[max(1, len(chunks) // 3): -max(1, len(chunks) // 3)]  # Middle section
-    
-    if len(middle_chunks) > num_samples - len(start_chunks) - len(end_chunks):
-        middle_chunks = random.sample(middle_chunks, num_samples - len(start_chunks) - len(end_chunks))
-    
-    return start_chunks + middle_chunks + end_chunks
-
-def process_raw_analysis(client, selected_chunks):
-    summary = []
-    for i in selected_chunks:
-        prompt = (
-                    "You are a highly intelligent AI assistant specializing in summarizing eBooks with precision and clarity. "
-                    "Your task is to extract key points, main ideas, and crucial details while ensuring coherence and brevity.\n\n"
-                    "Begin the response by analyzing and providing:\n"
-                    "At the begining of response just inlcude json response only"
-                    "- The overall sentiment of the text (e.g., positive, neutral, negative).\n"
-                    "- The language in which the text is written.\n"
-                    "- Identification of key characters (if applicable).\n\n"
-                    "Then, generate a well-structured and highly concise summary that captures all essential points without losing meaning.\n\n"
-                    "The response should be in a structured JSON format as follows:\n\n"
-                    "{\n"
-                    '  "summary": "...",\n'
-                    '  "sentiment": "...",\n'
-                    '  "language": "...",\n'
-                    '  "key_characters": ["...", "..."],\n'
-                    '  "themes": ["...", "..."]\n'
-                    "}\n"
-                    "\nNow, process the following text and generate the response:\n\n" + i
-            )
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "you are a helpful assistant."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="llama-3.3-70b-versatile",
-            temperature=0.5
-        )
-        # print(chat_completion.choices[0].message.content)
-        summary.append(chat_completion.choices[0].message.content)
-    return summary
-
-def extract_json(raw_string):
-    """Extract JSON content from a string enclosed within triple backticks."""
-    json_match = re.search(r"```(.*?)```", raw_string, re.DOTALL)
-    if json_match:
-        json_str = json_match.group(1).strip()
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            return None
-    return None
-
-def merge_responses(response_list):
-    """Merge multiple JSON responses into a single structured dictionary."""
-    merged_data = defaultdict(list)
-    
-    for raw_response in response_list:
-        parsed_json = extract_json(raw_response)
-        if parsed_json:
-            for key, value in parsed_json.items():
-                if isinstance(value, list):
-                    merged_data[key].extend(value)
-                elif isinstance(value, str):
-                    merged_data[key].append(value)
-                else:
-                    merged_data[key].append(str(value))
-    
-    # Convert lists to properly formatted values
-    final_data = {}
-    for key, value in merged_data.items():
-        if key in ["summary", "sentiment", "language"]:
-            final_data[key] = " ".join(value)  # Join string fields
-        else:
-            final_data[key] = list(set(value))  # Remove duplicates for lists
-    
-    return final_data
-
-def process_final_analysis(merged_output, client):
-    prompt = (
-    "You are an advanced AI designed to process and refine text data with clarity and conciseness. "
-    "Your task is to analyze the provided summaries and generate a refined version that meets the following criteria:\n\n"
-    "1. Provide a well-structured and concise summary that retains all essential points while improving readability.\n"
-    "2. Identify and consolidate sentiments—if duplicates exist, remove them; if they are similar, retain only the most relevant one.\n"
-    "3. Identify and consolidate the language—if duplicates exist, remove them; if they are similar, retain only one.\n"
-    "4. Extract key characters, ensuring no duplicates while keeping only distinct names.\n"
-    "5. Extract themes, removing exact duplicates but preserving variations when necessary.\n\n"
-    "6. Response should have only my json nothing else"
-    "The output should be in structured JSON format as follows:\n\n"
-    "{\n"
-    '  "summary": "...",\n'
-    '  "sentiment": "...",\n'
-    '  "language": "...",\n'
-    '  "key_characters": ["...", "..."],\n'
-    '  "themes": ["...", "..."]\n'
-    "}\n\n"
-    "Now, process the following text and generate the response:\n\n" + str(merged_output)
-    )
-
-    # AI Processing (Example usage, requires an AI API like OpenAI, Groq, etc.)
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        model="llama-3.3-70b-versatile",
-        temperature=0.5
-    )
-
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+import json
+import mmap
+import os
+import sqlite3
+import random
+import re
+import threading
+from collections import defaultdict
+from itertools import accumulate, chain
+from concurrent.futures import ThreadPoolExecutor
+from .throttle import get_rate_limiter, call_with_retry
+from .db import connection, run_migrations
+from .llm_cache import cached_completion
+from .llm_backends import MODEL_NAME, as_backend
+from .llm_json import parse_json_response, validate_analysis, count as count_parse_event
+from .fragment_cache import get_fragment_cache
+from .text_stats import compute_text_stats, save_text_stats, load_text_stats, text_stats_to_html
+from .normalize import normalize_text, chapter_spans, save_normalized, load_normalized
+from .editions import chunk_fingerprint
+from .entities import canonical_entities, vote, SENTIMENT_LABELS
+from . import content_store
+from .metrics import log, traced
+
+TEMPERATURE = 0.5
+# Bump when the corresponding prompt template changes so cached responses are not reused
+CHUNK_PROMPT_VERSION = 1
+FINAL_PROMPT_VERSION = 1
+PACKED_PROMPT_VERSION = 1
+CHARS_PER_TOKEN = 4
+# Chunk packing: several chunks share one request up to this many prompt tokens (0 disables packing)
+PACK_TOKEN_BUDGET = int(os.getenv("LLM_PACK_TOKEN_BUDGET", "6000"))
+PACK_MAX_CHUNKS = int(os.getenv("LLM_PACK_MAX_CHUNKS", "8"))
+OUTPUT_TOKENS_PER_CHUNK = 512
+# Bytes per page of /books/<id>/content?page=N unless the client asks for another page_size
+CONTENT_PAGE_SIZE = 64 * 1024
+# Times an unparseable chunk (or final) response is re-requested before giving up on it
+PARSE_RETRIES = int(os.getenv("LLM_PARSE_RETRIES", "1"))
+
+def ebook_analysis_to_html(row):
+    """
+    Converts an ebook_analysis row into a styled Tailwind HTML string.
+
+    Parameters:
+    row (sqlite3.Row): A row from the ebook_analysis table.
+
+    Returns:
+    str: A string containing the styled HTML for the ebook details.
+    """
+    if not row:
+        return """<div class="text-red-600 font-semibold p-4">No data found for the given Book ID.</div>"""
+
+    # Extract values from the row
+    ebook_id, summary, sentiment, language, key_characters, themes, status = row[1:]
+
+    # Convert JSON fields to formatted strings
+    key_characters_list = json.loads(key_characters) if key_characters else []
+    themes_list = json.loads(themes) if themes else []
+
+    key_characters_html = ", ".join(f"<span class='px-2 py-1 bg-gray-200 rounded-lg'>{char}</span>" for char in key_characters_list)
+    themes_html = ", ".join(f"<span class='px-2 py-1 bg-blue-200 rounded-lg'>{theme}</span>" for theme in themes_list)
+
+    # Construct HTML
+    html_content = f"""
+    <div class="max-w-3xl w-full bg-white">
+        <h2 class="text-2xl font-bold text-gray-800 mb-4">📖 EBook Details</h2>
+        <div class="grid grid-cols-1 md:grid-cols-2 gap-4">
+            <div class="font-semibold text-gray-600">📌 Ebook ID:</div>
+            <div class="text-gray-800">{ebook_id}</div>
+
+            <div class="font-semibold text-gray-600">📜 Summary:</div>
+            <div class="text-gray-800 text-sm leading-relaxed">{summary}</div>
+
+            <div class="font-semibold text-gray-600">📊 Sentiment:</div>
+            <div class="text-gray-800">{sentiment}</div>
+
+            <div class="font-semibold text-gray-600">🌎 Language:</div>
+            <div class="text-gray-800">{language}</div>
+
+            <div class="font-semibold text-gray-600">🎭 Key Characters:</div>
+            <div class="flex flex-wrap gap-2">{key_characters_html}</div>
+
+            <div class="font-semibold text-gray-600">🎨 Themes:</div>
+            <div class="flex flex-wrap gap-2">{themes_html}</div>
+
+            <div class="font-semibold text-gray-600">📌 Status:</div>
+            <div class="text-gray-800 font-semibold text-lg">{status}</div>
+        </div>
+    </div>
+    """
+
+    return html_content
+
+
+def json_to_html_table(json_data):
+    """
+    Converts JSON data to an HTML table with Tailwind CSS.
+
+    Parameters:
+    json_data (dict): A dictionary containing the JSON data to be converted into an HTML table.
+
+    Returns:
+    str: A string representing the HTML code for the table.
+    """
+    # Collect the pieces and join once instead of growing one string with +=
+    parts = ["""
+        <div class="max-w-2xl w-full bg-white shadow-lg rounded-lg p-6">
+            <h2 class="text-2xl font-bold text-gray-700 mb-4">EBook Meta Data</h2>
+            <table class="w-full border border-gray-300 rounded-lg">
+                <tbody>
+    """]
+
+    parts.extend(f"""
+        <tr class="border-b border-gray-200">
+            <th class="text-left px-4 py-2 font-semibold bg-gray-100">{key}</th>
+            <td class="px-4 py-2">{value}</td>
+        </tr>
+        """ for key, value in json_data.items())
+
+    parts.append("""
+                </tbody>
+            </table>
+        </div>
+    """)
+
+    return "".join(parts)
+
+
+def _migration_1(conn):
+    """Create the ebook_analysis, ebooks and analysis_jobs tables."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ebook_analysis (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ebook_id INTEGER NOT NULL UNIQUE,
+        summary TEXT,
+        sentiment TEXT,
+        language TEXT,
+        key_characters TEXT,  -- Store as JSON string
+        themes TEXT,          -- Store as JSON string
+        status TEXT NOT NULL
+    )
+    ''')
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ebooks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ebook_json TEXT NULL,
+        book_id TEXT NULL,
+        txt_path TEXT NULL,
+        accessed_date DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id TEXT NOT NULL,
+        file_path TEXT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT NULL,
+        timings TEXT NULL,                       -- Store as JSON string
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        started_at DATETIME NULL,
+        finished_at DATETIME NULL
+    );
+    """)
+    # Single-flight: at most one queued/running job per book
+    conn.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_analysis_jobs_active
+    ON analysis_jobs (book_id) WHERE status IN ('queued', 'running');
+    """)
+
+def _migration_2(conn):
+    """Deduplicate ebooks, add a unique book_id index and hot metadata columns."""
+    # Keep the first row fetched for each book_id, which is what lookups returned before
+    conn.execute("""
+    DELETE FROM ebooks
+    WHERE book_id IS NOT NULL
+    AND id NOT IN (SELECT MIN(id) FROM ebooks WHERE book_id IS NOT NULL GROUP BY book_id)
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ebooks_book_id ON ebooks (book_id)")
+    for column in EBOOK_METADATA_COLUMNS.values():
+        conn.execute(f"ALTER TABLE ebooks ADD COLUMN {column} TEXT NULL")
+    conn.execute("""
+    UPDATE ebooks SET
+        title = json_extract(ebook_json, '$.Title'),
+        author = json_extract(ebook_json, '$.Author'),
+        language = json_extract(ebook_json, '$.Language'),
+        release_date = json_extract(ebook_json, '$."Release Date"')
+    WHERE json_valid(ebook_json)
+    """)
+
+def _migration_3(conn):
+    """Create the book_search full-text index and its book_search_docs row map."""
+    # One FTS row per indexed document: a metadata row, an analysis row and one row per body chunk
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS book_search USING fts5(
+        title, author, subjects, summary, themes, body,
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS book_search_docs (
+        rowid INTEGER PRIMARY KEY,   -- same rowid as the book_search row
+        book_id TEXT NOT NULL,
+        kind TEXT NOT NULL,          -- meta, analysis or body
+        chunk_index INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_book_search_docs_book ON book_search_docs (book_id, kind)")
+
+def _migration_4(conn):
+    """Create analysis_checkpoints for resumable full-book map-reduce summaries."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_checkpoints (
+        book_id TEXT NOT NULL,
+        run_key TEXT NOT NULL,       -- hash of the text and map-reduce settings
+        level INTEGER NOT NULL,      -- 0 = chunk summaries, then one level per reduce round
+        results TEXT NOT NULL,       -- JSON list of partial analyses for the whole level
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (book_id, run_key, level)
+    )
+    """)
+
+def _migration_5(conn):
+    """Create analysis_usage for per-book LLM request and token accounting."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_usage (
+        ebook_id INTEGER PRIMARY KEY,
+        requests INTEGER NOT NULL DEFAULT 0,          -- LLM calls actually sent
+        cached_responses INTEGER NOT NULL DEFAULT 0,  -- answers served from llm_cache
+        chunks INTEGER NOT NULL DEFAULT 0,            -- chunks analysed
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _migration_6(conn):
+    """Create analysis_progress and analysis_partials for streaming analysis progress."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_progress (
+        book_id TEXT PRIMARY KEY,
+        stage TEXT NOT NULL,              -- read, chunk, map, reduce, persist, done
+        chunks_total INTEGER NOT NULL DEFAULT 0,
+        chunks_done INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_partials (
+        book_id TEXT NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        result TEXT NOT NULL,             -- JSON analysis of one chunk
+        PRIMARY KEY (book_id, chunk_index)
+    )
+    """)
+
+def _migration_7(conn):
+    """Create render_versions, bumped by triggers whenever an analysis or metadata row is written."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS render_versions (
+        book_id TEXT NOT NULL,
+        kind TEXT NOT NULL,               -- 'analysis' (ebook_analysis) or 'meta' (ebooks)
+        version INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (book_id, kind)
+    )
+    """)
+    for table, key, kind in (("ebook_analysis", "CAST(NEW.ebook_id AS TEXT)", "analysis"), ("ebooks", "NEW.book_id", "meta")):
+        for event in ("INSERT", "UPDATE"):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_render_version_{event.lower()} AFTER {event} ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO render_versions (book_id, kind, version) VALUES ({key}, '{kind}', 0);
+                UPDATE render_versions SET version = version + 1 WHERE book_id = {key} AND kind = '{kind}';
+            END
+            """)
+
+def _migration_8(conn):
+    """Create text_stats (local word/sentence/language statistics) with its own render version."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS text_stats (
+        book_id TEXT PRIMARY KEY,
+        stats TEXT NOT NULL,              -- JSON from text_stats.compute_text_stats
+        computed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    for event in ("INSERT", "UPDATE"):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS text_stats_render_version_{event.lower()} AFTER {event} ON text_stats
+        BEGIN
+            INSERT OR IGNORE INTO render_versions (book_id, kind, version) VALUES (NEW.book_id, 'stats', 0);
+            UPDATE render_versions SET version = version + 1 WHERE book_id = NEW.book_id AND kind = 'stats';
+        END
+        """)
+
+def _migration_9(conn):
+    """Create book_texts: the cleaned copy and chapter offsets of every normalised book."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS book_texts (
+        book_id TEXT PRIMARY KEY,
+        clean_path TEXT NOT NULL,
+        chapters TEXT NOT NULL,           -- JSON [{"title", "start"}], offsets into the cleaned text
+        raw_chars INTEGER NOT NULL,
+        clean_chars INTEGER NOT NULL,
+        normalized_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _migration_10(conn):
+    """Create metadata_cache for scraped Gutenberg book pages, with HTTP validators for revalidation."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS metadata_cache (
+        book_id TEXT PRIMARY KEY,
+        metadata TEXT NOT NULL,           -- JSON of the bibrec table (or the error for a 404)
+        status INTEGER NOT NULL,          -- 200 or 404
+        etag TEXT NULL,
+        last_modified TEXT NULL,
+        fetched_at REAL NOT NULL          -- unix time of the last fetch or revalidation
+    )
+    """)
+
+def _migration_11(conn):
+    """Recreate the render_versions triggers so they also work under UPSERT and INSERT OR REPLACE."""
+    # The outer statement's conflict policy overrides the trigger's own "OR IGNORE": an upsert of
+    # ebooks then failed on render_versions' primary key and INSERT OR REPLACE into text_stats
+    # reset the version. Inserting only when the row is missing never conflicts.
+    for table, key, kind in (
+        ("ebook_analysis", "CAST(NEW.ebook_id AS TEXT)", "analysis"),
+        ("ebooks", "NEW.book_id", "meta"),
+        ("text_stats", "NEW.book_id", "stats"),
+    ):
+        for event in ("INSERT", "UPDATE"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_render_version_{event.lower()}")
+            conn.execute(f"""
+            CREATE TRIGGER {table}_render_version_{event.lower()} AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO render_versions (book_id, kind, version)
+                SELECT {key}, '{kind}', 0
+                WHERE NOT EXISTS (SELECT 1 FROM render_versions WHERE book_id = {key} AND kind = '{kind}');
+                UPDATE render_versions SET version = version + 1 WHERE book_id = {key} AND kind = '{kind}';
+            END
+            """)
+
+def _migration_12(conn):
+    """Add analysis_jobs.trace_id so a background analysis logs under the trace of the request that queued it."""
+    conn.execute("ALTER TABLE analysis_jobs ADD COLUMN trace_id TEXT NULL")
+
+def _migration_13(conn):
+    """Create the near-duplicate edition index, kept chunk analyses and analysis provenance (see services.editions)."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS edition_signatures (
+        book_id TEXT PRIMARY KEY,
+        signature BLOB NOT NULL,          -- MinHash values, little-endian uint64 each
+        shingles INTEGER NOT NULL,        -- distinct word shingles of the normalised text
+        indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS edition_bands (
+        band INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,          -- hash of the band's rows of the signature
+        book_id TEXT NOT NULL,
+        PRIMARY KEY (band, bucket, book_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_edition_bands_book ON edition_bands (book_id)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chunk_analyses (
+        book_id TEXT NOT NULL,
+        chunk_hash TEXT NOT NULL,         -- chunk_fingerprint of the chunk text
+        result TEXT NOT NULL,             -- JSON analysis of the chunk
+        PRIMARY KEY (book_id, chunk_hash)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_sources (
+        book_id TEXT PRIMARY KEY,
+        source_book_id TEXT NOT NULL,
+        similarity REAL NOT NULL,         -- estimated Jaccard similarity of the two texts
+        reuse TEXT NOT NULL,              -- 'copy' (whole analysis) or 'chunks' (unchanged chunks)
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _migration_14(conn):
+    """Give analysis_partials an AUTOINCREMENT seq, so SSE event ids are never reused after a run's rows are deleted."""
+    conn.execute("""
+    CREATE TABLE analysis_partials_new (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- arrival order; the SSE event id of the chunk result
+        book_id TEXT NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        result TEXT NOT NULL,             -- JSON analysis of one chunk
+        UNIQUE (book_id, chunk_index)
+    )
+    """)
+    # Rows of running analyses keep their ids, so open event streams resume where they were
+    conn.execute("""
+    INSERT INTO analysis_partials_new (seq, book_id, chunk_index, result)
+    SELECT rowid, book_id, chunk_index, result FROM analysis_partials ORDER BY rowid
+    """)
+    conn.execute("DROP TABLE analysis_partials")
+    conn.execute("ALTER TABLE analysis_partials_new RENAME TO analysis_partials")
+
+def _migration_15(conn):
+    """Mark analyses whose themes are their character list (saved before the themes fix) for re-analysis."""
+    # 'Analysis Failed' rows are queued again by jobs.enqueue_analysis and are never copied to other editions
+    conn.execute("""
+    UPDATE ebook_analysis SET status = 'Analysis Failed'
+    WHERE status = 'Analysis Completed' AND themes = key_characters AND themes NOT IN ('', '[]')
+    """)
+
+def _migration_16(conn):
+    """Create llm_cache (see services.llm_cache), until now created outside the migrations."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,   -- sha256 of (model, temperature, prompt version, input text)
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+
+# Metadata fields scraped from the Gutenberg bibrec table that get their own ebooks columns
+EBOOK_METADATA_COLUMNS = {
+    "Title": "title",
+    "Author": "author",
+    "Language": "language",
+    "Release Date": "release_date",
+}
+
+# (version, migration) pairs; append new migrations, never edit applied ones
+MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+    (7, _migration_7),
+    (8, _migration_8),
+    (9, _migration_9),
+    (10, _migration_10),
+    (11, _migration_11),
+    (12, _migration_12),
+    (13, _migration_13),
+    (14, _migration_14),
+    (15, _migration_15),
+    (16, _migration_16),
+]
+
+def create_database():
+    """Brings the schema up to date by running pending MIGRATIONS."""
+    run_migrations(MIGRATIONS)
+
+def insert_ebook(ebook_id):
+    """Inserts a new record with only ebook_id and status='pending'."""
+    try:
+        with connection() as conn:
+            conn.execute('''
+            INSERT INTO ebook_analysis (ebook_id, status)
+            VALUES (?, ?)
+            ''', (ebook_id, "In Progress"))
+        get_fragment_cache().invalidate(ebook_id)
+        log(f"Record created with ebook_id={ebook_id}, status='In Progress'")
+    except sqlite3.IntegrityError:
+        log(f"Record with ebook_id={ebook_id} already exists.")
+    except sqlite3.Error as e:
+        log(f"Database error: {e}")
+
+def update_ebook_data(ebook_id, summary, sentiment, language, key_characters, themes, status):
+    """Updates an existing record with full details based on ebook_id."""
+    try:
+        # Convert lists to JSON strings
+        key_characters_json = json.dumps(key_characters)
+        themes_json = json.dumps(themes)
+
+        with connection() as conn:
+            cursor = conn.execute('''
+            UPDATE ebook_analysis 
+            SET summary=?, sentiment=?, language=?, key_characters=?, themes=?, status=? 
+            WHERE ebook_id=?
+            ''', (summary, sentiment, language, key_characters_json, themes_json, status, ebook_id))
+        get_fragment_cache().invalidate(ebook_id)
+
+        if cursor.rowcount == 0:
+            log(f"No record found for ebook_id={ebook_id}")
+        else:
+            log(f"Record updated successfully for ebook_id={ebook_id}", status=status)
+    except sqlite3.Error as e:
+        log(f"Database error: {e}")
+
+
+# Function to insert ebook data
+def insert_ebook_data(book_id, data, txt_path=None, conn=None):
+    """
+    Insert ebook metadata into the database as JSON.
+
+    Parameters:
+    data (dict): A dictionary containing the ebook metadata. Each key-value pair represents a metadata field and its value.
+    txt_path (str, optional): The path to the text file associated with the ebook. Defaults to None.
+    conn (sqlite3.Connection, optional): Connection of an enclosing transaction, used by batch
+                                         ingestion to write many rows in one commit. Defaults to None.
+
+    Returns:
+    None
+
+    This function converts the provided ebook metadata dictionary into a JSON string and stores it, together with
+    the optional text file path and the Title/Author/Language/Release Date columns, in the 'ebooks' table.
+    A book that is already present is updated in place instead of being inserted twice.
+    """
+    # Convert dictionary to JSON string
+    ebook_json = json.dumps(data)
+    title, author, language, release_date = (data.get(field) for field in EBOOK_METADATA_COLUMNS)
+
+    query = """
+    INSERT INTO ebooks (book_id, ebook_json, txt_path, title, author, language, release_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (book_id) DO UPDATE SET
+        ebook_json = excluded.ebook_json,
+        txt_path = excluded.txt_path,
+        title = excluded.title,
+        author = excluded.author,
+        language = excluded.language,
+        release_date = excluded.release_date,
+        accessed_date = CURRENT_TIMESTAMP
+    """
+    params = (book_id, ebook_json, txt_path, title, author, language, release_date)
+    if conn is None:
+        with connection() as own_conn:
+            own_conn.execute(query, params)
+    else:
+        conn.execute(query, params)
+    get_fragment_cache().invalidate(book_id)
+
+    log(f"Ebook data inserted for book_id={book_id}")
+
+def book_exists(book_id):
+    """Returns True if the book is in the ebooks table; answered from the book_id index alone."""
+    with connection() as conn:
+        row = conn.execute("SELECT 1 FROM ebooks WHERE book_id = ? LIMIT 1", (book_id,)).fetchone()
+    return row is not None
+
+def get_book_record(book_id):
+    """
+    Fetch the hot metadata columns of a book without its ebook_json blob.
+
+    Returns:
+    dict or None: book_id, title, author, language, release_date, txt_path and accessed_date,
+                  or None if the book is unknown.
+    """
+    with connection() as conn:
+        row = conn.execute(
+            """
+            SELECT book_id, title, author, language, release_date, txt_path, accessed_date
+            FROM ebooks WHERE book_id = ?
+            """,
+            (book_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+def book_id_exists(book_id):
+    """
+    Check if a book with the given ID exists in the database.
+    Returns a tuple (exists, value) where 'exists' is a boolean
+    and 'value' is the stored ebook_json if available, else None.
+    """
+    with connection() as conn:
+        row = conn.execute("SELECT ebook_json FROM ebooks WHERE book_id = ?", (book_id,)).fetchone()
+
+    return (row is not None, row[0] if row else None)
+def update_analysis_usage(ebook_id, usage):
+    """Stores the TokenUsage totals of an analysis run in analysis_usage, replacing earlier totals."""
+    totals = usage.snapshot()
+    with connection() as conn:
+        conn.execute('''
+        INSERT OR REPLACE INTO analysis_usage
+            (ebook_id, requests, cached_responses, chunks, prompt_tokens, completion_tokens, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (ebook_id, totals["requests"], totals["cached_responses"], totals["chunks"],
+              totals["prompt_tokens"], totals["completion_tokens"]))
+
+def get_analysis_usage(ebook_id):
+    """Returns the stored token accounting of a book as a dict, or None."""
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM analysis_usage WHERE ebook_id = ?", (ebook_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_render_version(book_id, kind):
+    """Version of a book's 'analysis', 'meta' or 'stats' row, bumped on every write (see _migration_7)."""
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT version FROM render_versions WHERE book_id = ? AND kind = ?", (str(book_id), kind)
+        ).fetchone()
+    return row[0] if row else 0
+
+def ebook_analysis_to_dict(row):
+    """Converts an ebook_analysis row into a JSON-ready dictionary."""
+    ebook_id, summary, sentiment, language, key_characters, themes, status = row[1:8]
+    return {
+        "ebook_id": ebook_id,
+        "summary": summary,
+        "sentiment": sentiment,
+        "language": language,
+        "key_characters": json.loads(key_characters) if key_characters else [],
+        "themes": json.loads(themes) if themes else [],
+        "status": status,
+    }
+
+def render_fragment(book_id, kind, fmt="html", version=None):
+    """
+    Renders the /analyze result for a book, served from the in-memory fragment cache.
+
+    Parameters:
+    book_id (str): The unique identifier of the eBook.
+    kind (str): "meta" (scraped metadata table), "stats" (local text statistics) or "analysis"
+                (LLM analysis card).
+    fmt (str): "html" for the Tailwind fragment, "json" for the underlying data.
+    version (int, optional): Row version from get_render_version, if the caller already has it.
+
+    Returns:
+    str or dict: The fragment, or None if the book has no such data.
+    """
+    kind = kind if kind in ("meta", "stats") else "analysis"
+    if version is None:
+        version = get_render_version(book_id, kind)
+    key = (str(book_id), kind, fmt, version)
+    cache = get_fragment_cache()
+    content = cache.get(key)
+    if content is not None:
+        return content
+
+    if kind == "meta":
+        _, ebook_json = book_id_exists(book_id)
+        data = json.loads(ebook_json) if ebook_json else None
+        content = data if fmt == "json" or data is None else json_to_html_table(data)
+    elif kind == "stats":
+        stats = book_text_stats(book_id)
+        content = stats if fmt == "json" or stats is None else text_stats_to_html(stats)
+    else:
+        exists, row = book_id_exists_in_analysis(book_id)
+        if exists:
+            content = ebook_analysis_to_dict(row) if fmt == "json" else ebook_analysis_to_html(row)
+    if content is not None:
+        cache.put(key, content, len(content) if isinstance(content, str) else len(json.dumps(content)))
+    return content
+
+def book_text_stats(book_id, text=None):
+    """
+    Returns the text statistics of a book, computing and storing them on first use.
+
+    Parameters:
+    book_id (str): The unique identifier of the eBook.
+    text (str, optional): The book text, if the caller already read it.
+
+    Returns:
+    dict: See text_stats.compute_text_stats, or None if the book has no text file.
+    """
+    stats = load_text_stats(book_id)
+    if stats is not None:
+        return stats
+    if text is None:
+        if book_file_info(book_id) is None:
+            return None
+        text, _ = read_clean_text(book_id)
+    stats = compute_text_stats(text)
+    save_text_stats(book_id, stats)
+    return stats
+
+def book_id_exists_in_analysis(book_id):
+    """
+    Check if a book with the given ID exists in the database.
+    Returns a tuple (exists, value) where 'exists' is a boolean
+    and 'value' is row[3] if available, else None.
+    """
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM ebook_analysis WHERE ebook_id = ?", (book_id,)).fetchone()
+
+    return (row is not None, row if row else None)
+def get_all_books():
+    """
+    Fetch all books from the database and return as a list of dictionaries.
+    """
+    with connection() as conn:
+        rows = conn.execute("SELECT book_id FROM ebooks").fetchall()
+
+    # Convert the rows to a list of dictionaries
+    books = [{"Book_id": row[0]} for row in rows]
+    
+    return books
+
+def txt_file_path(ebook_id):
+    """Path of the downloaded text file for a book (ValueError if the id is not numeric)."""
+    return "uploads/"+content_store.check_book_id(ebook_id)+".txt"
+
+def open_book_file(ebook_id):
+    """
+    Opens a book's downloaded text for binary reading: from the compressed content store if it
+    is there (see services.content_store), else the plain file in uploads/.
+
+    Raises:
+    FileNotFoundError: If the book has not been downloaded.
+    """
+    file = content_store.open_book(ebook_id)
+    return file if file is not None else open(txt_file_path(ebook_id), "rb")
+
+def book_file_info(ebook_id):
+    """(size in bytes, mtime) of a book's downloaded text, or None if there is none."""
+    info = content_store.book_info(ebook_id)
+    if info is None and os.path.isfile(txt_file_path(ebook_id)):
+        stat = os.stat(txt_file_path(ebook_id))
+        info = stat.st_size, stat.st_mtime
+    return info
+
+def book_summary(book_id, content_url):
+    """Metadata and content URL returned by /fetch_book and /search instead of the full book text."""
+    record = get_book_record(book_id)
+    info = book_file_info(book_id)
+    size = info[0] if info else 0
+    return {
+        "bookId": book_id,
+        "metadata": record,
+        "contentUrl": content_url,
+        "contentLength": size,
+        "pageSize": CONTENT_PAGE_SIZE,
+        "totalPages": max(1, -(-size // CONTENT_PAGE_SIZE)),
+    }
+
+def store_book_file(ebook_id):
+    """
+    Compresses a freshly downloaded book into the content store and deletes the plain copy
+    unless CONTENT_STORE_KEEP_UPLOADS is set. A no-op when CONTENT_STORE=0.
+    """
+    file_path = txt_file_path(ebook_id)
+    if not content_store.CONTENT_STORE_ENABLED or not os.path.isfile(file_path):
+        return None
+    result = content_store.write_book(ebook_id, file_path)
+    if os.getenv("CONTENT_STORE_KEEP_UPLOADS", "0") == "0":
+        os.remove(file_path)
+    return result
+
+def read_book_bytes(ebook_id):
+    """Whole downloaded text of a book as bytes; stored books are inflated in one call."""
+    if content_store.has_book(ebook_id):
+        return content_store.read_book(ebook_id)
+    with open(txt_file_path(ebook_id), "rb") as file:
+        return file.read()
+
+def read_txt_file(ebook_id):
+    """Read content from a text file."""
+    try:
+        # Universal newlines, as open(..., "r") gives for the plain file
+        content = read_book_bytes(ebook_id).decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        return content
+    except FileNotFoundError:
+        return "Error: File not found."
+    except Exception as e:
+        return f"Error reading file: {e}"
+
+def clean_txt_file_path(ebook_id):
+    """Path of the normalised copy of a book (see normalize_book), compressed in the content store if enabled."""
+    if content_store.CONTENT_STORE_ENABLED:
+        return content_store.book_path(ebook_id, "clean")
+    return os.path.join("uploads", "clean", f"{content_store.check_book_id(ebook_id)}.txt")
+
+def normalize_book(ebook_id):
+    """
+    Writes the cleaned copy of a downloaded book and records its chapter offsets.
+
+    The Gutenberg header, licence footer, table of contents and illustration markers are
+    removed (see services.normalize). The raw file is kept for /content and search.
+
+    Returns:
+    tuple: (cleaned text, chapters), or None if the book has no text file.
+    """
+    try:
+        # Decoded without newline translation so "\r\r\n" line ends are not read as blank lines
+        raw = read_book_bytes(ebook_id).decode("utf-8", errors="replace")
+    except FileNotFoundError:
+        return None
+    text, chapters = normalize_text(raw)
+    clean_path = clean_txt_file_path(ebook_id)
+    if content_store.CONTENT_STORE_ENABLED:
+        content_store.write_book(ebook_id, text.encode("utf-8"), "clean")
+    else:
+        os.makedirs(os.path.dirname(clean_path), exist_ok=True)
+        temp_path = clean_path + ".part"
+        with open(temp_path, "w", encoding="utf-8", newline="") as file:
+            file.write(text)
+        os.replace(temp_path, clean_path)
+    save_normalized(ebook_id, clean_path, chapters, len(raw), len(text))
+    if load_text_stats(ebook_id) is not None:
+        save_text_stats(ebook_id, compute_text_stats(text))
+    log(f"Normalised book_id={ebook_id}: {len(raw)} -> {len(text)} characters, {len(chapters)} chapters")
+    return text, chapters
+
+def read_clean_text(ebook_id):
+    """
+    Reads the cleaned copy of a book, normalising it first if that has not happened yet.
+
+    Returns:
+    tuple: (text, chapters). Falls back to read_txt_file's result and no chapters when the
+           book has no text file.
+    """
+    normalized = load_normalized(ebook_id)
+    if normalized is not None and os.path.exists(normalized[0]):
+        if normalized[0] == content_store.book_path(ebook_id, "clean"):
+            return content_store.read_book(ebook_id, "clean").decode("utf-8"), normalized[1]
+        with open(normalized[0], "r", encoding="utf-8", newline="") as file:
+            return file.read(), normalized[1]
+    result = normalize_book(ebook_id)
+    if result is None:
+        return read_txt_file(ebook_id), []
+    return result
+
+# Chunk boundary patterns: sentence ends (., !, ? plus closing quotes/brackets) and blank lines
+_BOUNDARY_PATTERNS = {
+    "sentence": r"[.!?][\"')\]]*(?=\s)",
+    "paragraph": r"\n[ \t]*\r?\n",
+}
+_compiled_boundaries = {}
+
+def _boundary_regex(boundary, binary):
+    key = (boundary, binary)
+    if key not in _compiled_boundaries:
+        pattern = _BOUNDARY_PATTERNS[boundary]
+        _compiled_boundaries[key] = re.compile(pattern.encode() if binary else pattern)
+    return _compiled_boundaries[key]
+
+def _is_space(text, index):
+    # Slicing works the same for str, bytes and mmap objects
+    return text[index:index + 1].isspace()
+
+def _find_split(text, start, limit, boundary):
+    """Returns the offset just past the last boundary in text[start:limit], or 0 if there is none."""
+    binary = not isinstance(text, str)
+    if boundary == "period":
+        return text.rfind(b"." if binary else ".", start, limit) + 1
+    split = 0
+    for match in _boundary_regex(boundary, binary).finditer(text, start, limit):
+        split = match.end()
+    if split == 0 and boundary == "paragraph":
+        return _find_split(text, start, limit, "sentence")
+    if split == 0 and boundary == "sentence":
+        return _find_split(text, start, limit, "period")
+    return split
+
+def _char_boundary(text, start, index):
+    """Moves a hard cut back so it never falls inside a UTF-8 multi-byte sequence."""
+    if isinstance(text, str):
+        return index
+    while index > start + 1 and text[index] & 0xC0 == 0x80:
+        index -= 1
+    return index
+
+def read_txt_page(ebook_id, page, page_size=65536):
+    """
+    Read one page of a book's text file without loading the rest of it.
+
+    Pages are page_size bytes long, moved forward to the next line break so a page never
+    splits a line (or a UTF-8 character); consecutive pages cover the file exactly once.
+
+    Parameters:
+    ebook_id (str): The unique identifier of the eBook.
+    page (int): 1-based page number.
+    page_size (int): Nominal page size in bytes.
+
+    Returns:
+    tuple: (text, total_pages). text is "" for pages past the end.
+    """
+    file_size = book_file_info(ebook_id)[0]
+    total_pages = max(1, -(-file_size // page_size))
+    if page < 1 or page > total_pages:
+        return "", total_pages
+    # Stored books are seekable too; only the frames holding the page are inflated
+    with open_book_file(ebook_id) as file:
+        start = _line_aligned_offset(file, (page - 1) * page_size)
+        end = _line_aligned_offset(file, page * page_size)
+        file.seek(start)
+        data = file.read(end - start)
+    return data.decode("utf-8", errors="replace"), total_pages
+
+def _line_aligned_offset(file, offset):
+    if offset <= 0:
+        return 0
+    file.seek(offset - 1)
+    file.readline()  # skip to just past the line break at or after offset - 1
+    return file.tell()
+
+def iter_chunk_spans(text, max_length=5000, boundary="period", max_tokens=None):
+    """
+    Yields (start, end) offsets of chunks without copying the remaining text.
+
+    Parameters:
+    text (str, bytes or mmap): The text to split.
+    max_length (int): Maximum chunk length in characters (bytes for binary input).
+    boundary (str): "period" splits after the last "." in the window (the original behaviour),
+                    "sentence" after the last sentence end, "paragraph" at the last blank line.
+                    Each falls back to the next finer boundary, then to a hard cut at max_length.
+    max_tokens (int, optional): Token budget per chunk; when given, chunks are also kept
+                                within this many estimated tokens.
+
+    Yields:
+    tuple: (start, end) offsets of each chunk with surrounding whitespace removed.
+    """
+    if max_tokens:
+        max_length = min(max_length, max_tokens * CHARS_PER_TOKEN)
+    start, end = 0, len(text)
+    while end - start > max_length:
+        limit = start + max_length
+        split = _find_split(text, start, limit, boundary)
+        if split == 0:
+            split = _char_boundary(text, start, limit)
+        while max_tokens and split - start > 1 and estimate_tokens(text[start:split]) > max_tokens:
+            limit = start + max(1, (split - start) * max_tokens // estimate_tokens(text[start:split]))
+            split = _find_split(text, start, limit, boundary) or limit
+        chunk_start, chunk_end = start, split
+        while chunk_start < chunk_end and _is_space(text, chunk_start):
+            chunk_start += 1
+        while chunk_end > chunk_start and _is_space(text, chunk_end - 1):
+            chunk_end -= 1
+        yield chunk_start, chunk_end
+        # Match the original text[split:].strip(): drop whitespace on both ends of the remainder
+        start = split
+        while start < end and _is_space(text, start):
+            start += 1
+        while end > start and _is_space(text, end - 1):
+            end -= 1
+    yield start, end
+
+def iter_chapter_chunk_spans(text, chapters, max_length=5000, boundary="period", max_tokens=None):
+    """
+    Like iter_chunk_spans, but chunks never cross a chapter boundary: each chapter (or run of
+    short chapters, see normalize.chapter_spans) is split on its own.
+    """
+    for section_start, section_end in chapter_spans(chapters, len(text), max_length):
+        section = text[section_start:section_end]
+        for start, end in iter_chunk_spans(section, max_length, boundary, max_tokens):
+            if end > start:
+                yield section_start + start, section_start + end
+
+def iter_chunks(text, max_length=5000, boundary="period", max_tokens=None):
+    """Generator version of chunk_text; yields one chunk string at a time."""
+    for start, end in iter_chunk_spans(text, max_length, boundary, max_tokens):
+        yield text[start:end]
+
+def iter_file_chunks(file_path, max_length=5000, boundary="period"):
+    """
+    Memory-maps a UTF-8 text file and yields decoded chunks without reading the whole file into memory.
+    max_length is measured in bytes; hard cuts are moved back to a character boundary.
+    """
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for start, end in iter_chunk_spans(mapped, max_length, boundary):
+                yield mapped[start:end].decode("utf-8", errors="replace")
+
+def chunk_text(text, max_length=5000, boundary="period", max_tokens=None):
+    """Splits the text into chunks of specified max_length."""
+    return list(iter_chunks(text, max_length, boundary, max_tokens))
+
+def sample_chunks(text, num_samples=20, seed=None, max_length=5000, boundary="period", max_tokens=None, chapters=None):
+    """
+    Same selection as select_chunks(chunk_text(text), ...), but only the selected chunks are
+    materialised; the rest of the book is represented by (start, end) offsets.
+    With chapters (see read_clean_text) the chunks follow chapter boundaries.
+    """
+    if chapters:
+        spans = list(iter_chapter_chunk_spans(text, chapters, max_length, boundary, max_tokens))
+    else:
+        spans = list(iter_chunk_spans(text, max_length, boundary, max_tokens))
+    return [text[start:end] for start, end in select_chunks(spans, num_samples, seed)]
+
+def select_chunks(chunks, num_samples=20, seed=None):
+    """
+    Selects a subset of chunks, ensuring diversity from start, middle, and end.
+    Passing a seed (e.g. the book_id) makes the middle sample repeatable across runs.
+    """
+    if len(chunks) <= num_samples:
+        return chunks  # If chunks are fewer than needed, return all
+    
+    start_chunks = chunks[:max(1, num_samples // 4)]  # First few chunks
+    end_chunks = chunks[-max(1, num_samples // 4):]  # Last few chunks
+    middle_chunks = chunks[max(1, len(chunks) // 3): -max(1, len(chunks) // 3)]  # Middle section
+    
+    if len(middle_chunks) > num_samples - len(start_chunks) - len(end_chunks):
+        middle_chunks = random.Random(seed).sample(middle_chunks, num_samples - len(start_chunks) - len(end_chunks))
+    
+    return start_chunks + middle_chunks + end_chunks
+
+def build_chunk_prompt(chunk):
+    """Builds the per-chunk analysis prompt sent to the LLM."""
+    return (
+                "You are a highly intelligent AI assistant specializing in summarizing eBooks with precision and clarity. "
+                "Your task is to extract key points, main ideas, and crucial details while ensuring coherence and brevity.\n\n"
+                "Begin the response by analyzing and providing:\n"
+                "At the begining of response just inlcude json response only"
+                "- The overall sentiment of the text (e.g., positive, neutral, negative).\n"
+                "- The language in which the text is written.\n"
+                "- Identification of key characters (if applicable).\n\n"
+                "Then, generate a well-structured and highly concise summary that captures all essential points without losing meaning.\n\n"
+                "The response should be in a structured JSON format as follows:\n\n"
+                "{\n"
+                '  "summary": "...",\n'
+                '  "sentiment": "...",\n'
+                '  "language": "...",\n'
+                '  "key_characters": ["...", "..."],\n'
+                '  "themes": ["...", "..."]\n'
+                "}\n"
+                "\nNow, process the following text and generate the response:\n\n" + chunk
+        )
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for rate limiting and chunk budgets."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+class TokenUsage:
+    """Thread-safe per-book counters of LLM requests, cache hits and prompt/completion tokens."""
+
+    def __init__(self):
+        self.requests = 0
+        self.cached_responses = 0
+        self.chunks = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, prompt, completion):
+        """Counts one request, using the token counts of the Completion when the backend reports them."""
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += completion.prompt_tokens or estimate_tokens(prompt)
+            self.completion_tokens += completion.completion_tokens or estimate_tokens(completion.content or "")
+
+    def add(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "cached_responses": self.cached_responses,
+                "chunks": self.chunks,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+def _send(backend, prompt, system_prompt, usage, max_output_tokens=None):
+    """One chat completion for `prompt`, throttled by the rate limiter when max_output_tokens is given."""
+    if max_output_tokens is not None:
+        get_rate_limiter().acquire(estimate_tokens(prompt) + max_output_tokens)
+    completion = backend.complete(prompt, system_prompt, TEMPERATURE)
+    if usage is not None:
+        usage.record(prompt, completion)
+    return completion.content
+
+def _cached(backend, prompt_version, text, request, validate, usage):
+    """cached_completion keyed on the backend's model that also counts cache hits in `usage`."""
+    sent = []
+
+    def counted_request():
+        sent.append(True)
+        return request()
+
+    response = cached_completion(backend.model, TEMPERATURE, prompt_version, text, counted_request, validate=validate)
+    if usage is not None and not sent:
+        usage.add("cached_responses")
+    return response
+
+def _request_parsed(backend, prompt_version, text, request, parse, usage):
+    """
+    Runs a cached request and returns parse(response), re-requesting an unusable response up
+    to PARSE_RETRIES times. Only responses that parse are stored in llm_cache.
+
+    Returns:
+    The parsed value, or None if every attempt failed.
+    """
+    for attempt in range(PARSE_RETRIES + 1):
+        parsed = []
+
+        def validate(response):
+            parsed.append(parse(response))
+            return parsed[-1] is not None
+
+        response = _cached(backend, prompt_version, text, request, validate, usage)
+        if not parsed:
+            # Cache hit (or empty response): validate() was not called
+            parsed.append(parse(response) if response else None)
+        if parsed[-1] is not None:
+            return parsed[-1]
+        count_parse_event("wasted_calls")
+        if attempt < PARSE_RETRIES:
+            count_parse_event("rerequests")
+    return None
+
+def analyze_chunk(client, chunk, max_output_tokens=1024, usage=None):
+    """
+    Sends a single chunk to the LLM, throttled by the shared rate limiter and retried on 429/5xx.
+    Responses are served from the llm_cache table when the same chunk was analysed before, and
+    a response that is not a valid analysis is requested again (see PARSE_RETRIES).
+
+    Returns:
+    dict: The validated analysis of the chunk, or None if the model never produced one.
+    """
+    backend = as_backend(client)
+    prompt = build_chunk_prompt(chunk)
+    return _request_parsed(
+        backend, CHUNK_PROMPT_VERSION, chunk,
+        lambda: call_with_retry(lambda: _send(backend, prompt, "you are a helpful assistant.", usage, max_output_tokens)),
+        lambda response: validate_analysis(extract_json(response)),
+        usage
+    )
+
+PACK_SECTION_HEADER = "=== Section {} ==="
+
+def build_packed_prompt(chunks):
+    """Builds one analysis prompt for several chunks, asking for a JSON array with one result per chunk."""
+    sections = "".join(
+        f"{PACK_SECTION_HEADER.format(number)}\n{chunk}\n\n" for number, chunk in enumerate(chunks, start=1)
+    )
+    return (
+                "You are a highly intelligent AI assistant specializing in summarizing eBooks with precision and clarity. "
+                "The text below is split into numbered sections. Analyse every section on its own: extract key points, "
+                "main ideas, and crucial details while ensuring coherence and brevity.\n\n"
+                "For each section provide:\n"
+                "- The overall sentiment of the text (e.g., positive, neutral, negative).\n"
+                "- The language in which the text is written.\n"
+                "- Identification of key characters (if applicable).\n"
+                "- A well-structured and highly concise summary that captures all essential points without losing meaning.\n\n"
+                f"Respond with a JSON array only, containing exactly {len(chunks)} objects in section order, "
+                "each in the following format:\n\n"
+                "{\n"
+                '  "summary": "...",\n'
+                '  "sentiment": "...",\n'
+                '  "language": "...",\n'
+                '  "key_characters": ["...", "..."],\n'
+                '  "themes": ["...", "..."]\n'
+                "}\n"
+                "\nNow, process the following sections and generate the response:\n\n" + sections
+        )
+
+def pack_chunks(chunks, token_budget=None, max_chunks=None):
+    """
+    Groups consecutive chunks so each group's packed prompt stays within `token_budget` tokens.
+
+    Parameters:
+    chunks (list): Chunks of text to analyse.
+    token_budget (int, optional): Max estimated prompt tokens per request. Defaults to PACK_TOKEN_BUDGET;
+                                  0 puts every chunk in its own group.
+    max_chunks (int, optional): Max chunks per request. Defaults to PACK_MAX_CHUNKS.
+
+    Returns:
+    list: Lists of chunks, in the original order.
+    """
+    token_budget = PACK_TOKEN_BUDGET if token_budget is None else token_budget
+    max_chunks = max_chunks or PACK_MAX_CHUNKS
+    if token_budget <= 0:
+        return [[chunk] for chunk in chunks]
+    overhead = estimate_tokens(build_packed_prompt([]))
+    groups, current, size = [], [], overhead
+    for chunk in chunks:
+        cost = estimate_tokens(chunk) + 8  # section header
+        if current and (len(current) >= max_chunks or size + cost > token_budget):
+            groups.append(current)
+            current, size = [], overhead
+        current.append(chunk)
+        size += cost
+    if current:
+        groups.append(current)
+    return groups
+
+def parse_packed_response(raw_string, count):
+    """
+    Splits a packed response into one validated analysis per chunk.
+
+    Returns:
+    list: `count` entries, None for every chunk the response does not cover with a valid object
+          (e.g. a truncated array only covers the first chunks); None if it holds no array at all.
+    """
+    parsed = extract_json(raw_string) if raw_string else None
+    if isinstance(parsed, dict) and count == 1:
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        return None
+    items = [validate_analysis(item) for item in parsed[:count]]
+    return items + [None] * (count - len(items))
+
+def analyze_packed(client, chunks, usage=None):
+    """
+    Analyses a group of chunks with one request.
+
+    A single chunk uses the plain per-chunk prompt (and its cache entries). Chunks the packed
+    answer does not cover with a valid object are re-sent one by one, so one bad entry never
+    costs the whole group.
+
+    Returns:
+    list: One validated analysis dict (or None) per chunk, in order.
+    """
+    if usage is not None:
+        usage.add("chunks", len(chunks))
+    if len(chunks) == 1:
+        return [analyze_chunk(client, chunks[0], usage=usage)]
+    backend = as_backend(client)
+    prompt = build_packed_prompt(chunks)
+    items = []
+
+    def validate(raw):
+        items[:] = parse_packed_response(raw, len(chunks)) or [None] * len(chunks)
+        return all(item is not None for item in items)
+
+    response = _cached(
+        backend, PACKED_PROMPT_VERSION, "\x1e".join(chunks),
+        lambda: call_with_retry(lambda: _send(
+            backend, prompt, "you are a helpful assistant.", usage, OUTPUT_TOKENS_PER_CHUNK * len(chunks)
+        )),
+        validate,
+        usage
+    )
+    if not items:
+        validate(response)
+    failed = [index for index, item in enumerate(items) if item is None]
+    if failed:
+        if len(failed) == len(chunks):
+            count_parse_event("wasted_calls")
+        count_parse_event("rerequests", len(failed))
+        log(f"Packed response did not cover {len(failed)} of {len(chunks)} chunks; re-requesting those one by one")
+        for index in failed:
+            items[index] = analyze_chunk(client, chunks[index], usage=usage)
+    return items
+
+def process_raw_analysis(client, selected_chunks, max_workers=None, usage=None, token_budget=None, on_result=None,
+                         known_results=None):
+    """
+    Analyses the selected chunks concurrently, packing several chunks into each request.
+
+    Parameters:
+    client: LLM backend (see services.llm_backends.get_llm_backend) or a raw Groq-compatible
+            client, shared by all worker threads.
+    selected_chunks (list): Chunks of text to analyse.
+    max_workers (int, optional): Concurrency cap. Defaults to LLM_MAX_CONCURRENCY or 10.
+    usage (TokenUsage, optional): Receives request and token counts.
+    token_budget (int, optional): Prompt token budget per packed request (see pack_chunks).
+    on_result (callable, optional): Called from the worker threads as on_result(first_chunk_index,
+                                    analyses) as soon as each request finishes.
+    known_results (dict, optional): Analyses by chunk_fingerprint, e.g. of a near-duplicate edition
+                                    (see services.editions); chunks found there are not sent again.
+
+    Returns:
+    list: One validated analysis dict per chunk, in chunk order; None for chunks the model
+          never answered usably.
+    """
+    if not selected_chunks:
+        return []
+    if known_results:
+        return _analyze_unknown_chunks(client, selected_chunks, known_results, max_workers, usage, token_budget, on_result)
+    groups = pack_chunks(selected_chunks, token_budget)
+    if max_workers is None:
+        max_workers = int(os.getenv("LLM_MAX_CONCURRENCY", "10"))
+    max_workers = max(1, min(max_workers, len(groups)))
+    offsets = accumulate((len(group) for group in groups), initial=0)
+
+    @traced
+    def analyze_group(first_index, group):
+        analyses = analyze_packed(client, group, usage)
+        if on_result is not None:
+            on_result(first_index, analyses)
+        return analyses
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map yields results in input order regardless of completion order
+        return list(chain.from_iterable(executor.map(analyze_group, offsets, groups)))
+
+def _analyze_unknown_chunks(client, chunks, known_results, max_workers, usage, token_budget, on_result):
+    """process_raw_analysis of only the chunks missing from `known_results`, merged back in chunk order."""
+    results = [known_results.get(chunk_fingerprint(chunk)) for chunk in chunks]
+    missing = [index for index, result in enumerate(results) if result is None]
+    log(f"Reusing {len(chunks) - len(missing)} of {len(chunks)} chunk analyses; analysing {len(missing)}")
+    if on_result is not None:
+        for index, result in enumerate(results):
+            if result is not None:
+                on_result(index, [result])
+
+    def forward(first_index, analyses):
+        # first_index counts within `missing`
+        for offset, analysis in enumerate(analyses):
+            on_result(missing[first_index + offset], [analysis])
+
+    analyses = process_raw_analysis(
+        client, [chunks[index] for index in missing], max_workers=max_workers, usage=usage,
+        token_budget=token_budget, on_result=forward if on_result is not None else None
+    )
+    for index, analysis in zip(missing, analyses):
+        results[index] = analysis
+    return results
+
+def extract_json(raw_string):
+    """
+    Extract JSON content from an LLM response: fenced (``` or ```json) or bare, with or without
+    surrounding prose, repairing trailing commas and truncated objects (see services.llm_json).
+    """
+    return parse_json_response(raw_string)
+
+def parse_analysis_responses(response_list):
+    """
+    Flattens chunk results into a list of analysis dicts, in order.
+
+    Entries may be analysis dicts (as returned by process_raw_analysis), raw responses holding
+    one JSON object, or raw packed responses holding a JSON array. Unusable entries are skipped.
+    """
+    parsed_list = []
+    for response in response_list:
+        if isinstance(response, dict):
+            parsed_list.append(response)
+            continue
+        parsed = extract_json(response) if response else None
+        for item in parsed if isinstance(parsed, list) else [parsed]:
+            analysis = validate_analysis(item) if item is not None else None
+            if analysis is not None:
+                parsed_list.append(analysis)
+    return parsed_list
+
+def merge_responses(response_list):
+    """Merge chunk analyses (dicts or raw plain/packed responses) into a single structured dictionary."""
+    return merge_parsed_responses(parse_analysis_responses(response_list))
+
+def merge_parsed_responses(parsed_list):
+    """
+    Merge already-parsed analysis dictionaries (None entries are skipped) into one dictionary.
+
+    Summaries are joined in order (repeats dropped); sentiment and language are voted on; key
+    characters and themes are canonicalised, with aliases merged and ranked by how many analyses
+    mention them (see services.entities), so the reduce prompt stays small and deterministic.
+    """
+    merged_data = defaultdict(list)
+
+    for parsed_json in filter(None, parsed_list):
+        for key, value in parsed_json.items():
+            merged_data[key].append(value)
+
+    final_data = {}
+    for key, values in merged_data.items():
+        if key == "summary":
+            final_data[key] = " ".join(dict.fromkeys(str(value).strip() for value in values if str(value).strip()))
+        elif key in ("sentiment", "language"):
+            final_data[key] = vote(
+                [item for value in values for item in (value if isinstance(value, list) else [value])],
+                SENTIMENT_LABELS if key == "sentiment" else None
+            )
+        else:
+            final_data[key] = canonical_entities(
+                [value if isinstance(value, list) else [value] for value in values],
+                names=key == "key_characters"
+            )
+
+    return final_data
+
+def build_final_prompt(merged_output):
+    """Builds the prompt that consolidates merged chunk analyses into one analysis."""
+    return (
+    "You are an advanced AI designed to process and refine text data with clarity and conciseness. "
+    "Your task is to analyze the provided summaries and generate a refined version that meets the following criteria:\n\n"
+    "1. Provide a well-structured and concise summary that retains all essential points while improving readability.\n"
+    "2. Identify and consolidate sentiments—if duplicates exist, remove them; if they are similar, retain only the most relevant one.\n"
+    "3. Identify and consolidate the language—if duplicates exist, remove them; if they are similar, retain only one.\n"
+    "4. Extract key characters, ensuring no duplicates while keeping only distinct names.\n"
+    "5. Extract themes, removing exact duplicates but preserving variations when necessary.\n\n"
+    "6. Response should have only my json nothing else"
+    "The output should be in structured JSON format as follows:\n\n"
+    "{\n"
+    '  "summary": "...",\n'
+    '  "sentiment": "...",\n'
+    '  "language": "...",\n'
+    '  "key_characters": ["...", "..."],\n'
+    '  "themes": ["...", "..."]\n'
+    "}\n\n"
+    "Now, process the following text and generate the response:\n\n" + str(merged_output)
+    )
+
+def process_final_analysis(merged_output, client, usage=None, max_output_tokens=1024):
+    """
+    Asks the LLM to consolidate merged chunk analyses into one analysis, throttled by the shared
+    rate limiter and retried on 429/5xx like the chunk calls.
+
+    The response is parsed tolerantly and validated; an unusable response is re-requested (see
+    PARSE_RETRIES), and if the model never produces a valid analysis the mechanical merge itself
+    is returned, so a malformed reply never fails the whole book.
+
+    Returns:
+    dict: The validated final analysis.
+    """
+    prompt = build_final_prompt(merged_output)
+
+    # AI Processing (Example usage, requires an AI API like OpenAI, Groq, etc.)
+    backend = as_backend(client)
+    final_analysis = _request_parsed(
+        backend, FINAL_PROMPT_VERSION, str(merged_output),
+        lambda: call_with_retry(lambda: _send(backend, prompt, "You are a helpful assistant.", usage, max_output_tokens)),
+        lambda response: validate_analysis(extract_json(response)),
+        usage
+    )
+    if final_analysis is None:
+        log("Final analysis response was unusable; falling back to the merged chunk analyses")
+        final_analysis = validate_analysis(merged_output)
+    if final_analysis is None:
+        raise ValueError("No usable analysis was produced for any chunk")
+    return final_analysis
\ No newline at end of file
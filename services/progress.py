@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import threading
+from .db import connection
+from .aio import run_sync
+
+TERMINAL_STATUSES = ("Analysis Completed", "Analysis Failed")
+KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "10"))  # seconds between idle SSE comments
+
+# Wakes event streams in this process as soon as an analysis writes progress; streams still
+# re-read the database every KEEPALIVE_INTERVAL, so workers in other processes are picked up too.
+_updates = threading.Condition()
+_versions = {}
+_async_waiters = {}  # book_id -> {(event loop, asyncio.Event)} of streams served by asgi.py
+
+
+def notify_progress(book_id):
+    """Wakes every event stream waiting on `book_id`."""
+    with _updates:
+        _versions[str(book_id)] = _versions.get(str(book_id), 0) + 1
+        _updates.notify_all()
+        for loop, event in _async_waiters.get(str(book_id), ()):
+            loop.call_soon_threadsafe(event.set)
+
+
+def progress_version(book_id):
+    with _updates:
+        return _versions.get(str(book_id), 0)
+
+
+def wait_for_progress(book_id, version, timeout):
+    """Blocks until `book_id` moves past `version` or `timeout` seconds pass; returns the current version."""
+    book_id = str(book_id)
+    with _updates:
+        _updates.wait_for(lambda: _versions.get(book_id, 0) != version, timeout)
+        return _versions.get(book_id, 0)
+
+
+async def wait_for_progress_async(book_id, version, timeout):
+    """wait_for_progress for coroutines: waits on an asyncio.Event instead of holding a thread."""
+    book_id = str(book_id)
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    with _updates:
+        if _versions.get(book_id, 0) != version:
+            return _versions[book_id]
+        _async_waiters.setdefault(book_id, set()).add(waiter)
+    try:
+        await asyncio.wait_for(waiter[1].wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        with _updates:
+            waiters = _async_waiters.get(book_id)
+            waiters.discard(waiter)
+            if not waiters:
+                del _async_waiters[book_id]
+    return progress_version(book_id)
+
+
+class AnalysisProgress:
+    """
+    Records the progress of one process_analysis run: the current stage and every chunk result
+    as it arrives, so the UI can show partial summaries before the whole book is done.
+    """
+
+    def __init__(self, book_id):
+        self.book_id = str(book_id)
+        self.lock = threading.Lock()
+        self.chunks_done = 0
+        with connection() as conn:
+            conn.execute("DELETE FROM analysis_partials WHERE book_id = ?", (self.book_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_progress (book_id, stage, chunks_total, chunks_done) VALUES (?, 'read', 0, 0)",
+                (self.book_id,),
+            )
+        notify_progress(self.book_id)
+
+    def stage(self, name, chunks_total=None):
+        """Moves to stage `name` (chunk, map, reduce, persist), optionally setting the chunk count."""
+        with connection() as conn:
+            conn.execute(
+                """
+                UPDATE analysis_progress
+                SET stage = ?, chunks_total = COALESCE(?, chunks_total), updated_at = CURRENT_TIMESTAMP
+                WHERE book_id = ?
+                """,
+                (name, chunks_total, self.book_id),
+            )
+        notify_progress(self.book_id)
+
+    def chunk_results(self, first_index, results):
+        """
+        Stores the analyses of chunks first_index.. (called from the map worker threads); None
+        entries are chunks without a usable result and only count as done.
+        """
+        with self.lock:
+            self.chunks_done += len(results)
+            chunks_done = self.chunks_done
+        with connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO analysis_partials (book_id, chunk_index, result) VALUES (?, ?, ?)",
+                (
+                    (self.book_id, first_index + offset, json.dumps(result))
+                    for offset, result in enumerate(results) if result is not None
+                ),
+            )
+            conn.execute(
+                "UPDATE analysis_progress SET chunks_done = ?, updated_at = CURRENT_TIMESTAMP WHERE book_id = ?",
+                (chunks_done, self.book_id),
+            )
+        notify_progress(self.book_id)
+
+    def finish(self):
+        """Marks the run done and drops its partial results; the final analysis is in ebook_analysis."""
+        with connection() as conn:
+            conn.execute("DELETE FROM analysis_partials WHERE book_id = ?", (self.book_id,))
+            conn.execute(
+                "UPDATE analysis_progress SET stage = 'done', updated_at = CURRENT_TIMESTAMP WHERE book_id = ?",
+                (self.book_id,),
+            )
+        notify_progress(self.book_id)
+
+
+def get_progress(book_id, after=-1):
+    """
+    Current analysis state of a book.
+
+    Parameters:
+    book_id (str): The unique identifier of the eBook.
+    after (int): Only partial results stored after the one with this sequence number are returned.
+
+    Returns:
+    dict: {"status", "stage", "chunks_total", "chunks_done", "partials": [{"seq", "index", ...analysis}]};
+          status is None when the book was never queued for analysis.
+    """
+    book_id = str(book_id)
+    with connection() as conn:
+        status = conn.execute("SELECT status FROM ebook_analysis WHERE ebook_id = ?", (book_id,)).fetchone()
+        progress = conn.execute(
+            "SELECT stage, chunks_total, chunks_done FROM analysis_progress WHERE book_id = ?", (book_id,)
+        ).fetchone()
+        partials = conn.execute(
+            # seq is AUTOINCREMENT: it orders results by arrival even when chunks finish out of order,
+            # and is never reused when a finished or restarted run deletes its rows
+            "SELECT seq, chunk_index, result FROM analysis_partials WHERE book_id = ? AND seq > ? ORDER BY seq",
+            (book_id, after),
+        ).fetchall()
+    return {
+        "status": status["status"] if status else None,
+        "stage": progress["stage"] if progress else None,
+        "chunks_total": progress["chunks_total"] if progress else 0,
+        "chunks_done": progress["chunks_done"] if progress else 0,
+        "partials": [
+            {"seq": row["seq"], "index": row["chunk_index"], **json.loads(row["result"])} for row in partials
+        ],
+    }
+
+
+def _event(name, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {name}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+def _progress_events(progress, last_state, after):
+    """
+    Events for one get_progress snapshot.
+
+    Returns:
+    tuple: (events, state, sequence of the last partial sent, whether the stream is finished)
+    """
+    events = []
+    state = (progress["stage"], progress["chunks_done"], progress["chunks_total"])
+    if state != last_state:
+        events.append(_event("progress", {
+            "stage": progress["stage"],
+            "chunks_done": progress["chunks_done"],
+            "chunks_total": progress["chunks_total"],
+        }))
+    for partial in progress["partials"]:
+        after = partial["seq"]
+        events.append(_event("chunk", partial, event_id=after))
+    finished = progress["status"] is None or progress["status"] in TERMINAL_STATUSES
+    if finished:
+        events.append(_event("done", {"status": progress["status"]}))
+    return events, state, after, finished
+
+
+def iter_progress_events(book_id, after=-1):
+    """
+    Server-Sent Events for one book's analysis.
+
+    Emits "progress" on every stage or chunk-count change, "chunk" (with its arrival sequence as
+    the event id, so a reconnecting EventSource resumes via Last-Event-ID) for every partial result,
+    and finally "done" with the terminal status. Idle periods send keep-alive comments.
+    """
+    last_state = None
+    while True:
+        version = progress_version(book_id)
+        events, last_state, after, finished = _progress_events(get_progress(book_id, after), last_state, after)
+        yield from events
+        if finished:
+            return
+        if wait_for_progress(book_id, version, KEEPALIVE_INTERVAL) == version:
+            yield ": keep-alive\n\n"
+
+
+async def aiter_progress_events(book_id, after=-1):
+    """Async twin of iter_progress_events for asgi.py; an idle stream holds no thread."""
+    last_state = None
+    while True:
+        version = progress_version(book_id)
+        progress = await run_sync(get_progress, book_id, after)
+        events, last_state, after, finished = _progress_events(progress, last_state, after)
+        for event in events:
+            yield event
+        if finished:
+            return
+        if await wait_for_progress_async(book_id, version, KEEPALIVE_INTERVAL) == version:
+            yield ": keep-alive\n\n"
@@ -0,0 +1,188 @@
+import html
+import json
+import re
+from .db import connection
+from .operations import iter_chunks, iter_file_chunks, read_txt_file
+
+# bm25 weights for the book_search columns: title, author, subjects, summary, themes, body
+BM25_WEIGHTS = (10.0, 6.0, 4.0, 3.0, 3.0, 1.0)
+INDEX_CHUNK_LENGTH = 2000
+SNIPPET_TOKENS = 24
+
+_COLUMNS = ("title", "author", "subjects", "summary", "themes", "body")
+# snippet() marks matches with these control characters; the text is HTML-escaped before they
+# become <mark> tags, so markup in a book's text or metadata is never rendered
+_MATCH_START, _MATCH_END = "\x02", "\x03"
+
+
+def snippet_html(snippet):
+    """An FTS snippet with _MATCH_START/_MATCH_END markers as escaped HTML with <mark> around matches."""
+    return html.escape(snippet).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>")
+
+
+def _replace_docs(conn, book_id, kind, documents):
+    """Replaces all book_search rows of one kind for a book with `documents` (dicts of column values)."""
+    old_rowids = [row[0] for row in conn.execute(
+        "SELECT rowid FROM book_search_docs WHERE book_id = ? AND kind = ?", (book_id, kind)
+    )]
+    conn.executemany("DELETE FROM book_search WHERE rowid = ?", ((rowid,) for rowid in old_rowids))
+    conn.execute("DELETE FROM book_search_docs WHERE book_id = ? AND kind = ?", (book_id, kind))
+    for chunk_index, document in enumerate(documents):
+        rowid = conn.execute(
+            "INSERT INTO book_search_docs (book_id, kind, chunk_index) VALUES (?, ?, ?)",
+            (book_id, kind, chunk_index),
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO book_search (rowid, title, author, subjects, summary, themes, body) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (rowid,) + tuple(document.get(column) for column in _COLUMNS),
+        )
+
+
+def index_book_text(book_id, text):
+    """Indexes the body text of a book chunk by chunk, replacing any previous body rows."""
+    book_id = str(book_id)
+    documents = ({"body": chunk} for chunk in iter_chunks(text, INDEX_CHUNK_LENGTH, boundary="paragraph") if chunk)
+    with connection() as conn:
+        _replace_docs(conn, book_id, "body", documents)
+
+
+def index_book_file(book_id, file_path):
+    """Like index_book_text, but reads the text through a memory map instead of a Python string."""
+    book_id = str(book_id)
+    documents = ({"body": chunk} for chunk in iter_file_chunks(file_path, INDEX_CHUNK_LENGTH, boundary="paragraph") if chunk)
+    with connection() as conn:
+        _replace_docs(conn, book_id, "body", documents)
+
+
+def index_book_metadata(book_id, metadata, conn=None):
+    """Indexes the scraped Gutenberg metadata (title, author, subjects) of a book, optionally inside `conn`'s transaction."""
+    if not metadata or "error" in metadata:
+        return
+    subjects = " ".join(
+        value for key, value in metadata.items() if key in ("Subject", "LoC Class", "Note", "Alternate Title")
+    )
+    document = {"title": metadata.get("Title"), "author": metadata.get("Author"), "subjects": subjects}
+    if conn is None:
+        with connection() as own_conn:
+            _replace_docs(own_conn, str(book_id), "meta", [document])
+    else:
+        _replace_docs(conn, str(book_id), "meta", [document])
+
+
+def index_book_analysis(book_id, summary, themes):
+    """Indexes the LLM analysis summary and themes of a book."""
+    if isinstance(themes, list):
+        themes = " ".join(str(theme) for theme in themes)
+    with connection() as conn:
+        _replace_docs(conn, str(book_id), "analysis", [{"summary": summary, "themes": themes}])
+
+
+def to_match_query(query):
+    """
+    Turns free text into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted term (so FTS5 operators and punctuation in user input are
+    never interpreted), terms are ANDed, and the last word is matched as a prefix.
+    """
+    terms = re.findall(r"\w+", query or "")
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_books(query, page=1, per_page=10):
+    """
+    Ranked full-text search over book text, metadata and analyses.
+
+    Results are grouped by book (the best-scoring document per book decides its rank) and
+    only the requested page gets snippets, so cost does not grow with the number of hits shown.
+
+    Parameters:
+    query (str): Free-text query.
+    page (int): 1-based page number.
+    per_page (int): Results per page.
+
+    Returns:
+    dict: {"query", "page", "per_page", "total", "results": [{"book_id", "title", "author",
+           "score", "matched", "chunk_index", "snippet"}]}; snippet is escaped HTML
+          with the matched terms in <mark>, title and author are plain text.
+    """
+    page = max(1, int(page))
+    per_page = max(1, min(int(per_page), 100))
+    response = {"query": query, "page": page, "per_page": per_page, "total": 0, "results": []}
+    match = to_match_query(query)
+    if match is None:
+        return response
+
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    with connection() as conn:
+        rows = conn.execute(
+            f"""
+            WITH hits AS MATERIALIZED (
+                SELECT rowid, bm25(book_search, {weights}) AS score
+                FROM book_search WHERE book_search MATCH ?
+            ),
+            ranked AS (
+                SELECT docs.book_id, docs.kind, docs.chunk_index, hits.rowid, hits.score,
+                       ROW_NUMBER() OVER (PARTITION BY docs.book_id ORDER BY hits.score) AS position
+                FROM hits JOIN book_search_docs AS docs ON docs.rowid = hits.rowid
+            )
+            SELECT ranked.*, ebooks.title, ebooks.author, COUNT(*) OVER () AS total
+            FROM ranked LEFT JOIN ebooks ON ebooks.book_id = ranked.book_id
+            WHERE position = 1
+            ORDER BY score
+            LIMIT ? OFFSET ?
+            """,
+            (match, per_page, (page - 1) * per_page),
+        ).fetchall()
+
+        for row in rows:
+            snippet = conn.execute(
+                f"""
+                SELECT snippet(book_search, -1, ?, ?, '…', {SNIPPET_TOKENS})
+                FROM book_search WHERE book_search MATCH ? AND rowid = ?
+                """,
+                (_MATCH_START, _MATCH_END, match, row["rowid"]),
+            ).fetchone()
+            response["total"] = row["total"]
+            response["results"].append({
+                "book_id": row["book_id"],
+                "title": row["title"],
+                "author": row["author"],
+                "score": -row["score"],  # bm25() is lower-is-better; expose higher-is-better
+                "matched": row["kind"],
+                "chunk_index": row["chunk_index"],
+                "snippet": snippet_html(snippet[0]) if snippet else "",
+            })
+    return response
+
+
+def reindex_all():
+    """Rebuilds the search index for every book in the ebooks table (one-off backfill)."""
+    with connection() as conn:
+        books = conn.execute("SELECT book_id, ebook_json FROM ebooks WHERE book_id IS NOT NULL").fetchall()
+        analyses = {
+            str(row["ebook_id"]): row for row in conn.execute(
+                "SELECT ebook_id, summary, themes FROM ebook_analysis WHERE status = 'Analysis Completed'"
+            )
+        }
+    for book in books:
+        book_id = book["book_id"]
+        text = read_txt_file(book_id)
+        if not text.startswith("Error"):
+            index_book_text(book_id, text)
+        if book["ebook_json"]:
+            index_book_metadata(book_id, json.loads(book["ebook_json"]))
+        analysis = analyses.get(book_id)
+        if analysis:
+            index_book_analysis(book_id, analysis["summary"], json.loads(analysis["themes"] or "[]"))
+        print(f"Indexed book_id={book_id}")
+    return len(books)
+
+
+if __name__ == "__main__":
+    from .operations import create_database
+    create_database()
+    print(f"Reindexed {reindex_all()} books")
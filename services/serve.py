@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+
+
+def main():
+    """
+    Production launcher for the ASGI serving mode (asgi.py) on uvicorn.
+
+    The schema is migrated and interrupted analysis jobs are recovered once here, before the
+    worker processes start, so they never race on a migration and never re-queue each other's
+    running jobs. Every worker process runs its own event loop, services.aio thread pool and
+    analysis workers; they share the SQLite database, job queue and content store.
+    """
+    parser = argparse.ArgumentParser(description="Serves the app with uvicorn worker processes (ASGI mode).")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5005")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="Worker processes (default WEB_CONCURRENCY or 1)")
+    parser.add_argument("--threads", type=int, help="Threads per process for blocking work (ASYNC_THREADS)")
+    parser.add_argument("--analysis-workers", type=int,
+                        help="Analysis worker threads per process (ANALYSIS_WORKERS); 0 leaves analysis to other processes")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+        import asgiref
+    except ImportError:
+        sys.exit("The ASGI serving mode needs uvicorn and asgiref: pip install uvicorn asgiref")
+
+    # Read by the worker processes when they import asgi.py
+    if args.threads is not None:
+        os.environ["ASYNC_THREADS"] = str(args.threads)
+    if args.analysis_workers is not None:
+        os.environ["ANALYSIS_WORKERS"] = str(args.analysis_workers)
+
+    from .operations import create_database
+    from .jobs import recover_jobs
+    create_database()
+    recover_jobs()
+    os.environ["ANALYSIS_RECOVER"] = "0"
+
+    uvicorn.run(
+        "asgi:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        log_level=args.log_level,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import ast
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+_INPUT_MARKER = "generate the response:\n\n"
+_SECTION_PATTERN = re.compile(r"^=== Section \d+ ===\n", re.MULTILINE)
+_COMMON_CAPITALISED = {
+    "The", "A", "An", "And", "But", "I", "It", "He", "She", "They", "We", "You", "In", "On", "At",
+    "Of", "To", "For", "With", "As", "His", "Her", "This", "That", "There", "Then", "When", "What",
+    "Project", "Gutenberg", "Ebook", "EBook", "Chapter", "CHAPTER",
+}
+
+
+class StubLLMClient:
+    """
+    Deterministic, offline stand-in for the Groq client.
+
+    It exposes the same `client.chat.completions.create(messages=..., model=..., temperature=...)`
+    call and answers with analysis JSON derived from the input text alone (first sentences as the
+    summary, frequent capitalised words as characters, frequent long words as themes), so the
+    whole pipeline can run and be load-tested without network access.
+
+    Parameters:
+    latency (float): Seconds to sleep per call, to imitate a remote model.
+    malformed_rate (float): Fraction of answers to mangle the way real models sometimes do
+                            (prose around the JSON, a ```json fence, or a truncated object),
+                            to exercise the tolerant parser and re-requests.
+    seed (int): Seed for choosing which answers are mangled.
+    """
+
+    def __init__(self, latency=0.0, malformed_rate=0.0, seed=0):
+        self.latency = latency
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, messages, model=None, temperature=None, **kwargs):
+        prompt = messages[-1]["content"]
+        text = prompt.split(_INPUT_MARKER, 1)[-1]
+        sections = _SECTION_PATTERN.split(text)
+        if len(sections) > 1:
+            # Packed prompt: one result per "=== Section n ===" block
+            analysis = [summarize_locally(section) for section in sections[1:]]
+        elif "refine" in prompt:
+            analysis = refine_locally(text)
+        else:
+            analysis = summarize_locally(text)
+        content = json.dumps(analysis)
+        if "refine" not in prompt:
+            # Chunk prompts are answered the way the hosted model usually does: inside a code fence
+            content = f"```\n{content}\n```"
+        with self._lock:
+            mangle = self._random.random() < self.malformed_rate and self._random.choice(("prose", "fence", "truncate"))
+        if mangle == "prose":
+            content = f"Here is the analysis you asked for:\n{json.dumps(analysis)}\nLet me know if you need more."
+        elif mangle == "fence":
+            content = f"```json\n{json.dumps(analysis)}\n```"
+        elif mangle == "truncate":
+            content = content[:len(content) // 3]
+        if self.latency:
+            time.sleep(self.latency)
+        usage = SimpleNamespace(
+            prompt_tokens=max(1, len(prompt) // 4),
+            completion_tokens=max(1, len(content) // 4),
+        )
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.completion_tokens += usage.completion_tokens
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+            model=model,
+        )
+
+
+def summarize_locally(text, max_summary_length=300):
+    """Cheap deterministic analysis of `text` in the same JSON shape the prompts ask for."""
+    sentences = re.split(r"(?<=[.!?])\s+", " ".join(text.split()))
+    summary = ""
+    for sentence in sentences:
+        if len(summary) + len(sentence) > max_summary_length:
+            break
+        summary = f"{summary} {sentence}".strip()
+    if not summary:
+        summary = " ".join(text.split())[:max_summary_length]
+    names = Counter(
+        word for word in re.findall(r"\b[A-Z][a-z]{2,}\b", text) if word not in _COMMON_CAPITALISED
+    )
+    words = Counter(word for word in re.findall(r"\b[a-z]{7,}\b", text.lower()))
+    return {
+        "summary": summary,
+        "sentiment": "neutral",
+        "language": "English",
+        "key_characters": [name for name, _ in names.most_common(5)],
+        "themes": [word for word, _ in words.most_common(3)],
+    }
+
+
+def refine_locally(text):
+    """Consolidates merged analyses (the str() of a dict, as process_final_analysis sends them)."""
+    try:
+        merged = ast.literal_eval(text.strip())
+    except (ValueError, SyntaxError):
+        merged = None
+    if not isinstance(merged, dict):
+        return summarize_locally(text)
+    analysis = summarize_locally(str(merged.get("summary", "")))
+    for key in ("sentiment", "language"):
+        words = str(merged.get(key, "")).split()
+        if words:
+            analysis[key] = words[0]
+    for key, limit in (("key_characters", 10), ("themes", 10)):
+        if isinstance(merged.get(key), list):
+            analysis[key] = merged[key][:limit]
+    return analysis
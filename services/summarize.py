@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .db import connection
+from .operations import (
+    iter_chunks, iter_chapter_chunk_spans, process_raw_analysis, process_final_analysis, parse_analysis_responses,
+    merge_parsed_responses, estimate_tokens, build_final_prompt, CHARS_PER_TOKEN, CHUNK_PROMPT_VERSION,
+    FINAL_PROMPT_VERSION,
+)
+from .llm_backends import as_backend
+from .editions import save_chunk_analyses
+from .metrics import log, traced
+
+# Full-coverage map-reduce settings
+MAP_CHUNK_LENGTH = 5000
+REDUCE_TOKEN_BUDGET = int(os.getenv("REDUCE_TOKEN_BUDGET", "6000"))  # max input tokens per reduce prompt
+REDUCE_FAN_IN = int(os.getenv("REDUCE_FAN_IN", "8"))                 # max partial results per reduce prompt
+MAX_LIST_ITEMS = 25
+
+
+def _run_key(text, models, chunk_length, token_budget, fan_in, chapters=None):
+    """Identifies a map-reduce run so checkpoints are only reused for the same text, models and settings."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        [models, CHUNK_PROMPT_VERSION, FINAL_PROMPT_VERSION, chunk_length, token_budget, fan_in,
+         [chapter["start"] for chapter in chapters or []]]
+    ).encode("utf-8"))
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_checkpoint(book_id, run_key):
+    """Returns (level, partial results) of the last finished level, or (None, None)."""
+    with connection() as conn:
+        row = conn.execute(
+            """
+            SELECT level, results FROM analysis_checkpoints
+            WHERE book_id = ? AND run_key = ? ORDER BY level DESC LIMIT 1
+            """,
+            (str(book_id), run_key),
+        ).fetchone()
+    if row is None:
+        return None, None
+    return row["level"], json.loads(row["results"])
+
+
+def save_checkpoint(book_id, run_key, level, results):
+    with connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO analysis_checkpoints (book_id, run_key, level, results) VALUES (?, ?, ?, ?)",
+            (str(book_id), run_key, level, json.dumps(results)),
+        )
+
+
+def clear_checkpoints(book_id):
+    with connection() as conn:
+        conn.execute("DELETE FROM analysis_checkpoints WHERE book_id = ?", (str(book_id),))
+
+
+def fit_partial(partial, max_tokens):
+    """
+    Shrinks one partial analysis until it fits in max_tokens: lists are cut to MAX_LIST_ITEMS,
+    then the summary is shortened, then the lists are halved (down to one item each).
+    """
+    partial = {
+        key: value[:MAX_LIST_ITEMS] if isinstance(value, list) else value
+        for key, value in partial.items()
+    }
+    size = estimate_tokens(json.dumps(partial))
+    summary = str(partial.get("summary", ""))
+    if size > max_tokens and summary:
+        keep = max(0, len(summary) - (size - max_tokens) * CHARS_PER_TOKEN)
+        partial["summary"] = summary[:keep]
+        size = estimate_tokens(json.dumps(partial))
+    while size > max_tokens and any(isinstance(value, list) and len(value) > 1 for value in partial.values()):
+        partial = {
+            key: value[:max(1, len(value) // 2)] if isinstance(value, list) else value
+            for key, value in partial.items()
+        }
+        size = estimate_tokens(json.dumps(partial))
+    return partial
+
+
+def group_for_reduce(partials, token_budget, fan_in):
+    """
+    Splits partial results into consecutive groups of at most `fan_in` items whose combined
+    size stays within `token_budget`, preserving book order.
+
+    If no two partials fit together (each is over half the budget even after fit_partial),
+    they are paired anyway, so every reduce level at least halves their number.
+    """
+    groups, current, size = [], [], 0
+    for partial in partials:
+        cost = estimate_tokens(json.dumps(partial))
+        if current and (len(current) >= fan_in or size + cost > token_budget):
+            groups.append(current)
+            current, size = [], 0
+        current.append(partial)
+        size += cost
+    if current:
+        groups.append(current)
+    if len(partials) > 1 and len(groups) == len(partials):
+        groups = [partials[index:index + 2] for index in range(0, len(partials), 2)]
+    return groups
+
+
+def reduce_input_budget(token_budget):
+    """Tokens of a reduce prompt left for the partial results once its instructions are counted."""
+    return max(1, token_budget - estimate_tokens(build_final_prompt("")))
+
+
+def reduce_group(client, group, token_budget, usage=None):
+    """Merges a group of partial analyses with one process_final_analysis call."""
+    merged = merge_parsed_responses(group)
+    # process_final_analysis falls back to the mechanical merge if the model's answer is unusable
+    return fit_partial(process_final_analysis(merged, client, usage=usage), token_budget // 2)
+
+
+def summarize_book(book_id, text, client, token_budget=None, fan_in=None, chunk_length=MAP_CHUNK_LENGTH,
+                   max_workers=None, timings=None, usage=None, reduce_client=None, progress=None, chapters=None,
+                   known_results=None):
+    """
+    Full-coverage analysis: summarise every chunk, then reduce the summaries in a tree.
+
+    Each reduce level groups at most `fan_in` partial results per prompt and never more than
+    `token_budget` estimated tokens including the prompt's instructions, so no prompt overflows the context window however long
+    the book is. Every finished level is saved in analysis_checkpoints; a run that fails part
+    way through resumes from the last finished level (and the llm_cache makes repeated chunk
+    or group calls free).
+
+    Parameters:
+    book_id (str): The unique identifier of the eBook.
+    text (str): Full text of the book.
+    client: LLM backend for the chunk summaries (see services.llm_backends.get_llm_backend).
+    token_budget (int, optional): Max input tokens per reduce prompt. Defaults to REDUCE_TOKEN_BUDGET.
+    fan_in (int, optional): Max partial results per reduce prompt. Defaults to REDUCE_FAN_IN.
+    chunk_length (int): Map chunk size in characters.
+    max_workers (int, optional): Concurrency cap for map and reduce calls.
+    timings (dict, optional): Filled with "map" and "reduce" seconds.
+    usage (TokenUsage, optional): Receives request and token counts.
+    reduce_client (optional): Backend for the reduce levels. Defaults to `client`.
+    progress (AnalysisProgress, optional): Receives stage changes and every chunk result.
+    chapters (list, optional): Chapter offsets from read_clean_text; chunks then never cross a chapter.
+    known_results (dict, optional): Chunk analyses of a near-duplicate edition by chunk_fingerprint;
+                                    only the chunks not found there are sent to the LLM.
+
+    Returns:
+    dict: The final analysis (summary, sentiment, language, key_characters, themes).
+
+    Raises:
+    ValueError: If no usable analysis was produced for any chunk.
+    """
+    token_budget = token_budget or REDUCE_TOKEN_BUDGET
+    fan_in = max(2, fan_in or REDUCE_FAN_IN)
+    if timings is None:
+        timings = {}
+    client = as_backend(client)
+    reduce_client = as_backend(reduce_client or client)
+    run_key = _run_key(text, [client.model, reduce_client.model], chunk_length, token_budget, fan_in, chapters)
+    input_budget = reduce_input_budget(token_budget)
+
+    started = time.perf_counter()
+    level, partials = load_checkpoint(book_id, run_key)
+    if level is None:
+        if chapters:
+            chunks = [text[start:end] for start, end in iter_chapter_chunk_spans(text, chapters, chunk_length)]
+        else:
+            chunks = list(iter_chunks(text, chunk_length))
+        if progress is not None:
+            progress.stage("map", chunks_total=len(chunks))
+        responses = process_raw_analysis(
+            client, chunks, max_workers=max_workers, usage=usage,
+            on_result=progress.chunk_results if progress is not None else None, known_results=known_results
+        )
+        save_chunk_analyses(book_id, chunks, responses)
+        partials = [fit_partial(parsed, input_budget // 2) for parsed in parse_analysis_responses(responses)]
+        level = 0
+        save_checkpoint(book_id, run_key, level, partials)
+    else:
+        log(f"Resuming analysis of book_id={book_id} from level {level} ({len(partials)} partial results)")
+    timings["map"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if progress is not None:
+        progress.stage("reduce")
+    workers = max_workers or int(os.getenv("LLM_MAX_CONCURRENCY", "10"))
+    # Always run at least one reduce so the output is the refined, deduplicated shape
+    while len(partials) > 1 or (level == 0 and partials):
+        groups = group_for_reduce(partials, input_budget, fan_in)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as executor:
+            partials = list(executor.map(traced(lambda group: reduce_group(reduce_client, group, input_budget, usage)), groups))
+        level += 1
+        save_checkpoint(book_id, run_key, level, partials)
+    timings["reduce"] = time.perf_counter() - started
+
+    if not partials:
+        raise ValueError("No usable analysis was produced for any chunk")
+    clear_checkpoints(book_id)
+    return partials[0]
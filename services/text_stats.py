@@ -0,0 +1,188 @@
+import json
+import math
+import re
+from collections import Counter
+from .db import connection
+
+WORDS_PER_MINUTE = 238
+MAX_CHARACTERS = 10
+MAX_KEYWORDS = 10
+MIN_NAME_COUNT = 5
+
+_WORD = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+_SENTENCE_END = re.compile(r"[.!?]+[\"'”’)\]]*(?=\s|$)")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\r?\n\s*")
+
+# Most frequent function words per language; the language whose words cover most tokens wins
+STOPWORDS = {
+    "English": {"the", "and", "of", "to", "a", "in", "that", "is", "was", "he", "it", "for", "with", "as",
+                "his", "on", "be", "at", "by", "had", "not", "are", "but", "from", "or", "have", "she", "they",
+                "which", "you", "were", "her", "all", "this", "their", "would", "there", "been", "one",
+                "so", "if", "my", "me", "an", "we", "him", "what", "when", "who", "them", "no", "said", "i",
+                "upon", "could", "into", "about", "through", "before", "after", "toward", "should", "than",
+                "only", "very", "some", "more", "these", "those", "other", "over", "such", "then", "your"},
+    "French": {"le", "la", "les", "de", "des", "et", "un", "une", "du", "est", "que", "qui", "dans", "pour",
+               "pas", "au", "il", "elle", "ne", "se", "sur", "avec", "son", "sa", "ses", "je", "vous", "nous"},
+    "German": {"der", "die", "das", "und", "den", "von", "zu", "mit", "ist", "des", "sich", "nicht", "auf",
+               "ein", "eine", "dem", "er", "sie", "es", "auch", "als", "wie", "ich", "aber", "noch", "nach"},
+    "Spanish": {"el", "la", "los", "las", "de", "y", "que", "en", "un", "una", "por", "con", "para", "del",
+                "se", "no", "su", "al", "lo", "como", "más", "pero", "sus", "le", "ya", "o", "fue", "este"},
+    "Italian": {"il", "di", "che", "e", "la", "per", "un", "una", "non", "in", "del", "della", "si", "le",
+                "con", "lo", "da", "sono", "ma", "gli", "alla", "anche", "come", "io", "questo", "era"},
+    "Portuguese": {"o", "a", "os", "as", "de", "do", "da", "dos", "das", "e", "que", "em", "um", "uma", "para",
+                   "com", "não", "por", "se", "na", "no", "mais", "ao", "ele", "ela", "foi", "seu", "sua"},
+    "Dutch": {"de", "het", "een", "en", "van", "in", "is", "dat", "op", "te", "zijn", "met", "voor", "niet",
+              "die", "aan", "er", "maar", "om", "ook", "als", "bij", "hij", "zij", "ik", "was", "werd"},
+}
+_ALL_STOPWORDS = set().union(*STOPWORDS.values())
+# Stopwords of one language only; shared ones ("de", "la", "in") say nothing about which language it is
+_UNIQUE_STOPWORDS = {
+    language: words - set().union(*(other for name, other in STOPWORDS.items() if name != language))
+    for language, words in STOPWORDS.items()
+}
+# Capitalised words that are rarely names in Gutenberg texts
+_NOT_NAMES = {
+    "project", "gutenberg", "ebook", "ebooks", "chapter", "book", "volume", "part", "illustration",
+    "mr", "mrs", "miss", "sir", "lord", "lady", "god", "oh", "yes", "well", "now", "then", "here",
+    "there", "why", "how", "where", "what", "yet", "still", "perhaps", "thus", "indeed", "english",
+}
+# Stems of contractions such as "I've" or "You'll", which are capitalised as often as names
+_PRONOUNS = {"i", "you", "he", "she", "it", "we", "they", "thou", "ye", "who", "that", "there", "here"}
+_APOSTROPHE = re.compile("['’]")
+
+
+def _is_contraction(word):
+    """Whether a word has an apostrophe followed by a lowercase suffix ("I'm", "L'aimé") or a pronoun stem."""
+    stem, *suffixes = _APOSTROPHE.split(word)
+    return bool(suffixes) and (stem.lower() in _PRONOUNS or any(suffix[:1].islower() for suffix in suffixes))
+
+
+def detect_language(counts, total_words):
+    """
+    Guesses the language from word counts by stopword coverage.
+
+    The confidence is the winner's share of the stopwords unique to one language, so function
+    words several languages share (French and Spanish "de", "la", "que") do not dilute it.
+
+    Returns:
+    tuple: (language name or "Unknown", confidence between 0 and 1)
+    """
+    if not total_words:
+        return "Unknown", 0.0
+    scores = {
+        language: sum(counts.get(word, 0) for word in words)
+        for language, words in STOPWORDS.items()
+    }
+    language, best = max(scores.items(), key=lambda item: item[1])
+    # Real prose has a large share of function words; lists and tables do not
+    if best / total_words < 0.05:
+        return "Unknown", 0.0
+    unique = {
+        name: sum(counts.get(word, 0) for word in words)
+        for name, words in _UNIQUE_STOPWORDS.items()
+    }
+    total = sum(unique.values())
+    return language, round(unique[language] / total, 3) if total else 0.0
+
+
+def compute_text_stats(text):
+    """
+    Computes deterministic statistics of a book's text without any LLM call.
+
+    The text is tokenised once; everything else is derived from the resulting Counter, whose
+    size is the vocabulary rather than the book.
+
+    Parameters:
+    text (str): Full text of the book.
+
+    Returns:
+    dict: {"characters", "words", "unique_words", "sentences", "paragraphs", "avg_word_length",
+           "avg_sentence_length", "type_token_ratio", "root_ttr", "reading_time_minutes",
+           "language", "language_confidence", "candidate_characters", "keywords"}
+    """
+    cased = Counter(_WORD.findall(text))
+    words = sum(cased.values())
+    lower = Counter()
+    for word, count in cased.items():
+        lower[word.lower()] += count
+    sentences = len(_SENTENCE_END.findall(text)) or (1 if words else 0)
+    paragraphs = len(_PARAGRAPH_BREAK.findall(text.strip())) + 1 if text.strip() else 0
+    letters = sum(len(word) * count for word, count in lower.items())
+    language, confidence = detect_language(lower, words)
+
+    # A name is capitalised nearly every time it appears, and is neither a function word nor a contraction
+    names = Counter()
+    for word, count in cased.items():
+        key = word.lower()
+        if (count >= MIN_NAME_COUNT and len(word) > 2 and word[0].isupper() and not word.isupper()
+                and key not in _ALL_STOPWORDS and key not in _NOT_NAMES and count >= 0.9 * lower[key]
+                and not _is_contraction(word)):
+            names[word] = count
+    keywords = Counter({
+        word: count for word, count in lower.items()
+        if len(word) > 3 and word not in _ALL_STOPWORDS and word not in _NOT_NAMES and word.capitalize() not in names
+    })
+
+    return {
+        "characters": len(text),
+        "words": words,
+        "unique_words": len(lower),
+        "sentences": sentences,
+        "paragraphs": paragraphs,
+        "avg_word_length": round(letters / words, 2) if words else 0.0,
+        "avg_sentence_length": round(words / sentences, 2) if sentences else 0.0,
+        "type_token_ratio": round(len(lower) / words, 4) if words else 0.0,
+        "root_ttr": round(len(lower) / math.sqrt(words), 2) if words else 0.0,  # length-robust richness
+        "reading_time_minutes": round(words / WORDS_PER_MINUTE, 1),
+        "language": language,
+        "language_confidence": confidence,
+        "candidate_characters": [name for name, _ in names.most_common(MAX_CHARACTERS)],
+        "keywords": [word for word, _ in keywords.most_common(MAX_KEYWORDS)],
+    }
+
+
+def save_text_stats(book_id, stats):
+    with connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO text_stats (book_id, stats, computed_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (str(book_id), json.dumps(stats)),
+        )
+
+
+def load_text_stats(book_id):
+    """Returns the stored statistics of a book, or None."""
+    with connection() as conn:
+        row = conn.execute("SELECT stats FROM text_stats WHERE book_id = ?", (str(book_id),)).fetchone()
+    return json.loads(row["stats"]) if row else None
+
+
+def text_stats_to_html(stats):
+    """Renders text statistics as a Tailwind fragment in the style of the /analyze cards."""
+    rows = [
+        ("🔤 Words", f"{stats['words']:,} ({stats['unique_words']:,} distinct)"),
+        ("🧾 Sentences / Paragraphs", f"{stats['sentences']:,} / {stats['paragraphs']:,}"),
+        ("📏 Avg. word / sentence length", f"{stats['avg_word_length']} letters / {stats['avg_sentence_length']} words"),
+        ("📚 Vocabulary richness", f"TTR {stats['type_token_ratio']}, root TTR {stats['root_ttr']}"),
+        ("⏱️ Reading time", f"{stats['reading_time_minutes']} minutes"),
+        ("🌎 Language", f"{stats['language']} ({stats['language_confidence']:.0%} confidence)"),
+    ]
+    cells = "".join(
+        f"""
+            <div class="font-semibold text-gray-600">{label}:</div>
+            <div class="text-gray-800">{value}</div>
+        """ for label, value in rows
+    )
+    names = ", ".join(f"<span class='px-2 py-1 bg-gray-200 rounded-lg'>{name}</span>" for name in stats["candidate_characters"])
+    keywords = ", ".join(f"<span class='px-2 py-1 bg-blue-200 rounded-lg'>{word}</span>" for word in stats["keywords"])
+    return f"""
+    <div class="max-w-3xl w-full bg-white">
+        <h2 class="text-2xl font-bold text-gray-800 mb-4">📈 Text Statistics</h2>
+        <div class="grid grid-cols-1 md:grid-cols-2 gap-4">{cells}
+            <div class="font-semibold text-gray-600">🎭 Candidate Characters:</div>
+            <div class="flex flex-wrap gap-2">{names}</div>
+
+            <div class="font-semibold text-gray-600">🔑 Keywords:</div>
+            <div class="flex flex-wrap gap-2">{keywords}</div>
+        </div>
+    </div>
+    """
@@ -0,0 +1,135 @@
+import os
+import random
+import threading
+import time
+import httpx
+import requests
+from groq import APIConnectionError, APITimeoutError
+from .metrics import log
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills continuously up to `per_minute` tokens.
+
+    Parameters:
+    per_minute (int): Bucket capacity and refill rate per minute. 0 disables throttling.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Block until `amount` tokens are available, then take them."""
+        if self.capacity <= 0:
+            return
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Combines a requests-per-minute and a tokens-per-minute bucket for one provider.
+
+    Parameters:
+    rpm (int): Requests allowed per minute (0 = unlimited).
+    tpm (int): Tokens allowed per minute (0 = unlimited).
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, tokens=0):
+        self.requests.acquire(1)
+        if tokens:
+            self.tokens.acquire(tokens)
+
+
+# Shared across every analysis thread so concurrent books stay inside one quota.
+_rate_limiter = RateLimiter(
+    rpm=int(os.getenv("LLM_RPM_LIMIT", "30")),
+    tpm=int(os.getenv("LLM_TPM_LIMIT", "0")),
+)
+
+
+def get_rate_limiter():
+    return _rate_limiter
+
+
+# Failures before any HTTP status arrived: refused or dropped connections and timeouts of the
+# requests-based backends (openai, stub server), httpx and the Groq SDK
+_TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,  # includes ConnectTimeout
+    requests.exceptions.Timeout,          # includes ReadTimeout
+    httpx.TransportError,
+    APIConnectionError,
+    APITimeoutError,
+)
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """Returns True for rate limits (429), server errors (5xx) and connection failures."""
+    status = _status_code(error)
+    if status is None:
+        return isinstance(error, _TRANSIENT_ERRORS)
+    return status == 429 or status >= 500
+
+
+def call_with_retry(func, retries=None, base_delay=1.0, max_delay=30.0):
+    """
+    Calls `func()` and retries retryable failures with full-jitter exponential backoff.
+
+    Parameters:
+    func (callable): Zero-argument callable performing the request.
+    retries (int, optional): Maximum number of retries. Defaults to LLM_MAX_RETRIES or 5.
+    base_delay (float): Initial backoff in seconds.
+    max_delay (float): Upper bound for a single backoff in seconds.
+
+    Returns:
+    The return value of `func()`. The last error is re-raised once retries are exhausted.
+    """
+    if retries is None:
+        retries = int(os.getenv("LLM_MAX_RETRIES", "5"))
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            log(f"LLM call failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import db
+from services.operations import create_database
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh, fully migrated database.db in a temporary working directory (uploads/ and store/ land there too)."""
+    monkeypatch.chdir(tmp_path)
+    previous = db.DATABASE_PATH
+    db.set_database_path(str(tmp_path / "database.db"))
+    create_database()
+    yield tmp_path / "database.db"
+    db.set_database_path(previous)
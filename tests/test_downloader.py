@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import pytest
+import requests
+from services.downloader import download_file, download_file_async
+
+BODY = ("It was the best of times, it was the worst of times.\n" * 2000).encode("utf-8")
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves BODY at /book.txt with an ETag, conditional GETs and byte ranges; everything else is 404."""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path != "/book.txt":
+            self._reply(404)
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self._reply(304)
+            return
+        requested = self.headers.get("Range")
+        if requested and self.headers.get("If-Range", ETAG) == ETAG:
+            start = int(requested.split("=")[1].split("-")[0])
+            if start >= len(BODY):
+                self._reply(416, headers={"Content-Range": f"bytes */{len(BODY)}"})
+                return
+            self._reply(206, BODY[start:], {"Content-Range": f"bytes {start}-{len(BODY) - 1}/{len(BODY)}"})
+            return
+        self._reply(200, BODY)
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.requests = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def session():
+    with requests.Session() as session:
+        yield session
+
+
+def _leftovers(path):
+    return [name for name in (path + ".part", path + ".part.json") if os.path.exists(name)]
+
+
+def _start_part(server, path, size):
+    """Leaves an interrupted download of the first `size` bytes, as a killed download would."""
+    with open(path + ".part", "wb") as file:
+        file.write(BODY[:size])
+    with open(path + ".part.json", "w", encoding="utf-8") as file:
+        json.dump({"url": server.url + "/book.txt", "etag": ETAG, "last_modified": None}, file)
+
+
+def test_download_then_not_modified(server, session, tmp_path):
+    path = str(tmp_path / "book.txt")
+    urls = [server.url + "/missing.txt", server.url + "/book.txt"]
+
+    result = download_file(urls, path, session=session)
+    assert result == {"status": "downloaded", "url": server.url + "/book.txt", "bytes": len(BODY)}
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert _leftovers(path) == []
+
+    # The second time only the URL that worked is asked, conditionally (the losing candidate of
+    # the first download may still be logged late, as it is not waited for)
+    server.requests.clear()
+    assert download_file(urls, path, session=session)["status"] == "not_modified"
+    conditional = [(url, headers.get("If-None-Match")) for url, headers in server.requests if url == "/book.txt"]
+    assert conditional == [("/book.txt", ETAG)]
+
+
+def test_interrupted_download_resumes_with_range(server, session, tmp_path):
+    path = str(tmp_path / "book.txt")
+    _start_part(server, path, 10000)
+
+    result = download_file([server.url + "/book.txt"], path, session=session)
+    assert result["status"] == "resumed"
+    assert server.requests[0][1]["Range"] == "bytes=10000-"
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert _leftovers(path) == []
+
+
+def test_rejected_range_restarts_the_download(server, session, tmp_path):
+    path = str(tmp_path / "book.txt")
+    # A complete .part that was never moved into place: the server answers the Range with 416
+    _start_part(server, path, len(BODY))
+    with open(path + ".part", "ab") as file:
+        file.write(b"stale")
+
+    result = download_file([server.url + "/book.txt"], path, session=session)
+    assert result["status"] == "downloaded"
+    assert ["Range" in headers for _, headers in server.requests] == [True, False]
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert _leftovers(path) == []
+
+
+def test_failed_download_keeps_the_existing_file(server, session, tmp_path):
+    path = str(tmp_path / "book.txt")
+    with open(path, "wb") as file:
+        file.write(b"previous copy")
+
+    with pytest.raises(requests.HTTPError):
+        download_file([server.url + "/missing.txt"], path, session=session)
+    with open(path, "rb") as file:
+        assert file.read() == b"previous copy"
+    assert _leftovers(path) == []
+
+
+def test_async_download_resumes_and_revalidates(server, tmp_path):
+    path = str(tmp_path / "book.txt")
+    _start_part(server, path, 5000)
+
+    async def download():
+        async with httpx.AsyncClient() as client:
+            first = await download_file_async([server.url + "/book.txt"], path, client=client)
+            second = await download_file_async([server.url + "/book.txt"], path, client=client)
+        return first, second
+
+    first, second = asyncio.run(download())
+    assert (first["status"], second["status"]) == ("resumed", "not_modified")
+    with open(path, "rb") as file:
+        assert file.read() == BODY
+    assert _leftovers(path) == []
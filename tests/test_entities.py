@@ -0,0 +1,33 @@
+from services.entities import canonical_entities, entity_key
+
+
+def test_entity_key():
+    assert entity_key("Dian's") == "dian"
+    assert entity_key("  Élisabeth   BENNET. ") == "elisabeth bennet"
+
+
+def test_spellings_are_merged_under_the_most_used_one():
+    lists = [["Elizabeth Bennet", "Mr. Darcy"], ["Elisabeth Bennet"], ["elizabeth bennet", "Mr. Darcy"], ["Mr Darcy"]]
+    assert canonical_entities(lists, names=True) == ["Elizabeth Bennet", "Mr. Darcy"]
+
+
+def test_ranked_by_chunks_then_first_appearance():
+    lists = [["Ghak", "Perry"], ["Dian", "Perry"], ["Dian", "Perry", "Hooja"]]
+    assert canonical_entities(lists, names=True) == ["Perry", "Dian", "Ghak", "Hooja"]
+
+
+def test_prefixes_of_names_are_different_people():
+    assert canonical_entities([["Julia"], ["Julian"], ["Julia"]], names=True) == ["Julia", "Julian"]
+    # ...while themes merge plurals and close spellings
+    assert canonical_entities([["friendship"], ["friendships"], ["friendship"]]) == ["friendship"]
+
+
+def test_partial_name_joins_its_only_longer_name():
+    lists = [["Dian the Beautiful"], ["Dian"], ["Dian", "David Innes"]]
+    assert canonical_entities(lists, names=True) == ["Dian", "David Innes"]
+
+
+def test_empty_and_limited():
+    assert canonical_entities([]) == []
+    assert canonical_entities([None, [], ["", "  "]]) == []
+    assert canonical_entities([["a1", "b2", "c3", "d4"]], max_entities=2) == ["a1", "b2"]
@@ -0,0 +1,45 @@
+from services.db import connection
+from services.jobs import enqueue_analysis, claim_next_job, finish_job
+from services.operations import insert_ebook, update_ebook_data
+
+
+def _jobs(book_id):
+    with connection() as conn:
+        return [dict(row) for row in conn.execute(
+            "SELECT id, status FROM analysis_jobs WHERE book_id = ? ORDER BY id", (book_id,)
+        )]
+
+
+def test_enqueue_is_single_flight(database):
+    first = enqueue_analysis("1342", "uploads/1342.txt")
+    second = enqueue_analysis("1342", "uploads/1342.txt")
+    assert first == {"job_id": first["job_id"], "status": "queued", "created": True}
+    assert second == {"job_id": first["job_id"], "status": "queued", "created": False}
+
+    # A running job is reused too
+    assert claim_next_job()["id"] == first["job_id"]
+    assert enqueue_analysis("1342") == {"job_id": first["job_id"], "status": "running", "created": False}
+    assert len(_jobs("1342")) == 1
+
+
+def test_completed_analysis_is_not_queued(database):
+    insert_ebook("11")
+    update_ebook_data("11", "A summary", "positive", "English", ["Alice"], ["curiosity"], "Analysis Completed")
+    assert enqueue_analysis("11") == {"job_id": None, "status": "Analysis Completed", "created": False}
+    assert _jobs("11") == []
+
+
+def test_failed_analysis_is_queued_again(database):
+    insert_ebook("84")
+    job = enqueue_analysis("84")
+    claim_next_job()
+    update_ebook_data("84", "", "", "", "", "", "Analysis Failed")
+    finish_job(job["job_id"], "failed", {}, error="boom")
+
+    retry = enqueue_analysis("84")
+    assert retry["created"] is True
+    assert retry["job_id"] != job["job_id"]
+    assert [row["status"] for row in _jobs("84")] == ["failed", "queued"]
+    with connection() as conn:
+        # process_analysis only runs analyses that are 'In Progress'
+        assert conn.execute("SELECT status FROM ebook_analysis WHERE ebook_id = 84").fetchone()[0] == "In Progress"
@@ -0,0 +1,54 @@
+from services.llm_json import parse_json_response, validate_analysis
+
+ANALYSIS = {"summary": "A girl falls down a rabbit hole.", "sentiment": "positive", "language": "English",
+            "key_characters": ["Alice", "the White Rabbit"], "themes": ["curiosity", "growing up"]}
+BARE = (
+    '{"summary": "A girl falls down a rabbit hole.", "sentiment": "positive", "language": "English", '
+    '"key_characters": ["Alice", "the White Rabbit"], "themes": ["curiosity", "growing up"]}'
+)
+
+
+def test_bare_json():
+    assert parse_json_response(BARE) == ANALYSIS
+
+
+def test_fenced_json():
+    assert parse_json_response("```json\n" + BARE + "\n```") == ANALYSIS
+    assert parse_json_response("```\n" + BARE + "\n```") == ANALYSIS
+
+
+def test_prose_wrapped_json():
+    response = "Sure! Here is the analysis you asked for:\n\n" + BARE + "\n\nLet me know if you need anything else."
+    assert parse_json_response(response) == ANALYSIS
+
+
+def test_trailing_comma():
+    assert parse_json_response('{"themes": ["war", "peace",],}') == {"themes": ["war", "peace"]}
+
+
+def test_truncated_json():
+    # Cut off inside the last string: what was complete is kept
+    value = parse_json_response(BARE[:BARE.index("growing") + 4])
+    assert value["summary"] == ANALYSIS["summary"]
+    assert value["key_characters"] == ANALYSIS["key_characters"]
+    assert value["themes"][0] == "curiosity"
+
+    # Cut off right after a key
+    value = parse_json_response('{"summary": "Short.", "themes": ["war"], "language":')
+    assert value == {"summary": "Short.", "themes": ["war"]}
+
+
+def test_unusable_responses():
+    assert parse_json_response("") is None
+    assert parse_json_response(None) is None
+    assert parse_json_response("I could not analyse this text.") is None
+    assert parse_json_response('"just a string"') is None
+
+
+def test_validate_analysis_normalises_fields():
+    value = validate_analysis({"summary": ["One.", "Two."], "themes": "war, peace", "extra": 1})
+    assert value["summary"] == "One. Two."
+    assert value["themes"] == ["war", "peace"]
+    assert value["key_characters"] == []
+    assert "extra" not in value
+    assert validate_analysis({"summary": "  ", "themes": ["war"]}) is None
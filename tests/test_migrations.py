@@ -0,0 +1,33 @@
+from services.db import connection
+from services.operations import MIGRATIONS, create_database
+
+
+def _schema():
+    with connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        objects = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+    return version, [tuple(row) for row in objects]
+
+
+def test_migrations_run_once(database):
+    version, objects = _schema()
+    assert version == MIGRATIONS[-1][0]
+    names = {name for _, name, _ in objects}
+    assert {"ebook_analysis", "ebooks", "analysis_jobs", "llm_cache", "book_search", "edition_bands"} <= names
+
+    # A second start applies nothing and leaves the schema as it was
+    create_database()
+    assert _schema() == (version, objects)
+
+
+def test_migrations_keep_rows(database):
+    with connection() as conn:
+        conn.execute("INSERT INTO ebook_analysis (ebook_id, status) VALUES (1342, 'In Progress')")
+    create_database()
+    with connection() as conn:
+        assert conn.execute("SELECT status FROM ebook_analysis WHERE ebook_id = 1342").fetchone()[0] == "In Progress"
+
+
+def test_versions_are_ascending():
+    versions = [version for version, _ in MIGRATIONS]
+    assert versions == list(range(1, len(MIGRATIONS) + 1))